@@ -85,156 +85,140 @@ class GLOBIO_CalcAquaticAAPFD(CalculationBase):
     MON.showMemDiskUsage(Log,"- ","",self.outDir)
 
     #-----------------------------------------------------------------------------
-    # Read the fractions rasters, prepare and select.
+    # Open the fractions and month rasters.
     #-----------------------------------------------------------------------------
 
-    # Create a list with the fraction rasters.
-    fracRasterNames = [rivFractionsRasterName,floodFractionsRasterName]
-    fracDescriptions = ["river","floodplain"]
-    
-    fracMask = None    
-    for i in range(len(fracRasterNames)):
-      fracRasterName = fracRasterNames[i]
-      fracDescription = fracDescriptions[i]
-
-      # Reads the raster and resizes to extent and resamples to cellsize.
-      fracRaster = self.readAndPrepareInRaster(extent,cellSize,fracRasterName,fracDescription+" fractions")
-
-      # Create the mask. Select fraction > 0.0.
-      tmpMask = (fracRaster.r > 0.0)
-
-      # Select all cells where river/floodplain fractions are. Extend mask.
-      if fracMask is None:
-        fracMask = tmpMask
-      else:
-        fracMask = np.logical_or(fracMask,tmpMask)
-        
-      # Close and free the fractions raster.
-      fracRaster.close()
-      fracRaster = None
-
-      # Cleanup mask.
-      tmpMask = None
-
-    #-----------------------------------------------------------------------------
-    # Create output raster.
-    #-----------------------------------------------------------------------------
-
-    # Create AAPFD raster.
-    # Initialize with 0.0.
-    Log.info("Creating AAPFD raster...")
-    noDataValue = -999.0
-    outRaster = Raster(outRasterName)
-    outRaster.initRaster(extent,cellSize,np.float32,noDataValue,0.0)
-
-    #-----------------------------------------------------------------------------
-    # Process month reference raster to create mean year reference raster
-    #-----------------------------------------------------------------------------
-    # Create Reference annual mean raster
-    refMeanRaster = Raster()
-    refMeanRaster.initRaster(extent,cellSize,np.float32,noDataValue,0.0)
-    refMonthCntRaster = Raster()
-    refMonthCntRaster.initRaster(extent,cellSize,np.int16,noDataValue,0)
-
-    #refMeanRaster = 5.0
-    
-    for i in range(len(refStreamflowMonthsRasterNames)):
-      # Set raster names.
-      refRasterName = refStreamflowMonthsRasterNames[i]
-
-      # Reads the raster and resizes to extent and resamples to cellsize.
-      refRaster = self.readAndPrepareInRaster(extent,cellSize,refRasterName,"reference streamflow")
-
-      # Select valid data.
-      dataMask = refRaster.getDataMask()
-      
-      # Select mean > 0.0.
-      dataMask = np.logical_and(dataMask,refRaster.r > 0.0) 
-
-      refMeanRaster.r[dataMask] = refMeanRaster.r[dataMask] + refRaster.r[dataMask]
-      refMonthCntRaster.r[dataMask] += 1
-      #refMeanRaster.r[dataMask] = refMeanRaster.r[dataMask] + refRaster.r[dataMask]
-      #refMeanRaster.r += 5.0
-
-      # Clear mask.
-      dataMask = None
-
-      # Close and free the rasters.
-      refRaster.close()
-      refRaster = None
-
-    # Calculate mean year reference raster, divide by number of months with valid data
-    # Select valid data.
-    #dataMask = refRaster.getDataMask()
-      
-    # Select mean > 0.0.
-    dataMask = (refMonthCntRaster.r > 0.0) 
-
-    refMeanRaster.r[dataMask] = refMeanRaster.r[dataMask] / refMonthCntRaster.r[dataMask]
-
-    #-----------------------------------------------------------------------------
-    # Process month rasters.
-    #-----------------------------------------------------------------------------
-
-    # Process month rasters.
-    for i in range(len(scenStreamflowMonthsRasterNames)):
-      # Set raster names.
-      scenRasterName = scenStreamflowMonthsRasterNames[i]
-      refRasterName = refStreamflowMonthsRasterNames[i]
-      #refMeanRasterName = refStreamflowMonthsMeanRasterNames[i]
-      
-      # Reads the raster and resizes to extent and resamples to cellsize.
-      scenRaster = self.readAndPrepareInRaster(extent,cellSize,scenRasterName,"scenarion streamflow")
-      refRaster = self.readAndPrepareInRaster(extent,cellSize,refRasterName,"reference streamflow")
-      #refMeanRaster = self.readAndPrepareInRaster(extent,cellSize,refMeanRasterName,"reference mean streamflow")
-      
-      # Select valid data.
-      dataMask = scenRaster.getDataMask()
-      dataMask = np.logical_and(dataMask,refRaster.getDataMask())  
-      #dataMask = np.logical_and(dataMask,refMeanRaster.getDataMask())  
-
-      # Select mean > 0.0.
-      dataMask = np.logical_and(dataMask,refMeanRaster.r > 0.0)  
-         
-      # Combine with fractions mask.
-      dataMask = np.logical_and(dataMask,fracMask)  
-         
-      # Calculate sum ((Q - Qref) / Qmean)^2.
-      outRaster.r[dataMask] += np.square( (scenRaster.r[dataMask] - refRaster.r[dataMask]) / refMeanRaster.r[dataMask])  
-
-      # Clear mask.
-      dataMask = None
-
-      # Close and free the rasters.
-      scenRaster.close()
-      scenRaster = None
-      refRaster.close()
-      refRaster = None
-
-    # Close and free the reference annual mean raster  
-    #refMeanRaster.close()
-    #refMeanRaster = None
-
-    # Calculate squareroot of sum.
-    outRaster.r = np.sqrt(outRaster.r)  
-
-    # Set nodata.
-    outRaster.r[~fracMask] = outRaster.noDataValue      # pylint: disable=invalid-unary-operand-type
-
-    #-----------------------------------------------------------------------------
-    # Write output raster.
-    #-----------------------------------------------------------------------------
-
-    # Save the AAPFD raster.
-    Log.info("Writing AAPFD raster...")
-    outRaster.write()
-    refMeanRaster.write()
+    # All rasters are read once, block by block. Rasters with another extent
+    # or cellsize are prepared and written to a tmp raster first.
+    tmpRasterNames = []
 
-    # Cleanup.
-    outRaster.close()
+    fracRasters = []
+    refRasters = []
+    scenRasters = []
     outRaster = None
-    refMeanRaster.close()
-    refMeanRaster = None
+    try:
+      # Create a list with the fraction rasters.
+      fracRasterNames = [rivFractionsRasterName,floodFractionsRasterName]
+      fracDescriptions = ["river","floodplain"]
+
+      for i in range(len(fracRasterNames)):
+        tmpRasterName = os.path.join(self.outDir,"tmp_aapfd_%s_fractions.tif" % fracDescriptions[i])
+        tmpRasterNames.append(tmpRasterName)
+        fracRasters.append(self.openAndPrepareInRaster(extent,cellSize,fracRasterNames[i],
+                                                       fracDescriptions[i]+" fractions",
+                                                       tmpRasterName=tmpRasterName))
+
+      for i in range(len(scenStreamflowMonthsRasterNames)):
+        tmpRasterName = os.path.join(self.outDir,"tmp_aapfd_reference_%s.tif" % (i+1))
+        tmpRasterNames.append(tmpRasterName)
+        refRasters.append(self.openAndPrepareInRaster(extent,cellSize,refStreamflowMonthsRasterNames[i],
+                                                      "reference streamflow",
+                                                      tmpRasterName=tmpRasterName))
+        tmpRasterName = os.path.join(self.outDir,"tmp_aapfd_scenario_%s.tif" % (i+1))
+        tmpRasterNames.append(tmpRasterName)
+        scenRasters.append(self.openAndPrepareInRaster(extent,cellSize,scenStreamflowMonthsRasterNames[i],
+                                                       "scenarion streamflow",
+                                                       tmpRasterName=tmpRasterName))
+
+      #-----------------------------------------------------------------------------
+      # Create output raster.
+      #-----------------------------------------------------------------------------
+
+      # Create AAPFD raster.
+      Log.info("Creating AAPFD raster...")
+      noDataValue = -999.0
+      outRaster = Raster(outRasterName)
+      outRaster.initRasterEmpty(extent,cellSize,np.float32,noDataValue)
+
+      #-----------------------------------------------------------------------------
+      # Process the rasters block by block.
+      #-----------------------------------------------------------------------------
+
+      # The reference month blocks are kept until the deviation is calculated,
+      # so use smaller blocks.
+      Log.info("Calculating AAPFD...")
+      minNrCells = max(1,GLOB.blockMinNrCells // max(1,len(refRasters)))
+      for minCol,minRow,nrCols,nrRows in outRaster.getBlockWindows(minNrCells):
+
+        # Select all cells where river/floodplain fractions are > 0.0.
+        fracMask = None
+        for fracRaster in fracRasters:
+          tmpMask = (fracRaster.readBlock(minCol,minRow,nrCols,nrRows) > 0.0)
+          if fracMask is None:
+            fracMask = tmpMask
+          else:
+            fracMask = np.logical_or(fracMask,tmpMask)
+
+        # Cleanup mask.
+        tmpMask = None
+
+        # Calculate mean year reference, divide by number of months with 
+        # valid data > 0.0.
+        refMeanBlock = np.zeros((nrRows,nrCols),dtype=np.float32)
+        refMonthCntBlock = np.zeros((nrRows,nrCols),dtype=np.int16)
+        refBlocks = []
+        for refRaster in refRasters:
+          refBlock = refRaster.readBlock(minCol,minRow,nrCols,nrRows)
+          dataMask = (refBlock != refRaster.noDataValue)
+          dataMask = np.logical_and(dataMask,refBlock > 0.0)
+          refMeanBlock[dataMask] = refMeanBlock[dataMask] + refBlock[dataMask]
+          refMonthCntBlock[dataMask] += 1
+          refBlocks.append(refBlock)
+
+        dataMask = (refMonthCntBlock > 0.0)
+        refMeanBlock[dataMask] = refMeanBlock[dataMask] / refMonthCntBlock[dataMask]
+
+        # Select mean > 0.0 and combine with fractions mask.
+        meanMask = np.logical_and(refMeanBlock > 0.0,fracMask)
+
+        # Calculate sum ((Q - Qref) / Qmean)^2.
+        outBlock = np.zeros((nrRows,nrCols),dtype=np.float32)
+        for i in range(len(scenRasters)):
+          scenBlock = scenRasters[i].readBlock(minCol,minRow,nrCols,nrRows)
+          refBlock = refBlocks[i]
+
+          # Select valid data.
+          dataMask = (scenBlock != scenRasters[i].noDataValue)
+          dataMask = np.logical_and(dataMask,refBlock != refRasters[i].noDataValue)
+          dataMask = np.logical_and(dataMask,meanMask)
+
+          outBlock[dataMask] += np.square( (scenBlock[dataMask] - refBlock[dataMask]) / refMeanBlock[dataMask])
+
+          # Free the reference month block.
+          refBlocks[i] = None
+
+        # Clear masks.
+        dataMask = None
+        meanMask = None
+
+        # Calculate squareroot of sum.
+        outBlock = np.sqrt(outBlock)
+
+        # Set nodata.
+        outBlock[~fracMask] = noDataValue
+
+        # Write the AAPFD block.
+        outRaster.writeBlock(minCol,minRow,outBlock)
+
+    finally:
+      #-----------------------------------------------------------------------------
+      # Cleanup.
+      #-----------------------------------------------------------------------------
+
+      # Close the rasters.
+      if not outRaster is None:
+        outRaster.close()
+      outRaster = None
+      for inRaster in fracRasters + refRasters + scenRasters:
+        inRaster.close()
+      fracRasters = None
+      refRasters = None
+      scenRasters = None
+
+      # Delete the tmp rasters, also when the calculation failed.
+      for tmpRasterName in tmpRasterNames:
+        if RU.rasterExists(tmpRasterName):
+          RU.rasterDelete(tmpRasterName)
           
     # Show used memory and disk space.
     MON.showMemDiskUsage()
@@ -23,7 +23,6 @@
 
 import os
 import numpy as np
-import subprocess as sp
 
 import GlobioModel.Core.Error as Err
 import GlobioModel.Core.Globals as GLOB
@@ -36,6 +35,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.CellArea as CA
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
+from GlobioModel.Workers.FlowAccumulation import FlowAccumulation
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -45,132 +45,6 @@ class GLOBIO_CalcAquaticFRHLU(CalculationBase):
   upstream catchments (FRHLU).
   """
 
-  # Name of TAUDEMPATH environment variable.
-  varTaudemPath = "TAUDEMPATH"
-  
-  #-----------------------------------------------------------------------------
-  # Gets the TAUDEMPATH environment variable. Also checks if the 
-  # environment variable variable exists and has an valid path.
-  # Returns the path.
-  # Throws an exception when an error occurred.
-  def getTauDEMPath(self):
-
-    # Check environment variable.
-    if not self.varTaudemPath in os.environ:
-      msg = "The environment variable '%s' is not defined. " + \
-            "Run aborted." % self.varTaudemPath
-      Err.raiseGlobioError(Err.UserDefined1,msg)
-
-    # Get path and check.
-    taudemPath = os.environ[self.varTaudemPath]
-    if taudemPath=="":
-      # 20201117
-#      msg = "The TauDEM path '%s' is not specified. " + \
-#            "Run aborted." % self.taudemPath
-      msg = "The TauDEM path '%s' is not specified. " + \
-            "Run aborted." % (taudemPath)
-      Err.raiseGlobioError(Err.UserDefined1,msg)
-    if not os.path.isdir(taudemPath):
-      # 20201117
-#      msg = "The TauDEM path '%s' is not found. " + \
-#            "Run aborted." % self.taudemPath
-      msg = "The TauDEM path '%s' is not found. " + \
-            "Run aborted." % (taudemPath)
-      Err.raiseGlobioError(Err.UserDefined1,msg)
-    
-    return taudemPath
-
-  #-----------------------------------------------------------------------------
-  # Runs the TauDEM AreaD8 molule.
-  # Throws an exception when an error occurred.
-  def runTauDEMAreaD8(self,taudemPath,flowDirectionRasterName,
-                      weightRasterName,outRasterName,nrOfCores=6):
-
-    # Set exe's.
-    mpiexecExe = os.path.join(taudemPath,"mpiexec")
-    taudemExe = os.path.join(taudemPath,"aread8")
-
-    if not UT.isLinux():
-      # Add quotes for Windows.
-      if not mpiexecExe.startswith('"'):
-        mpiexecExe = '"%s"' % (mpiexecExe)
-      if not taudemExe.startswith('"'):
-        taudemExe = '"%s"' % (taudemExe)
-
-    # Create commandline.  
-    flowArg = "-p %s" % flowDirectionRasterName
-    if weightRasterName!="":
-      weightArg = "-wg %s" % weightRasterName
-    else:
-      weightArg = ""
-    outArg = "-ad8 %s" % outRasterName
-    cmd = "%s -np %s %s %s %s %s" % (mpiexecExe,nrOfCores,taudemExe,
-                                     flowArg,weightArg,outArg)
-
-    print('cmd: %s' %cmd)
-    # Run the TauDEM AreaD8 molule.
-    p = sp.Popen(cmd,shell=True,stdout=sp.PIPE,stderr=sp.STDOUT)
-
-    # Collect stdout.    
-    linesSTDOUT = []
-    for line in p.stdout.readlines():
-      linesSTDOUT.append(line.decode("utf-8"))
-      
-    # Wait and get return value.  
-    retval = p.wait()
-
-    # Check return value.
-    if retval!=0:
-      # Toon de TauDEM AreaD8 uitvoer.
-      msg = "Error while running the TauDEM AreaD8 molule:"
-      for line in linesSTDOUT:
-        if line.strip() != "":
-          msg += "  " + line
-      Err.raiseGlobioError(Err.UserDefined1,msg)
-  # 20201202    
-  # def runTauDEMAreaD8(self,taudemPath,flowDirectionRasterName,
-  #                      weightRasterName,outRasterName,nrOfCores=6):
-
-  #   # 20201117
-  #   # Add quotes to path for Windows.
-  #   if not UT.isLinux():
-  #     # Windows, not already quoted?
-  #     if not taudemPath.startswith('"'):
-  #       taudemPath = '"%s"' % (taudemPath)
-
-
-  #   # Create commandline.  
-  #   flowArg = "-p %s" % flowDirectionRasterName
-  #   if weightRasterName!="":
-  #     weightArg = "-wg %s" % weightRasterName
-  #   else:
-  #     weightArg = ""
-  #   outArg = "-ad8 %s" % outRasterName
-  #   # cmd = "mpiexec -np %s %s/aread8 %s %s %s" % (nrOfCores,taudemPath,
-  #   #                                              flowArg,weightArg,outArg)
-  #   cmd = "mpiexec -np %s %s\\aread8 %s %s %s" % (nrOfCores,taudemPath,
-  #                                                flowArg,weightArg,outArg)
-  #   # Run the TauDEM AreaD8 molule.
-  #   p = sp.Popen(cmd,shell=True,stdout=sp.PIPE,stderr=sp.STDOUT)
-
-  #   # Collect stdout.    
-  #   linesSTDOUT = []
-  #   for line in p.stdout.readlines():
-  #     linesSTDOUT.append(line)
-      
-  #   # Wait and get return value.  
-  #   retval = p.wait()
-
-  #   # Check return value.
-  #   if retval!=0:
-  #     # Toon de TauDEM AreaD8 uitvoer.
-  #     msg = "Error while running the TauDEM AreaD8 molule:"
-  #     for line in linesSTDOUT:
-  #       if line.strip() != "":
-  #         #msg += "  " + line
-  #         msg += "  %s" % line
-  #     Err.raiseGlobioError(Err.UserDefined1,msg)
-
   #-------------------------------------------------------------------------------
   def run(self,*args):
     """
@@ -212,26 +86,15 @@ class GLOBIO_CalcAquaticFRHLU(CalculationBase):
     tmpAntFracRasterName = os.path.join(self.outDir,"tmp_frhlu_anthro_fractions.tif")
     tmpWeightedAreaRasterName = os.path.join(self.outDir,"tmp_frhlu_weighted_area.tif")
     tmpTotalAreaRasterName = os.path.join(self.outDir,"tmp_frhlu_total_area.tif")
-    # 20200917
-    tmpFlowDirectionRasterName = os.path.join(self.outDir,"tmp_flowdirection.tif")
     
     # Remove tmp rasters.
     RU.rasterDelete(tmpAntFracRasterName)
     RU.rasterDelete(tmpWeightedAreaRasterName)
     RU.rasterDelete(tmpTotalAreaRasterName)
-    # 20200917
-    RU.rasterDelete(tmpFlowDirectionRasterName)
     
     # Enable monitor en show memory and disk space usage.
     MON.showMemDiskUsage(Log,"- ","",self.outDir)
 
-    #-----------------------------------------------------------------------------
-    # Get and check the TAUDEMPATH environment variable.
-    #-----------------------------------------------------------------------------
-
-    # Get and check the path.
-    taudemPath = self.getTauDEMPath()  
-
     #-----------------------------------------------------------------------------
     # Create 10sec area raster for anthropogenic landuse.
     #-----------------------------------------------------------------------------
@@ -305,7 +168,7 @@ class GLOBIO_CalcAquaticFRHLU(CalculationBase):
     Log.info("Calculating anthropogenic fractions...")
     
     # Create anthropogenic fraction raster.
-    anthrFracRaster = Raster(tmpAntFracRasterName)
+    anthrFracRaster = Raster()
     anthrFracRaster.initRasterEmpty(extent,cellSize,np.float32,-999.0)
     anthrFracRaster.r = resAnthrAreaRaster.r / totAreaRaster.r
     
@@ -320,74 +183,40 @@ class GLOBIO_CalcAquaticFRHLU(CalculationBase):
     totAreaRaster.close()
     totAreaRaster = None
 
-    #-----------------------------------------------------------------------------
-    # Write anthropogenic fraction.
-    #-----------------------------------------------------------------------------
-
     # Save the anthropogenic fractions.
-    Log.info("Writing anthropogenic fractions...")
-    anthrFracRaster.write()
-
-    # Cleanup.
-    anthrFracRaster.close()
-    anthrFracRaster = None
+    self.writeTmpRaster(anthrFracRaster,tmpAntFracRasterName,"Writing anthropogenic fractions")
 
     #-----------------------------------------------------------------------------
-    # Resize/resample flow direction raster.
+    # Read flow direction raster.
     #-----------------------------------------------------------------------------
 
-    # Need to resize/resample?
-    if not RU.rasterHasExtentCellSize(flowDirectionRasterName,extent,cellSize):
-      
-      # Read the raster and resizes to extent and resamples to cellsize.
-      flowDirRaster = self.readAndPrepareInRaster(extent,cellSize,
-                                                  flowDirectionRasterName,"flow direction")
-      # Save the flow direction.
-      Log.info("Writing flow direction...")
-      flowDirRaster.writeAs(tmpFlowDirectionRasterName)
-
-      # Cleanup.
-      flowDirRaster.close()
-      flowDirRaster = None
-    else:
-      # No resize/resample is needed. Just set tmp flow direction raster name.
-      tmpFlowDirectionRasterName = flowDirectionRasterName
+    # Read the raster and resizes to extent and resamples to cellsize.
+    flowDirRaster = self.readAndPrepareInRaster(extent,cellSize,
+                                                flowDirectionRasterName,"flow direction")
       
     #-----------------------------------------------------------------------------
-    # Calculate weighted upstream anthropogenic areas.
-    # Use fractions as weighting.
+    # Calculate weighted upstream anthropogenic areas and total upstream
+    # areas. Use fractions as weighting.
     #-----------------------------------------------------------------------------
 
-    # Run the TauDEM AreaD8 module.
-    Log.info("Calculating weighted upstream anthropogenic areas...")
-    self.runTauDEMAreaD8(taudemPath,tmpFlowDirectionRasterName,
-                         tmpAntFracRasterName,tmpWeightedAreaRasterName)  
+    Log.info("Calculating weighted upstream anthropogenic areas and total upstream areas...")
+    pFlow = FlowAccumulation(GLOB.numberOfCores)
+    totalAreaRaster,weightedAreaRaster = pFlow.areaD8(flowDirRaster,anthrFracRaster)
+    pFlow = None
 
-    #-----------------------------------------------------------------------------
-    # Calculate total upstream anthropogenic areas.
-    # Use no weighting.
-    #-----------------------------------------------------------------------------
+    # Cleanup.
+    flowDirRaster.close()
+    flowDirRaster = None
+    anthrFracRaster.close()
+    anthrFracRaster = None
 
-    # Run the TauDEM AreaD8 module.
-    Log.info("Calculating total upstream areas...")
-    self.runTauDEMAreaD8(taudemPath,tmpFlowDirectionRasterName,"",
-                         tmpTotalAreaRasterName)  
+    # Save the upstream areas.
+    self.writeTmpRaster(weightedAreaRaster,tmpWeightedAreaRasterName,"Writing weighted upstream anthropogenic areas")
+    self.writeTmpRaster(totalAreaRaster,tmpTotalAreaRasterName,"Writing total upstream areas")
 
     #-----------------------------------------------------------------------------
     # Calculate upstream anthropogenic fractions.
     #-----------------------------------------------------------------------------
-  
-    Log.info("Reading weighted upstream anthropogenic areas...")
-    
-    # Reads the weighted upstream anthropogenic areas.
-    weightedAreaRaster = Raster(tmpWeightedAreaRasterName)
-    weightedAreaRaster.read()
-
-    Log.info("Reading total upstream areas...")
-    
-    # Reads the total upstream areas.
-    totalAreaRaster = Raster(tmpTotalAreaRasterName)
-    totalAreaRaster.read()
 
     # Create mask.
     mask = (totalAreaRaster.r > 0.0)
@@ -411,18 +240,6 @@ class GLOBIO_CalcAquaticFRHLU(CalculationBase):
     totalAreaRaster.close()
     totalAreaRaster = None
 
-    # Remove tmp rasters?   
-    if not GLOB.saveTmpData:
-      RU.rasterDelete(tmpAntFracRasterName)
-      RU.rasterDelete(tmpWeightedAreaRasterName)
-      RU.rasterDelete(tmpTotalAreaRasterName)
-      # 20200917
-      # 20211115: MB: Only remove tmpFlowDirectionRasterName if tmpFlowDirection is
-      #           resized or changed extent; the original code removes input FlowDirection 
-      #           raster
-      if not RU.rasterHasExtentCellSize(flowDirectionRasterName,extent,cellSize):
-        RU.rasterDelete(tmpFlowDirectionRasterName)
-
     #-----------------------------------------------------------------------------
     # Save output.
     #-----------------------------------------------------------------------------
@@ -474,6 +474,38 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
       self.dbgInfo()
     return areaRaster
 
+  #-----------------------------------------------------------------------------
+  # Creates an index of the masked cells grouped by region.
+  # Returns a tuple (cellIds,regionOffsets) with:
+  # - cellIds: the flat cell ids of the masked cells, sorted by region. Within
+  #   a region the cells are in raster (row-major) order.
+  # - regionOffsets: a dict with per region a (start,end) tuple of the cells
+  #   of the region in cellIds.
+  # Cells of regions which are not in the regionList are skipped.
+  def createRegionIndex(self,regionRaster,regionList,mask):
+    # Set index datatype.
+    if regionRaster.r.size < np.iinfo(np.uint32).max:
+      indexDataType = np.uint32
+    else:
+      indexDataType = np.int64
+    # Get the masked cells and their regions.
+    cellIds = np.flatnonzero(mask).astype(indexDataType)
+    cellRegions = np.take(regionRaster.r,cellIds)
+    # Sort the cells by region, keeping the raster order within a region.
+    sortIds = np.argsort(cellRegions,kind="stable")
+    cellIds = cellIds[sortIds]
+    cellRegions = cellRegions[sortIds]
+    sortIds = None
+    # Get the start and end of the cells per region.
+    regions = np.array(regionList,dtype=cellRegions.dtype)
+    starts = np.searchsorted(cellRegions,regions,side="left")
+    ends = np.searchsorted(cellRegions,regions,side="right")
+    cellRegions = None
+    regionOffsets = dict()
+    for i in range(len(regionList)):
+      regionOffsets[regionList[i]] = (starts[i],ends[i])
+    return cellIds,regionOffsets
+
   #-----------------------------------------------------------------------------
   # Creates a list of regions from the region raster.
   def createRegionListFromRegionRaster(self,regionRaster):
@@ -629,6 +661,47 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
           area = area * claimAreaMultiplier
           landuseType.claims[region] = area
           
+  #-------------------------------------------------------------------------------
+  # Selects the cells with the highest suitability up to the claim area.
+  # The suitability is multiplied by -1, i.e. sorted from low to high.
+  # Returns a tuple (sortIds,insertIdx,cumAreaRas) with the ids of the best
+  # cells sorted from high to low suitability, the number of cells within
+  # the claim area and the cummulative area of the sorted cells.
+  # Only the best cells are sorted. These are found with a partial selection,
+  # and the number of cells is doubled until the claim area is exceeded.
+  # Cells with equal suitability are kept in order, so the result is the
+  # same as sorting all cells.
+  def selectClaimCells(self,suitRas,areaRas,claim,totArea,cumsumDataType):
+    nrCells = len(suitRas)
+    # Estimate the number of cells needed, using the mean cell area.
+    if (totArea > 0) and (claim < totArea):
+      nrSelect = int(claim / (totArea / nrCells) * 1.1) + 1
+    else:
+      nrSelect = nrCells
+    while True:
+      if nrSelect >= nrCells:
+        # Sort all cells.
+        sortIds = np.argsort(suitRas,kind=self.sortKind)
+      else:
+        # Get the suitability of the cell at position nrSelect.
+        threshold = np.partition(suitRas,nrSelect-1)[nrSelect-1]
+        if np.isnan(threshold):
+          nrSelect = nrCells
+          continue
+        # Select and sort the best cells, including all cells with a
+        # suitability equal to the threshold.
+        selectIds = np.flatnonzero(suitRas <= threshold)
+        sortIds = selectIds[np.argsort(suitRas[selectIds],kind=self.sortKind)]
+        selectIds = None
+      # Calculate the cummulative area.
+      cumAreaRas = np.cumsum(areaRas[sortIds],dtype=cumsumDataType)
+      # Get the index of the cell which claim area <= cum area.
+      insertIdx = np.searchsorted(cumAreaRas,claim,side='right')
+      # Claim area exceeded or all cells selected?
+      if (insertIdx < len(sortIds)) or (len(sortIds) >= nrCells):
+        return sortIds,insertIdx,cumAreaRas
+      nrSelect *= 2
+
   #-------------------------------------------------------------------------------
   # Bind the claim area to the landuse types.
   def setLanduseClaims(self,claimFile):
@@ -1087,6 +1160,16 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
     outRaster = Raster(outRasterName)
     outRaster.initRaster(extent,cellSize,np.uint8,0)
 
+    #-----------------------------------------------------------------------------
+    # Create the region index.
+    #-----------------------------------------------------------------------------
+
+    # Group the allocatable cells by region. So the cells of a region
+    # can be selected without creating a region mask for every land-use type.
+    Log.info("Creating region index...")
+    regionCellIds,regionOffsets = self.createRegionIndex(regionRaster,regionList,
+                                                         allocatableMask)
+
     ##############################################################################
     # Calculate discrete landuse allocation.
     ##############################################################################
@@ -1181,92 +1264,62 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
         #-----------------------------------------------------------------------------
 
         #-----------------------------------------------------------------------------
-        # Select current region.
+        # Select allocatable cells in current region.
         #-----------------------------------------------------------------------------
 
-        # Select the cells in the current region.
-        currSuitMask = (regionRaster.r == region)
-
-        # Check regions.
-        if np.sum(currSuitMask) == 0:
-          Log.info("    No region cels found.")
-          continue
-
-        ########### FOR TESTING.
-        self.dbgPrintArray("currSuitMask - region",currSuitMask)
-
-        #-----------------------------------------------------------------------------
-        # Select allocatable cells.
-        #-----------------------------------------------------------------------------
-
-        # Refine region mask with allocatable cells.
-        currSuitMask = np.logical_and(currSuitMask,allocatableMask)
+        # Get the allocatable cells in the current region from the region index.
+        start,end = regionOffsets[region]
+        currCellIds = regionCellIds[start:end]
 
         # Check allocatable cells.
-        if np.sum(currSuitMask) == 0:
+        if len(currCellIds) == 0:
           Log.info("    No allocatable cells in regio found.")
           continue
 
         ########### FOR TESTING.
-        self.dbgPrintArray("currSuitMask - allocatableMask",currSuitMask)
+        self.dbgPrintArray("currCellIds - allocatable",currCellIds)
 
         #-----------------------------------------------------------------------------
         # Select free cells.
         #-----------------------------------------------------------------------------
 
         # Select the output cells which are not allocated by previous processed landuse types.
-        currSuitMask = np.logical_and(currSuitMask,(outRaster.r == outRaster.noDataValue))
+        currCellIds = currCellIds[np.take(outRaster.r,currCellIds) == outRaster.noDataValue]
 
         # Check free cells.
-        if np.sum(currSuitMask) == 0:
+        if len(currCellIds) == 0:
           Log.info("    No free cells in regio found.")
           continue
 
         ########### FOR TESTING.
-        self.dbgPrintArray("currSuitMask outRaster.noDataValue",currSuitMask)
+        self.dbgPrintArray("currCellIds - free",currCellIds)
 
         #-----------------------------------------------------------------------------
         # Select valid suitability cells, i.e. allocatable cells.
         #-----------------------------------------------------------------------------
 
         # Select suitability.
-        selectedCurrSuitRas = currSuitRaster.r[currSuitMask]
+        selectedCurrSuitRas = np.take(currSuitRaster.r,currCellIds)
 
         ########### FOR TESTING.
         self.dbgPrintArray("selectedCurrSuitRas",selectedCurrSuitRas)
   
-        #-----------------------------------------------------------------------------
-        # Sort the suitability of the allocatable cells.
-        #-----------------------------------------------------------------------------
-
         # Calculate *-1 to sort from high to low.
         selectedCurrSuitRas *= -1.0
 
-        # Sort suitability from high to low.
-        #Log.info("- Sorting suitability (%s)..." % self.sortKind)
-        currSuitSortIds = np.argsort(selectedCurrSuitRas,kind=self.sortKind)
-
-        ########### FOR TESTING.
-        self.dbgPrintArray("currSuitSortIds",currSuitSortIds)
-        self.dbgPrintArray("selectedCurrSuitRas[currSuitSortIds]",selectedCurrSuitRas[currSuitSortIds])
-        self.dbgPrintArray("selectedCurrSuitRas[currSuitSortIds[-20:]]",selectedCurrSuitRas[currSuitSortIds[-20:]])
-
-        # Cleanup maskedCurrSuitRas.
-        selectedCurrSuitRas = None
-
         #-----------------------------------------------------------------------------
         # Select valid area cells, i.e. with same mask as for suitability.
         #-----------------------------------------------------------------------------
 
         # Select areas.
-        selectedAreaRas = areaRaster.r[currSuitMask]
+        selectedAreaRas = np.take(areaRaster.r,currCellIds)
   
         ########### FOR TESTING.
         self.dbgPrintArray("selectedAreaRas",selectedAreaRas)
-        self.dbgPrintArray("selectedAreaRas[currSuitSortIds]",selectedAreaRas[currSuitSortIds])
 
         #-----------------------------------------------------------------------------
-        # Calculate the cummulated area of the selected and sorted cells.
+        # Select the cells with the highest suitability up to the landuse
+        # claim area.
         #-----------------------------------------------------------------------------
 
         # Set cumsum datatype. Cellsize less than 30sec, use float64.
@@ -1275,31 +1328,34 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
           cumsumDataType = np.float64
         else:
           cumsumDataType = np.float32
-        
-        # Calculate the cummulative area.
-        cumAreaRas = np.cumsum(selectedAreaRas[currSuitSortIds],dtype=cumsumDataType)
-
-        ########### FOR TESTING.
-        self.dbgPrintArray("cumAreaRas",cumAreaRas)
-
-        #-----------------------------------------------------------------------------
-        # Select area cells up to the landuse claim area.
-        #-----------------------------------------------------------------------------
 
         # Get the current landuse claim.
         currClaim = landuseType.claims[region]
         #JM
         Log.info("   Current claim for region is %s" % (str(currClaim)))
-                  
-        # Get the index of the cell which claim area <= cum area.
-        insertIdx = np.searchsorted(cumAreaRas,currClaim,side='right')
-        
+
+        # Calculate the total area.
+        totAreaRas = np.sum(selectedAreaRas,dtype=cumsumDataType)
+
+        # Sort the best cells from high to low suitability and get the
+        # index of the cell which claim area <= cum area.
+        currSuitSortIds,insertIdx,cumAreaRas = self.selectClaimCells(selectedCurrSuitRas,
+                                                                     selectedAreaRas,
+                                                                     currClaim,totAreaRas,
+                                                                     cumsumDataType)
+
         ########### FOR TESTING.
+        self.dbgPrintArray("currSuitSortIds",currSuitSortIds)
+        self.dbgPrintArray("selectedCurrSuitRas[currSuitSortIds]",selectedCurrSuitRas[currSuitSortIds])
+        self.dbgPrintArray("selectedAreaRas[currSuitSortIds]",selectedAreaRas[currSuitSortIds])
+        self.dbgPrintArray("cumAreaRas",cumAreaRas)
         self.dbgPrintTestInfo1(currClaim,insertIdx,cumAreaRas,currSuitSortIds,selectedAreaRas)
 
+        # Cleanup maskedCurrSuitRas.
+        selectedCurrSuitRas = None
+
         #JH
-        # Calculate the total area and report whether the claim is fully allocated.
-        totAreaRas = np.sum(selectedAreaRas[currSuitSortIds],dtype=cumsumDataType)
+        # Report whether the claim is fully allocated.
         if totAreaRas>=currClaim:
             Log.info("   100% of claim is allocated")
         else:
@@ -1312,34 +1368,29 @@ class GLOBIO_CalcDiscreteLanduseAllocation(CalculationBase):
         selectedAreaRas  = None
   
         #-----------------------------------------------------------------------------
-        # Create masked output array.
+        # Update output raster.
         #-----------------------------------------------------------------------------
   
-        # Select output cells.
-        selectedOutRas = outRaster.r[currSuitMask]
-  
-        ########### FOR TESTING.
-        self.dbgPrintArray("selectedOutRas",selectedOutRas)
-  
         # Update output raster with land-use.
-        selectedOutRas[currSuitSortIds[:insertIdx]] = landuseType.code
+        outRaster.r.flat[currCellIds[currSuitSortIds[:insertIdx]]] = landuseType.code
   
         ########### FOR TESTING.
-        self.dbgPrintArray("maskedOutRas code",selectedOutRas)
-  
-        # Update output raster.
-        outRaster.r[currSuitMask] = selectedOutRas
+        self.dbgPrintArray("outRaster code",outRaster.r)
 
         # Free sorted ids.
         currSuitSortIds  = None
   
-        # Free suitability mask.
-        currSuitMask  = None
+        # Free cell ids.
+        currCellIds  = None
       
       # Close and free landuse suitability raster.
       currSuitRaster.close()
       currSuitRaster = None
 
+    # Free the region index.
+    regionCellIds = None
+    regionOffsets = None
+
     # Close and free the cell area raster.
     areaRaster.close()
     areaRaster = None
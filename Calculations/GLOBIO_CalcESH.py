@@ -38,8 +38,10 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Grass_adj import Grass
 from GlobioModel.Core.Raster import Raster
 from GlobioModel.Core.Vector import Vector
+from GlobioModel.Workers.GeodesicDistance import GeodesicDistance
 
 import GlobioModel.Core.RasterUtils as RU
+import GlobioModel.Core.RegionUtils as RGU
 import GlobioModel.Common.Utils as UT
 
 #-------------------------------------------------------------------------------
@@ -656,11 +658,7 @@ class GLOBIO_CalcESH(CalculationBase):
       noDataValue = -999.0
       SpeciesESHAreaRaster = Raster()
       SpeciesESHAreaRaster.initRaster(extentShapefile,cellSize,np.float32,noDataValue)
-      SpeciesESHAreaRaster.r = SpeciesESHRaster.r
-
-      # Free np.int raster
-      SpeciesESHRaster.close()
-      SpeciesESHRaster = None
+      SpeciesESHAreaRaster.r = SpeciesESHRaster.r.copy()
 
       # Calculate ESH
       SpeciesESHAreaRaster.r[notmask] = 0        
@@ -692,19 +690,22 @@ class GLOBIO_CalcESH(CalculationBase):
 
       halfspeciesDisp = speciesDisp / 2.0
     
-      # Buffer ESH areas.
-      gr = Grass()
-      #np.random.seed(seed=batchNumber)
-      gr.init(batchNumber)
-      gr.buffer(extentShapefile,cellSize,tmpSpeciesESHRasterName,tmpSpeciesESHBufRasterName,
-                halfspeciesDisp,"kilometers")
-      gr = None
+      # Buffer ESH areas. The species are already divided over batches,
+      # so use 1 core.
+      pDist = GeodesicDistance(1)
+      SpeciesESHBufRaster = pDist.buffer(extentShapefile,cellSize,SpeciesESHRaster,
+                                         halfspeciesDisp * 1000.0)
+      pDist = None
+
+      # Free np.int raster
+      SpeciesESHRaster.close()
+      SpeciesESHRaster = None
+
+      # Save species ESH buffer raster
+      self.writeTmpRaster(SpeciesESHBufRaster,tmpSpeciesESHBufRasterName,"Saving tmp_species_buf")
 
       # Reclass buffer values (i.e., 2) to species values (i.e., 1)
       Log.info("Reclassing...")
-      
-      # Read buffered ESH raster.
-      SpeciesESHBufRaster = self.readAndPrepareInRaster(extentShapefile,cellSize,tmpSpeciesESHBufRasterName,"tmp_species_buf")
 
       # Select all values and reclass to 1.
       buffermask = (SpeciesESHBufRaster.r == 2)
@@ -713,25 +714,21 @@ class GLOBIO_CalcESH(CalculationBase):
       mask = None
       
       # Save species ESH buffer raster
-      SpeciesESHBufRaster.writeAs(tmpSpeciesBufClumpRasterName)
-
-      # Close and free the raster.
-      SpeciesESHBufRaster.close()
-      SpeciesESHBufRaster = None
+      self.writeTmpRaster(SpeciesESHBufRaster,tmpSpeciesBufClumpRasterName,"Saving tmp_species_buf_clump")
 
       # Clump connected areas.
       Log.info("Clumping connected areas...")
 
       diagonal = True
 
-      gr = Grass()
-      #np.random.seed(seed=batchNumber)
-      gr.init(batchNumber)
-      gr.clump(extentShapefile,cellSize,tmpSpeciesBufClumpRasterName,tmpSpeciesESHClumpRasterName,np.uint32,diagonal)
-      gr = None
+      SpeciesESHClumpedRaster = RGU.clumpRaster(SpeciesESHBufRaster,diagonal,np.uint32)
+
+      # Close and free the raster.
+      SpeciesESHBufRaster.close()
+      SpeciesESHBufRaster = None
 
-      # Read clumped ESH raster.
-      SpeciesESHClumpedRaster = self.readAndPrepareInRaster(extentShapefile,cellSize,tmpSpeciesESHClumpRasterName,"tmp_species_clump")
+      # Save clumped ESH raster
+      self.writeTmpRaster(SpeciesESHClumpedRaster,tmpSpeciesESHClumpRasterName,"Saving tmp_species_clump")
 
       # Remove buffer cells from patches by setting to noData.
       SpeciesESHClumpedRaster.r[buffermask] = SpeciesESHClumpedRaster.noDataValue
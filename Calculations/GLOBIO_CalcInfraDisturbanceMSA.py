@@ -26,9 +26,9 @@ import GlobioModel.Core.Logger as Log
 import GlobioModel.Core.Monitor as MON
 
 from GlobioModel.Core.CalculationBase import CalculationBase
-from GlobioModel.Core.Grass import Grass
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
+from GlobioModel.Workers.GeodesicDistance import GeodesicDistance
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -156,39 +156,24 @@ class GLOBIO_CalcInfraDisturbanceMSA(CalculationBase):
       # Replace 0 with nodata for buffering.
       tmpInfraRaster.r[tmpInfraRaster.r==0] = tmpInfraRaster.noDataValue
 
-      # Check the temporary infra raster.
-      if RU.rasterExists(tmpInfraRasterName):
-        Log.info("Delete %s" % tmpInfraRasterName)
-        RU.rasterDelete(tmpInfraRasterName)
-
       # Save the temporary infra raster.
-      Log.info("Writing %s..." % tmpInfraRasterName)
-      tmpInfraRaster.writeAs(tmpInfraRasterName)
-
-      # Close and free the temporary raster.
-      tmpInfraRaster.close()
-      tmpInfraRaster = None
+      self.writeTmpRaster(tmpInfraRaster,tmpInfraRasterName,"Writing infra raster")
 
       Log.info(f"Calculating nearest distance to infrastructure {i}...")
 
-      # Check the temporary distance raster.
-      if RU.rasterExists(tmpInfraDistanceRasterName):
-        Log.info("Delete %s" % tmpInfraDistanceRasterName)
-        RU.rasterDelete(tmpInfraDistanceRasterName)
-        
-      # Calculate nearest distance to infrastructure. 
-      gr = Grass()
-      gr.init()
-      gr.distance_V1(extent,cellSize,tmpInfraRasterName,tmpInfraDistanceRasterName)
-      gr = None
-          
-      # Read distance raster.
-      Log.info(f"Reading infra distance raster {tmpInfraDistanceRasterName}...")
-      distanceRaster = Raster(tmpInfraDistanceRasterName)
-      distanceRaster.read()
-    
       # Limit distance to maximum value.
       maxDistanceM = maxDistanceKM * 1000.0
+
+      # Calculate nearest distance to infrastructure. 
+      pDist = GeodesicDistance(GLOB.numberOfCores)
+      distanceRaster = pDist.distance(extent,cellSize,tmpInfraRaster,
+                                      maxDistance=maxDistanceM)
+      pDist = None
+
+      # Close and free the temporary raster.
+      tmpInfraRaster.close()
+      tmpInfraRaster = None
+    
       maxDistMask = (distanceRaster.r >= maxDistanceM)
       distanceRaster.r[maxDistMask] = maxDistanceM
       del maxDistMask
@@ -197,19 +182,13 @@ class GLOBIO_CalcInfraDisturbanceMSA(CalculationBase):
       distMask = (distanceRaster.r > 0.0) & (distanceRaster.r != distanceRaster.noDataValue)
       distanceRaster.r[distMask] /= 1000.0
 
-      if not GLOB.saveTmpData:
-        if RU.rasterExists(tmpInfraRasterName):
-          RU.rasterDelete(tmpInfraRasterName)
-        if RU.rasterExists(tmpInfraDistanceRasterName):
-          RU.rasterDelete(tmpInfraDistanceRasterName)
-
       self.fuseDistanceRasters(combinedInfraDistanceRaster, distanceRaster, existingIsEmpty=firstDistanceRaster)
       # Clear flag if not already cleared
       if firstDistanceRaster:
         firstDistanceRaster = False
 
-      Log.info(f"Writing {tmpInfraDistanceRasterName}...")
-      distanceRaster.write()
+      # Save the temporary distance raster.
+      self.writeTmpRaster(distanceRaster,tmpInfraDistanceRasterName,"Writing infra distance raster")
       distanceRaster.close()
       del distanceRaster
 
@@ -19,7 +19,6 @@
 
 import os
 import numpy as np
-import scipy.ndimage
 
 import GlobioModel.Core.Error as Err
 import GlobioModel.Core.Globals as GLOB
@@ -31,6 +30,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.CellArea as CellArea
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
+import GlobioModel.Core.RegionUtils as RGU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -64,29 +64,27 @@ class GLOBIO_CalcInfraFragmentationMSA(CalculationBase):
 
   #-------------------------------------------------------------------------------
   # Find natural regions.
-  def createRegions(self,roadsRas,natRas,closeRoadConnections):
+  # The regions are found tile by tile, so no label raster of the whole
+  # extent is needed. Returns the tiles and lookup table to get the region
+  # numbers of a tile (see RGU.getTileRegions), the number of regions and
+  # the area per region.
+  def createRegions(self,roadsRas,natRas,closeRoadConnections,areaRas):
 
     if closeRoadConnections:
-      # Shifting down roads to close diagonal connections.      
       Log.info("- Closing road connections...")
-      # Roll all rows 1 row down.
-      roadsSRas = np.roll(roadsRas,roadsRas.shape[1])
-      # Blank out first row to 0.
-      roadsSRas[:1] = 0
-      # Add original roads.
-      roadsSRas[(roadsRas==1)] = 1
+
+    # Blank out natural landuse on road locations.
+    Log.info("- Removing natural landuse on roads locations...")
+    if closeRoadConnections:
+      # Shifting down roads to close diagonal connections, i.e. also blank
+      # out the cells below the roads.
+      natRas[(roadsRas==1)] = 0
+      natRas[1:][(roadsRas[:-1] > 0)] = 0
     else:
-      roadsSRas = roadsRas
+      natRas[roadsRas > 0] = 0
       
     # Free roads.
     roadsRas = None
-  
-    # Blank out natural landuse on road locations.
-    Log.info("- Removing natural landuse on roads locations...")
-    natRas[roadsSRas > 0] = 0
- 
-    # Free shifted roads.
-    roadsSRas = None
     
     # Save temp raster?
     if GLOB.saveTmpData:
@@ -94,27 +92,25 @@ class GLOBIO_CalcInfraFragmentationMSA(CalculationBase):
       Log.info("- Writing natural landuse: "+tmpName)
       self.writeTmpRaster(natRas,tmpName)
     
-    # Find natural landuse regions with diagonal connections.
+    # Find natural landuse regions with diagonal connections and
+    # calculate the region areas.
     Log.info("- Finding natural landuse regions...")
-    struc = np.array([[1,1,1],
-                      [1,1,1],
-                      [1,1,1]])
-    natRegionsRas,nrRegions = scipy.ndimage.label(natRas,structure=struc)
+    tiles,labelToRegion,nrRegions,regionAreas = RGU.labelRegionsTiled(natRas,True,areaRas)
 
     # Show found number of regions.
     Log.info("- Number of regions found: %s" % nrRegions)
 
-    # Free natural landuse.
-    natRas = None
-
     # Save temp raster?
     if GLOB.saveTmpData:
       tmpName = "tmp_infrafragmentation_nat_regions.tif"
       Log.info("- Writing natural regions: "+tmpName)
+      natRegionsRas = np.vstack([RGU.getTileRegions(natRas,tile,labelToRegion)
+                                 for tile in tiles])
       self.writeTmpRaster(natRegionsRas,tmpName)
+      natRegionsRas = None
 
-    # Return natural landuse regions/patches and number of regions.
-    return (natRegionsRas,nrRegions)
+    # Return natural landuse regions/patches, number of regions and areas.
+    return (tiles,labelToRegion,nrRegions,regionAreas)
      
   #-------------------------------------------------------------------------------
   def run(self,*args):
@@ -238,16 +234,6 @@ class GLOBIO_CalcInfraFragmentationMSA(CalculationBase):
     naturalLanduseRaster.close()
     naturalLanduseRaster = None
     
-    #-----------------------------------------------------------------------------
-    # Find natural regions.
-    #-----------------------------------------------------------------------------
- 
-    Log.info("Finding natural regions...")
-    natRegionsRas,nrRegions = self.createRegions(roadsRas,natRas,closeRoadConnections)
-  
-    # Free roads.
-    roadsRas = None
-  
     #-------------------------------------------------------------------------------
     # Calculate CellArea in km2.
     #-------------------------------------------------------------------------------
@@ -266,35 +252,43 @@ class GLOBIO_CalcInfraFragmentationMSA(CalculationBase):
 #       Log.info("- Writing cell area raster: "+tmpName)
 #       self.writeTmpRaster(areaRas,tmpName) 
 
-    # Calculate natural landuse cell area in km2 (by broadcasting).
-    Log.info("Calculating natural landuse area in km2...")
-    natAreaRas = np.zeros_like(natRegionsRas,dtype=dataType) 
-    natAreaRas[natRegionsRas>0] = 1.0
-    natAreaRas *= areaRas
-
-    # Free cellarea raster.
-    areaRas = None
+    #-----------------------------------------------------------------------------
+    # Find natural regions and calculate the region areas.
+    #-----------------------------------------------------------------------------
+ 
+    Log.info("Finding natural regions...")
+    tiles,labelToRegion,nrRegions,regionAreas = self.createRegions(roadsRas,natRas,closeRoadConnections,areaRas)
+  
+    # Free roads.
+    roadsRas = None
 
     # Save temp raster?
     if GLOB.saveTmpData:
+      # Calculate natural landuse cell area in km2 (by broadcasting).
+      natAreaRas = np.zeros_like(natRas,dtype=dataType) 
+      natAreaRas[natRas!=0] = 1.0
+      natAreaRas *= areaRas
       tmpName = "tmp_infrafragmentation_nat_area.tif"
       Log.info("- Writing natural landuse cell area raster: "+tmpName)
       self.writeTmpRaster(natAreaRas,tmpName)
- 
-    # Calculate natural landuse cell area in km2.
-    Log.info("Summarizing area of landuse regions...")
-    regionIds = np.arange(0,nrRegions+1)
-    regionAreaRas = scipy.ndimage.labeled_comprehension(natAreaRas,natRegionsRas,regionIds,np.sum,dataType,0)
+      natAreaRas = None
+
+    # Free cellarea raster.
+    areaRas = None
 
     # Replace region ids by region areas.
     Log.info("Updating landuse regions...")
-    natRegionAreaIds = np.empty(nrRegions+1,dtype=dataType)
-    natRegionAreaIds[regionIds] = regionAreaRas
-    natRegionAreaSumRas = natRegionAreaIds[natRegionsRas.flatten()].reshape(natRegionsRas.shape)
+    natRegionAreaIds = regionAreas.astype(dataType)
+    natRegionAreaSumRas = np.empty(natRas.shape,dtype=dataType)
+    for tile in tiles:
+      minRow,maxRow,_,_ = tile
+      natRegionAreaSumRas[minRow:maxRow] = natRegionAreaIds[RGU.getTileRegions(natRas,tile,labelToRegion)]
 
     # Free rasters and lists.
-    natRegionsRas = None
-    regionAreaRas = None
+    natRas = None
+    tiles = None
+    labelToRegion = None
+    regionAreas = None
     natRegionAreaIds = None
 
     # Save temp raster?
@@ -111,27 +111,34 @@ class GLOBIO_CalcOverallTerrestrialMSA(CalculationBase):
     # Reclass the MSA values in 10 equal 0.1 classes
     Log.info("Reclassifying terrestrial MSA raster in 10 equal 0.1 classes...")
     outRasterCatName = outRasterName.replace(".tif","_10classes.tif")
+    classNoDataValue = RU.getNoDataValue(np.uint8)
     outRasterCat = Raster(outRasterCatName)
-    outRasterCat.initRaster(extent,cellSize,np.int16,noDataValue)
-
-    msaClassValue = 1
-    lowerBoundary = 0.0
-
-    while msaClassValue < 11:
-      upperBoundary = lowerBoundary + 0.1
-      #Log.info("Reclass info class " + str(msaClassValue) + ": boundaries are: " + str(lowerBoundary) + " - " + str(upperBoundary))
-      mask = (outRaster.r != outRaster.noDataValue) & (outRaster.r >= lowerBoundary) & (outRaster.r < upperBoundary)
-      outRasterCat.r[mask] = msaClassValue
-      msaClassValue = msaClassValue + 1
-      lowerBoundary = lowerBoundary + 0.1
+    outRasterCat.initRaster(extent,cellSize,np.uint8,classNoDataValue)
 
     # Reclass the high MSA (>= 0.8) values in value 1
     Log.info("Reclassifying high terrestrial MSA values (>=0.8) in single value (1) raster...")
     outRasterHighName = outRasterName.replace(".tif","_high80.tif")
     outRasterHigh = Raster(outRasterHighName)
-    outRasterHigh.initRaster(extent,cellSize,np.int16,noDataValue)
-    mask = (outRasterCat.r >= 9)
-    outRasterHigh.r[mask] = 1
+    outRasterHigh.initRaster(extent,cellSize,np.uint8,classNoDataValue)
+
+    # Set the class boundaries 0.0, 0.1, ..., 1.0. Class i is 
+    # [boundary i-1, boundary i>. The boundaries are summed like
+    # lowerBoundary + 0.1 and compared with the float32 MSA values.
+    boundaries = [0.0]
+    for _ in range(10):
+      boundaries.append(boundaries[-1] + 0.1)
+    boundaries = np.array(boundaries,dtype=outRaster.dataType)
+
+    # Get the class of all cells in one pass (in blocks of rows).
+    blockNrRows = RU.getArrayBlockNrRows(outRaster.nrCols)
+    for row in range(0,outRaster.nrRows,blockNrRows):
+      msaBlock = outRaster.r[row:row+blockNrRows]
+      classBlock = np.searchsorted(boundaries,msaBlock,side="right")
+      mask = (msaBlock != outRaster.noDataValue) & \
+             (classBlock >= 1) & (classBlock <= 10)
+      outRasterCat.r[row:row+blockNrRows][mask] = classBlock[mask]
+      mask &= (classBlock >= 9)
+      outRasterHigh.r[row:row+blockNrRows][mask] = 1
     
     # Clear mask.
     mask = None
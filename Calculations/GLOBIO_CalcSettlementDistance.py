@@ -41,6 +41,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Grass import Grass
 from GlobioModel.Core.Raster import Raster
 from GlobioModel.Core.Vector import Vector
+from GlobioModel.Workers.GeodesicDistance import GeodesicDistance
 
 #import Convert as CO
 import GlobioModel.Core.RasterUtils as RU
@@ -338,14 +339,8 @@ class GLOBIO_CalcSettlementDistance(CalculationBase):
     # Save the settlements. 
     #-----------------------------------------------------------------------------
 
-    Log.info("Saving settlements...")
-
     # Save settlements selection.
-    settlementsRaster.writeAs(tmpSelSettlementsRasterName)
-
-    # Close and free the raster.
-    settlementsRaster.close()
-    settlementsRaster = None
+    self.writeTmpRaster(settlementsRaster,tmpSelSettlementsRasterName,"Saving settlements")
 
     #-----------------------------------------------------------------------------
     # Calculate nearest distance to settlements. 
@@ -353,18 +348,22 @@ class GLOBIO_CalcSettlementDistance(CalculationBase):
    
     Log.info("Calculating nearest distance to settlements...")
     
-    # Calculate nearest distance to settlements. 
-    gr = Grass()
-    gr.init()
-    gr.distance_V1(extent,cellSize,tmpSelSettlementsRasterName,tmpDistanceRasterName)
-    gr = None
-      
-    # Read distance raster.
-    distanceRaster = Raster(tmpDistanceRasterName)
-    distanceRaster.read()
-
     # Limit distance to maximum value.
     maxDistanceM = maxDistanceKM * 1000.0
+
+    # Calculate nearest distance to settlements. 
+    pDist = GeodesicDistance(GLOB.numberOfCores)
+    distanceRaster = pDist.distance(extent,cellSize,settlementsRaster,
+                                    maxDistance=maxDistanceM)
+    pDist = None
+
+    # Close and free the raster.
+    settlementsRaster.close()
+    settlementsRaster = None
+
+    # Save distance raster.
+    self.writeTmpRaster(distanceRaster,tmpDistanceRasterName,"Saving distances")
+
     mask = (distanceRaster.r >= maxDistanceM)
     distanceRaster.r[mask] = maxDistanceM
     
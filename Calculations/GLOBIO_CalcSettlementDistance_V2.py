@@ -42,6 +42,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Grass import Grass
 from GlobioModel.Core.Raster import Raster
 from GlobioModel.Core.Vector import Vector
+from GlobioModel.Workers.GeodesicDistance import GeodesicDistance
 
 #import Convert as CO
 import GlobioModel.Core.RasterUtils as RU
@@ -356,8 +357,6 @@ class GLOBIO_CalcSettlementDistance_V2(CalculationBase):
     settlementsRaster.r[maskLandBiome] = noDataValue
     # Cleanup mask
     maskLandBiome =None
-    landBiomeMaskRaster.close()
-    landBiomeMaskRaster = None
 
     # Cleanup mask.
     mask = None
@@ -370,14 +369,8 @@ class GLOBIO_CalcSettlementDistance_V2(CalculationBase):
     # Save the settlements. 
     #-----------------------------------------------------------------------------
 
-    Log.info("Saving settlements...")
-
     # Save settlements selection.
-    settlementsRaster.writeAs(tmpSelSettlementsRasterName)
-
-    # Close and free the raster.
-    settlementsRaster.close()
-    settlementsRaster = None
+    self.writeTmpRaster(settlementsRaster,tmpSelSettlementsRasterName,"Saving settlements")
 
     #-----------------------------------------------------------------------------
     # Calculate nearest distance to settlements. 
@@ -385,16 +378,20 @@ class GLOBIO_CalcSettlementDistance_V2(CalculationBase):
    
     Log.info("Calculating nearest distance to settlements...")
 
-    # Calculate nearest distance to settlements. 
-    gr = Grass()
-    gr.init()
-    gr.distance(extent,cellSize,tmpSelSettlementsRasterName,tmpDistanceRasterName,tmpMaskRasterName)
-    #gr.distance(extent,cellSize,tmpSelSettlementsRasterName,tmpDistanceRasterName)
-    gr = None
-      
-    # Read distance raster.
-    distanceRaster = Raster(tmpDistanceRasterName)
-    distanceRaster.read()
+    # Calculate nearest distance to settlements within the land and biome mask. 
+    pDist = GeodesicDistance(GLOB.numberOfCores)
+    distanceRaster = pDist.distance(extent,cellSize,settlementsRaster,
+                                    landBiomeMaskRaster,dataType=np.uint32)
+    pDist = None
+
+    # Close and free the rasters.
+    settlementsRaster.close()
+    settlementsRaster = None
+    landBiomeMaskRaster.close()
+    landBiomeMaskRaster = None
+
+    # Save distance raster.
+    self.writeTmpRaster(distanceRaster,tmpDistanceRasterName,"Saving distances")
 
     # Select valid distance values.
     #distMask = (distanceRaster.r > 0.0)
@@ -78,109 +78,117 @@ class GLOBIO_CalcSplitImpactsMSA(CalculationBase):
     # Enable monitor and show memory and disk space usage.
     MON.showMemDiskUsage(Log,"- ","",self.outDir)
 
-    # Create summed terrestrial MSA loss raster.
-    Log.info("Creating terrestrial MSA loss raster...")
-    noDataValue = -999.0
-    outRasterLoss = Raster(totalLossRasterName)
-    outRasterLoss.initRaster(extent,cellSize,np.float32,noDataValue)
-
-    # Calculate total MSA.
-    Log.info("Calculating total terrestrial MSA loss raster...")
+    # Open the impact MSA rasters. Each raster is read only once, block by
+    # block. Rasters with another extent or cellsize are prepared first.
+    msaRasters = []
     for i in range(len(impactsRasterNames)):
       msaRasterName = impactsRasterNames[i]
       msaDescription = f"impact msa raster {i}"
-
       if (not self.isValueSet(msaRasterName)):
-          continue
+        msaRasters.append(None)
       else:
+        msaRasters.append(self.openAndPrepareInRaster(extent,cellSize,msaRasterName,msaDescription))
 
-          #-----------------------------------------------------------------------------
-          # Read the MSA raster and prepare.
-          #-----------------------------------------------------------------------------
-
-          # Reads the raster and resizes to extent and resamples to cellsize.
-          msaRaster = self.readAndPrepareInRaster(extent,cellSize,msaRasterName,msaDescription)
-
-          # Calculate msa where no nodata.
-          Log.info("- Calculating...")
-
-          if i == 0:
-              firstmask = (msaRaster.r != msaRaster.noDataValue)
-              outRasterLoss.r[firstmask] = (1 - msaRaster.r[firstmask])
-          else:
-              mask = (outRasterLoss.r != outRasterLoss.noDataValue) & (msaRaster.r != msaRaster.noDataValue)
-              outRasterLoss.r[mask] += (1 - msaRaster.r[mask])
-
-          # Clear mask.
-          mask = None
-          firstmask = None
+    # Open the terrestrial MSA raster.
+    msaRasterOverall = self.openAndPrepareInRaster(extent,cellSize,terrRasterName,"terrestrial msa")
 
-          # Close and free the msa raster.
-          msaRaster.close()
-          msaRaster = None
-
-    # Save the terrestrial MSA raster.
-    Log.info("Writing total terrestrial MSA lossraster...")
-    outRasterLoss.write()
-
-    outRasterLoss.close()
+    # Create summed terrestrial MSA loss raster.
+    # The loss is kept in memory per block and is not read back.
+    noDataValue = -999.0
     outRasterLoss = None
-
-  # Calculate individual MSA impacts.
-    Log.info("Calculating individual MSA impacts raster...")
-
-    msaRasterNameOverall = terrRasterName
-    msaDescriptionOverall = "terrestrial msa"
-    msaRasterOverall = self.readAndPrepareInRaster(extent,cellSize,msaRasterNameOverall,msaDescriptionOverall)
-
-    outRasterLossTotal = self.readAndPrepareInRaster(extent,cellSize,totalLossRasterName,"msa loss")
-
+    if self.isValueSet(totalLossRasterName):
+      Log.info("Creating terrestrial MSA loss raster...")
+      outRasterLoss = Raster(totalLossRasterName)
+      outRasterLoss.initRasterEmpty(extent,cellSize,np.float32,noDataValue)
+
+    # Create individual MSA impact rasters.
+    # Initialize with noDataValue.
+    outRasterLossInds = []
     for i in range(len(impactsRasterNames)):
-      msaRasterName = impactsRasterNames[i]
-      msaDescription = f"impact msa raster {i}"
-
-      if (not self.isValueSet(msaRasterName)) or (not self.isValueSet(impactContributionsRasterNames[i])):
-          continue
+      if (msaRasters[i] is None) or (not self.isValueSet(impactContributionsRasterNames[i])):
+        outRasterLossInds.append(None)
       else:
-
-          # Create terrestrial MSA raster.
-          # Initialize with noDataValue.
-          noDataValue = -999.0
-          outRasterLossInd = Raster(impactContributionsRasterNames[i])
-          outRasterLossInd.initRaster(extent,cellSize,np.float32,noDataValue)
-
-          #-----------------------------------------------------------------------------
-          # Read the MSA raster and prepare.
-          #-----------------------------------------------------------------------------
-
-          # Reads the raster and resizes to extent and resamples to cellsize.
-          msaRaster = self.readAndPrepareInRaster(extent,cellSize,msaRasterName,msaDescription)
-
-          # Calculate msa where no nodata.
-          Log.info("- Calculating...")
-
-          # Create mask where total loss = 0.0..
-          zerolossMask = (msaRaster.r != msaRaster.noDataValue) & (msaRasterOverall.r != msaRasterOverall.noDataValue) & (outRasterLossTotal.r == 0.0)
-          outRasterLossInd.r[zerolossMask] = 0.0
-
-          lossMask = (msaRasterOverall.r != msaRasterOverall.noDataValue) & (msaRaster.r != msaRaster.noDataValue) & (outRasterLossTotal.r > 0.0)
-          outRasterLossInd.r[lossMask] = (1-msaRaster.r[lossMask])*(1-msaRasterOverall.r[lossMask])/(outRasterLossTotal.r[lossMask])
-
-            # Clear mask.
-          #zerolossMask = None
-          lossMask = None
-
-          # Close and free the msa raster.
-          msaRaster.close()
-          msaRaster = None
-
-          # Save the terrestrial MSA raster.
-          Log.info("Writing individual loss MSA raster...")
-          outRasterLossInd.write()
-
-          # Cleanup.
-          outRasterLossInd.close()
-          outRasterLossInd = None
+        outRasterLossInd = Raster(impactContributionsRasterNames[i])
+        outRasterLossInd.initRasterEmpty(extent,cellSize,np.float32,noDataValue)
+        outRasterLossInds.append(outRasterLossInd)
+
+    # Get the block windows from an output raster, so full strips are written.
+    windowRaster = msaRasterOverall
+    for outRaster in [outRasterLoss] + outRasterLossInds:
+      if not outRaster is None:
+        windowRaster = outRaster
+        break
+
+    # Calculate total MSA loss and individual MSA impacts block by block.
+    Log.info("Calculating total terrestrial MSA loss and individual MSA impacts rasters...")
+    for minCol,minRow,nrCols,nrRows in windowRaster.getBlockWindows():
+
+      # Read the MSA blocks.
+      msaBlocks = []
+      for msaRaster in msaRasters:
+        if msaRaster is None:
+          msaBlocks.append(None)
+        else:
+          msaBlocks.append(msaRaster.readBlock(minCol,minRow,nrCols,nrRows))
+      msaBlockOverall = msaRasterOverall.readBlock(minCol,minRow,nrCols,nrRows)
+
+      # Calculate total MSA loss where no nodata.
+      lossBlock = np.full((nrRows,nrCols),noDataValue,dtype=np.float32)
+      for i in range(len(msaBlocks)):
+        msaBlock = msaBlocks[i]
+        if msaBlock is None:
+          continue
+        if i == 0:
+          firstmask = (msaBlock != msaRasters[i].noDataValue)
+          lossBlock[firstmask] = (1 - msaBlock[firstmask])
+        else:
+          mask = (lossBlock != noDataValue) & (msaBlock != msaRasters[i].noDataValue)
+          lossBlock[mask] += (1 - msaBlock[mask])
+
+      # Clear mask.
+      mask = None
+      firstmask = None
+
+      if not outRasterLoss is None:
+        outRasterLoss.writeBlock(minCol,minRow,lossBlock)
+
+      # Calculate individual MSA impacts.
+      overallMask = (msaBlockOverall != msaRasterOverall.noDataValue)
+      for i in range(len(msaBlocks)):
+        if outRasterLossInds[i] is None:
+          continue
+        msaBlock = msaBlocks[i]
+        lossIndBlock = np.full((nrRows,nrCols),noDataValue,dtype=np.float32)
+
+        # Create mask where total loss = 0.0..
+        zerolossMask = (msaBlock != msaRasters[i].noDataValue) & overallMask & (lossBlock == 0.0)
+        lossIndBlock[zerolossMask] = 0.0
+
+        lossMask = overallMask & (msaBlock != msaRasters[i].noDataValue) & (lossBlock > 0.0)
+        lossIndBlock[lossMask] = (1-msaBlock[lossMask])*(1-msaBlockOverall[lossMask])/(lossBlock[lossMask])
+
+        outRasterLossInds[i].writeBlock(minCol,minRow,lossIndBlock)
+
+      # Clear masks.
+      zerolossMask = None
+      lossMask = None
+      msaBlocks = None
+
+    # Cleanup.
+    for msaRaster in msaRasters:
+      if not msaRaster is None:
+        msaRaster.close()
+    msaRasters = None
+    msaRasterOverall.close()
+    msaRasterOverall = None
+    if not outRasterLoss is None:
+      outRasterLoss.close()
+      outRasterLoss = None
+    for outRasterLossInd in outRasterLossInds:
+      if not outRasterLossInd is None:
+        outRasterLossInd.close()
+    outRasterLossInds = None
+    windowRaster = None
 
     # Show used memory and disk space.
     MON.showMemDiskUsage()
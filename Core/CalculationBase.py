@@ -857,10 +857,10 @@ class CalculationBase(object):
     if GLOB.gisLib == GLOB.GIS_LIB_ARCGIS:
       Err.raiseGlobioError(Err.NotImplemented1,"readAndPrepareInRaster")
     else:
-      # Read the raster.
+      # Read the raster. Only the part which overlaps the extent is read.
       if not silent:
         Log.info("%sReading %s raster..." % (prefix,inRasterDisplayName))
-      inRaster = Raster(inRasterName).read()
+      inRaster = Raster(inRasterName).readOverlap(extent)
    
       # Show datatype.
       #Log.dbg("readAndPrepareInRaster - DataType: %s" % RU.dataTypeNumpyToString(inRaster.dataType))
@@ -890,6 +890,48 @@ class CalculationBase(object):
       # Return the prepared raster.
       return inRaster
 
+  #-------------------------------------------------------------------------------
+  # Returns the raster for reading blocks (see Raster.readBlock). When the
+  # raster already has the extent and cellsize only the raster info is read,
+  # so the raster can be read block by block. Otherwise the raster is read
+  # and prepared (see readAndPrepareInRaster) and the blocks are views of the
+  # prepared raster data. When tmpRasterName is specified the prepared raster
+  # is written to this raster and opened from there, so the prepared raster
+  # data is not kept in memory. The tmp raster should be deleted by the
+  # caller.
+  def openAndPrepareInRaster(self,extent,cellSize,
+                             inRasterName,inRasterDisplayName,
+                             prefix="",silent=False,tmpRasterName=None):
+    if GLOB.gisLib == GLOB.GIS_LIB_ARCGIS:
+      Err.raiseGlobioError(Err.NotImplemented1,"openAndPrepareInRaster")
+    else:
+      # GDAL raster with the extent and cellsize?
+      if RU.isGdalRasterName(inRasterName):
+        inRaster = Raster(inRasterName)
+        inRaster.readInfo()
+        if RU.isEqualExtent(inRaster.extent,extent,cellSize) and \
+           RU.isEqualCellSize(inRaster.cellSize,cellSize):
+          if not silent:
+            Log.info("%sOpening %s raster..." % (prefix,inRasterDisplayName))
+          return inRaster
+        inRaster.close()
+
+      # Read and prepare the raster.
+      inRaster = self.readAndPrepareInRaster(extent,cellSize,
+                                             inRasterName,inRasterDisplayName,
+                                             prefix,silent)
+      if tmpRasterName is None:
+        return inRaster
+
+      # Write the prepared raster and open it.
+      if RU.rasterExists(tmpRasterName):
+        RU.rasterDelete(tmpRasterName)
+      inRaster.writeAs(tmpRasterName)
+      inRaster.close()
+      inRaster = Raster(tmpRasterName)
+      inRaster.readInfo()
+      return inRaster
+
   #-------------------------------------------------------------------------------
   # Uses read(extent) to read the raster.
   #
@@ -972,19 +1014,17 @@ class CalculationBase(object):
       outRaster = Raster()
       outRaster.initRaster(inRaster.extent,inRaster.cellSize,dataType,noDataValue)
    
-      # Do lookup.
-      cnt = 0
-      prevKey = None
+      # Show intervals.
+      prevKey = lowerBound
       for key in pLookup:
-        # Create mask.
-        if cnt==0:
-          # Set prevkey.
-          prevKey = lowerBound
-          cnt = 1
-  
         Log.dbg("Interval: %s - %s => %s" % (prevKey,key,pLookup[key]))
-        outRaster.r[(inRaster.r > prevKey) & (inRaster.r<= key)] = pLookup[key]
         prevKey = key
+
+      # Do lookup. All classes are looked up in one pass.
+      keys = pLookup.keys()
+      RU.reclassArrayClasses(inRaster.r,lowerBound,
+                             keys,[pLookup[key] for key in keys],
+                             outRaster.r)
         
       return outRaster
 
@@ -1011,13 +1051,12 @@ class CalculationBase(object):
       outRaster.initRaster(self.extent,self.cellSize,dataType,
                            noDataValue,defaultValue)
    
-      # Reclass.
+      # Reclass. All values are looked up in one pass.
       Log.info("Reclassing...")
-      for key in pLookup:
-        # Create mask.
-        mask = (inRaster.r==key)
-        # Set output value using mask.
-        outRaster.raster[mask] = pLookup[key]
+      keys = pLookup.keys()
+      RU.reclassArrayUniqueValues(inRaster.r,
+                                  keys,[pLookup[key] for key in keys],
+                                  outRaster.r)
   
       return outRaster
 
@@ -1051,17 +1090,20 @@ class CalculationBase(object):
       outRaster.initRaster(self.extent,self.cellSize,dataType,
                            noDataValue,defaultValue)
    
-      # Reclass.
-      Log.info("Reclassing...")
+      # Split keys.
+      keys1 = []
+      keys2 = []
+      values = []
       for key in pLookup:
-        # Split key.
         keys = key.split("_")
-        key1 = int(keys[0])
-        key2 = int(keys[1])
-        # Create mask.
-        mask = (inRaster1.r==key1) & (inRaster2.r==key2)
-        # Set output value using mask.
-        outRaster.r[mask] = pLookup[key]
+        keys1.append(int(keys[0]))
+        keys2.append(int(keys[1]))
+        values.append(pLookup[key])
+
+      # Reclass. All key pairs are looked up in one pass.
+      Log.info("Reclassing...")
+      RU.reclassArrayTwoKeys(inRaster1.r,inRaster2.r,keys1,keys2,values,
+                             outRaster.r)
   
       return outRaster
   
@@ -1079,10 +1121,10 @@ class CalculationBase(object):
       if RU.rasterExists(outRasterName):
         Err.raiseGlobioError(Err.RasterAlreadyExists1,outRasterName)
 
-      # Read the input raster.
+      # Read the input raster. Only the part which overlaps the extent is read.
       if not silent:
         Log.info("%sReading %s raster..." % (prefix,os.path.basename(inRasterName)))
-      inRaster = Raster(inRasterName).read()
+      inRaster = Raster(inRasterName).readOverlap(extent)
 
       # Show datatype.
       #Log.dbg("rasterResizeResample - DataType: %s" % RU.dataTypeNumpyToString(inRaster.dataType))
@@ -127,6 +127,15 @@ overwriteOutput = False
 # Number of cores used during parallelization.
 numberOfCores = 0
 
+# Minimal number of cells of a block when reading or writing rasters
+# block by block. Smaller GDAL blocks (i.e. strips) are combined.
+blockMinNrCells = 16 * 1024 * 1024
+
+# Cache of vector features read with VU.vectorReadFeatures.
+# The cache is stored in vectorCacheDir or, when empty, in the user temp dir.
+useVectorCache = False
+vectorCacheDir = ""
+
 # Logging.
 logging = True
 logToFile = True
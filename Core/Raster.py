@@ -306,6 +306,57 @@ class Raster(object):
     # Update raster.
     self.raster = tmpRaster
 
+  #-------------------------------------------------------------------------------
+  # Returns the GDAL block size (xSize,ySize) of the band.
+  # Opens the dataset/band if not already opened.
+  def getBlockSize(self):
+
+    # No dataset/band opened?
+    if self.band is None:
+      # Raster data without dataset? Use strips.
+      if not self.raster is None:
+        return self.nrCols,1
+      # Check if NetCDF raster.
+      if RU.isNetCDFName(self.fileName):
+        Err.raiseGlobioError(Err.UserDefined1,"NetCDF raster type not supported (getBlockSize).")
+      # Open dataset/band and read raster info.
+      self.readInfo()
+
+    # Get block size.
+    blockXSize,blockYSize = self.band.GetBlockSize()
+    return blockXSize,blockYSize
+
+  #-------------------------------------------------------------------------------
+  # Returns a list of windows (minCol,minRow,nrCols,nrRows) which cover the
+  # raster. The windows are aligned with the GDAL block size. When a GDAL
+  # block has less than minNrCells cells (i.e. strips) the blocks are
+  # combined, first horizontal and then vertical.
+  def getBlockWindows(self,minNrCells=None):
+
+    # Check minimal number of cells.
+    if minNrCells is None:
+      minNrCells = GLOB.blockMinNrCells
+
+    # Get block size.
+    blockXSize,blockYSize = self.getBlockSize()
+
+    # Combine blocks horizontal.
+    factor = max(1,int(np.ceil(minNrCells / (blockXSize * blockYSize))))
+    winXSize = min(blockXSize * factor,self.nrCols)
+
+    # Combine blocks vertical.
+    factor = max(1,int(np.ceil(minNrCells / (winXSize * blockYSize))))
+    winYSize = min(blockYSize * factor,self.nrRows)
+
+    # Create windows.
+    windows = []
+    for minRow in range(0,self.nrRows,winYSize):
+      nrRows = min(winYSize,self.nrRows - minRow)
+      for minCol in range(0,self.nrCols,winXSize):
+        nrCols = min(winXSize,self.nrCols - minCol)
+        windows.append((minCol,minRow,nrCols,nrRows))
+    return windows
+
   #-------------------------------------------------------------------------------
   # Returns specified data/region of the raster data
   def getDataByExtent(self,extent):
@@ -670,6 +721,89 @@ class Raster(object):
     # For chaining.
     return self
 
+  #-------------------------------------------------------------------------------
+  # Reads the raster block by block and yields per block a tuple with
+  # (minCol,minRow,data,noDataMask). The blocks are aligned with the GDAL block
+  # size (see getBlockWindows). When the raster data is already available
+  # the blocks are views of the raster data.
+  # Caution: The .raster property is not used and remains unchanged.
+  #
+  # Example:
+  #   for col,row,data,noDataMask in inRaster.readBlocks():
+  #     data[noDataMask] = 0
+  #     outRaster.writeBlock(col,row,data)
+  def readBlocks(self,minNrCells=None):
+
+    # Raster data not available?
+    if self.raster is None:
+
+      # Check if in-memory raster.
+      if (not self.dataset is None) and self.isMemRaster():
+        Err.raiseGlobioError(Err.CannotReadInMemoryRaster)
+
+      # Check if NetCDF raster.
+      if RU.isNetCDFName(self.fileName):
+        Err.raiseGlobioError(Err.UserDefined1,"NetCDF raster type not supported (readBlocks).")
+
+      # Check if raster exist.
+      if not RU.rasterExists(self.fileName):
+        Err.raiseGlobioError(Err.RasterNotFound1,self.fileName)
+
+      # Open dataset/band and read raster info.
+      self.readInfo()
+
+    # Loop the block windows.
+    for minCol,minRow,nrCols,nrRows in self.getBlockWindows(minNrCells):
+      data = self.readBlock(minCol,minRow,nrCols,nrRows)
+      yield minCol,minRow,data,(data == self.noDataValue)
+
+  #-------------------------------------------------------------------------------
+  # Reads 1 block and returns the data. Use getBlockWindows to get the block
+  # positions, i.e. to read blocks of several rasters with the same windows.
+  # When the raster data is already available the block is a view of the
+  # raster data.
+  # Caution: The .raster property is not used and remains unchanged.
+  def readBlock(self,minCol,minRow,nrCols,nrRows):
+
+    # Raster data available?
+    if not self.raster is None:
+      return self.raster[minRow:minRow+nrRows,minCol:minCol+nrCols]
+
+    # Dataset/band not opened?
+    if self.band is None:
+      # Check if NetCDF raster.
+      if RU.isNetCDFName(self.fileName):
+        Err.raiseGlobioError(Err.UserDefined1,"NetCDF raster type not supported (readBlock).")
+      # Check if raster exist.
+      if not RU.rasterExists(self.fileName):
+        Err.raiseGlobioError(Err.RasterNotFound1,self.fileName)
+      # Open dataset/band and read raster info.
+      self.readInfo()
+
+    # Read block: xoff, yoff, xcount, ycount
+    return self.band.ReadAsArray(minCol,minRow,nrCols,nrRows)
+
+  #-------------------------------------------------------------------------------
+  # Reads only the part of the raster which overlaps the specified extent,
+  # instead of reading the full raster extent. Use resize() to get a raster
+  # with the specified extent.
+  # When the raster is not a GDAL raster or the raster does not overlap the
+  # specified extent, the full raster extent is read.
+  def readOverlap(self,extent):
+
+    # GDAL raster?
+    if RU.isGdalRasterName(self.fileName) and RU.rasterExists(self.fileName):
+      # Reads the raster info.
+      self.readInfo()
+      # Calculate overlap extent.
+      alignedExtent = RU.alignExtent(extent,self.cellSize)
+      overlapExtent = RU.calcExtentOverlap(self.extent,alignedExtent)
+      if not overlapExtent is None:
+        return self.read(overlapExtent)
+
+    # Read full raster extent.
+    return self.read()
+
   #-------------------------------------------------------------------------------
   # Reads the raster info (extent,cellsize,nrCols,nrRows,dataType,noDataValue).
   # Opens the dataset/band if not already opened.
@@ -864,6 +998,78 @@ class Raster(object):
     else:
       return nodata
 
+  #-------------------------------------------------------------------------------
+  # Returns per block the value with the highest occurence. When equal counts
+  # the minimum value is used.
+  # The blocks array is a 2d array (nrBlocks,nrValues).
+  def resampleBlocksGetMajorityValue(self,blocks,nodata=None):
+    # Sort the values of each block.
+    blocks = np.sort(blocks,axis=1)
+    # Get the start position of each series of equal values.
+    idx = np.arange(blocks.shape[1],dtype=np.int32)
+    isFirst = np.ones(blocks.shape,dtype=bool)
+    isFirst[:,1:] = (blocks[:,1:] != blocks[:,:-1])
+    first = np.where(isFirst,idx,0)
+    np.maximum.accumulate(first,axis=1,out=first)
+    # Count the equal values. The first maximum count is found at the
+    # end of the longest series with the lowest value.
+    pos = np.argmax(idx - first,axis=1)
+    return blocks[np.arange(blocks.shape[0]),pos]
+
+  #-------------------------------------------------------------------------------
+  # Returns per block the mean value.
+  # The blocks array is a 2d array (nrBlocks,nrValues).
+  # Be aware that the blocks should not contain nodata values!!!
+  def resampleBlocksGetMeanValue(self,blocks,nodata=None):
+    return RU.calcBlockSum(blocks) / blocks.dtype.type(blocks.shape[1])
+
+  #-------------------------------------------------------------------------------
+  # Returns per block the mean value.
+  # The blocks array is a 2d array (nrBlocks,nrValues).
+  # Cells with the nodata value are not used calculating the mean.
+  def resampleBlocksGetMeanValueSkipNoData(self,blocks,nodata):
+    mask = (blocks != nodata)
+    counts = np.sum(mask,axis=1)
+    result = np.full(blocks.shape[0],nodata,dtype=blocks.dtype)
+    # Blocks with the same number of data cells are processed together.
+    for count in np.unique(counts):
+      if count == 0:
+        continue
+      countMask = (counts == count)
+      values = blocks[countMask][mask[countMask]].reshape(-1,count)
+      result[countMask] = RU.calcBlockSum(values) / blocks.dtype.type(count)
+    return result
+
+  #-------------------------------------------------------------------------------
+  # Returns per block the sum value.
+  # The blocks array is a 2d array (nrBlocks,nrValues).
+  # Be aware that the blocks should not contain nodata values!!!
+  def resampleBlocksGetSumValue(self,blocks,nodata=None):
+    return RU.calcBlockSum(blocks)
+
+  #-------------------------------------------------------------------------------
+  # Returns per block the sum value.
+  # The blocks array is a 2d array (nrBlocks,nrValues).
+  # Cells with the nodata value are not used calculating the sum.
+  def resampleBlocksGetSumValueSkipNoData(self,blocks,nodata):
+    mask = (blocks != nodata)
+    counts = np.sum(mask,axis=1)
+    # Integer type? Nodata cells can be set to 0.
+    if not np.issubdtype(blocks.dtype,np.floating):
+      result = RU.calcBlockSum(np.where(mask,blocks,0))
+      result = result.astype(blocks.dtype)
+      result[counts == 0] = nodata
+      return result
+    result = np.full(blocks.shape[0],nodata,dtype=blocks.dtype)
+    # Blocks with the same number of data cells are processed together.
+    for count in np.unique(counts):
+      if count == 0:
+        continue
+      countMask = (counts == count)
+      values = blocks[countMask][mask[countMask]].reshape(-1,count)
+      result[countMask] = RU.calcBlockSum(values)
+    return result
+
   #-------------------------------------------------------------------------------
   # Downsampling:
   #   For integer rasters the majority is calculated. When equal counts the
@@ -929,7 +1135,7 @@ class Raster(object):
         if RU.dataTypeNumpyIsFloat(self.dataType):
           # Skip NoData values?
           if floatSkipNoData:
-            downSampleFunc = self.resampleGetMeanValueSkipNoData
+            downSampleFunc = self.resampleBlocksGetMeanValueSkipNoData
           else:
             # Check for nodata values. Floating point rasters with nodata values
             # can not be resampled.
@@ -937,22 +1143,22 @@ class Raster(object):
             count = np.sum(self.raster==self.noDataValue)
             if count > 0:
               Err.raiseGlobioError(Err.ResamplingRasterContainsNoData1,self.fileName)
-            downSampleFunc = self.resampleGetMeanValue
+            downSampleFunc = self.resampleBlocksGetMeanValue
         else:
-          downSampleFunc = self.resampleGetMajorityValue
+          downSampleFunc = self.resampleBlocksGetMajorityValue
       else:
         # Float type?
         if RU.dataTypeNumpyIsFloat(self.dataType):
           # Skip NoData values?
           if sumDivSkipNoData:
-            downSampleFunc = self.resampleGetSumValueSkipNoData
+            downSampleFunc = self.resampleBlocksGetSumValueSkipNoData
           else:
             # Check for nodata values. Rasters with nodata values can not be resampled.
             # Count the nr of nodata values.
             count = np.sum(self.raster==self.noDataValue)
             if count > 0:
               Err.raiseGlobioError(Err.ResamplingRasterContainsNoData1,self.fileName)
-            downSampleFunc = self.resampleGetSumValue
+            downSampleFunc = self.resampleBlocksGetSumValue
         else:
           # Integer type. Check for minimal int16 type (because of posible overflow for sum).
           # In any other cases an overflow can always occur!!!
@@ -960,14 +1166,14 @@ class Raster(object):
             Err.raiseGlobioError(Err.ResamplingInvalidTypeForSum1,self.fileName)
           # SkipNoData values?
           if sumDivSkipNoData:
-            downSampleFunc = self.resampleGetSumValueSkipNoData
+            downSampleFunc = self.resampleBlocksGetSumValueSkipNoData
           else:
             # Check for nodata values. Rasters with nodata values can not be resampled.
             # Count the nr of nodata values.
             count = np.sum(self.raster==self.noDataValue)
             if count > 0:
               Err.raiseGlobioError(Err.ResamplingRasterContainsNoData1,self.fileName)
-            downSampleFunc = self.resampleGetSumValue
+            downSampleFunc = self.resampleBlocksGetSumValue
 
       # Calculate new number of cols/rows.
       newNrCols,newNrRows = RU.calcNrColsRowsFromExtent(self.extent,toCellSize)
@@ -1008,14 +1214,19 @@ class Raster(object):
 
       #Log.dbg("OutRaster New Cols,Rows: %s %s" % (outRaster.nrCols,outRaster.nrRows))
 
-      # Loop raster blocks.
-      for r in np.arange(0,truncNrRows,step):
-        for c in np.arange(0,truncNrCols,step):
-          # Get value.
-          #outRaster.raster[r/step,c/step] = downSampleFunc(self.raster[r:r+step,c:c+step],noDataValue)
-          rstep = UT.trunc(r/step)
-          cstep = UT.trunc(c/step)
-          outRaster.raster[rstep,cstep] = downSampleFunc(self.raster[r:r+step,c:c+step],noDataValue)
+      # Calculate the number of new rows which are processed at once.
+      nrChunkRows = max(1,GLOB.blockMinNrCells // (truncNrCols * step))
+
+      # Loop raster rows in chunks.
+      for r in range(0,newNrRows,nrChunkRows):
+        r2 = min(r + nrChunkRows,newNrRows)
+        # Get the raster blocks as a 2d array (nrBlocks,step*step). Each row
+        # contains the values of a block in row-major order.
+        blocks = self.raster[r*step:r2*step,0:truncNrCols]
+        blocks = blocks.reshape(r2-r,step,newNrCols,step).swapaxes(1,2)
+        blocks = blocks.reshape(-1,step*step)
+        # Get values.
+        outRaster.raster[r:r2] = downSampleFunc(blocks,noDataValue).reshape(r2-r,newNrCols)
     else:
       # Upsample.
 
@@ -1046,15 +1257,18 @@ class Raster(object):
       # Init raster with nodata.
       outRaster.initRaster(self.extent,toCellSize,self.dataType,noDataValue)
 
-      for r in np.arange(0,self.nrRows):
-        for c in np.arange(0,self.nrCols):
-          r1 = r*step
-          c1 = c*step
-          value = self.raster[r,c]
-          if value != self.noDataValue:
-            value /= divider
-          outRaster.raster[r1:r1+step,c1:c1+step] = np.full((step,step),value,
-                                                            dtype=self.dataType)
+      # Divide the values. NoDataValues are never divided.
+      values = self.raster / divider
+      mask = (self.raster == self.noDataValue)
+      values[mask] = self.raster[mask]
+      del mask
+
+      # Copy each value to a block of step x step cells. The output raster is
+      # viewed as a 4d array (nrRows,step,nrCols,step), so no temporary
+      # upsampled arrays are created.
+      outBlocks = outRaster.raster[0:self.nrRows*step,0:self.nrCols*step]
+      outBlocks = outBlocks.reshape(self.nrRows,step,self.nrCols,step)
+      outBlocks[...] = values[:,np.newaxis,:,np.newaxis]
 
     # Show resampled raster.
     #Log.dbg(str(pResult.outRaster))
@@ -1462,6 +1676,27 @@ class Raster(object):
     self.dataset = newDataset
     self.fileName = newFileName
 
+  #-------------------------------------------------------------------------------
+  # Writes 1 block. Data should be a 2d array. Use readBlocks or getBlockWindows
+  # to get the block positions.
+  # Caution: The .raster property is not used and remains unchanged.
+  def writeBlock(self,minCol,minRow,data):
+
+    # Check if in-memory raster.
+    if self.isMemRaster():
+      Err.raiseGlobioError(Err.CannotSaveInMemoryRaster)
+
+    # Check readonly raster types.
+    self.checkIsReadOnly(self.fileName)
+
+    # Check dataset.
+    if self.dataset is None:
+      Err.raiseGlobioError(Err.UserDefined1,"Raster not initialize for writing...")
+
+    # Write raster block: data, xoff, yoff.
+    self.dataset.GetRasterBand(1).WriteArray(data,minCol,minRow)
+    self.dataset.GetRasterBand(1).FlushCache()
+
   #-------------------------------------------------------------------------------
   # Writes 1 column. Data should be a 2d array.
   # Caution: The .raster property is not used and remains unchanged.
@@ -1690,6 +1925,36 @@ if __name__ == "__main__":
     except:
       Err.showError()        
       
+  #-------------------------------------------------------------------------------
+  def testRasterReadWriteBlocks():
+    try:
+
+      inDir = r""
+      fn = os.path.join(inDir,"esa_copy_30sec.tif")
+      fn2 = os.path.join(inDir,"test_blocks.tif")
+
+      if RU.rasterExists(fn2):
+        RU.rasterDelete(fn2)
+
+      inRas = Raster(fn)
+      inRas.readInfo()
+      print("Block size: %s %s" % inRas.getBlockSize())
+
+      outRas = Raster(fn2)
+      outRas.initRasterEmpty(inRas.extent,inRas.cellSize,inRas.dataType,inRas.noDataValue)
+
+      print("reading/writing blocks...")
+      for col,row,data,noDataMask in inRas.readBlocks():
+        data[~noDataMask] += 100
+        outRas.writeBlock(col,row,data)
+
+      inRas.close()
+      outRas.close()
+
+      print("Ready")
+    except:
+      Err.showError()
+
   #-------------------------------------------------------------------------------
   def testRasterWrite():
     pass
@@ -2399,6 +2664,7 @@ if __name__ == "__main__":
   #testRasterResize2()
   #testRasterResizeAndMerge1()
   #testRasterReadWrite()
+  #testRasterReadWriteBlocks()
   #testRasterWrite()
   #testRasterWriteReadMem()
   #testRasterReadRow()
@@ -206,6 +206,50 @@ def alignExtentGrow(extent,cellSize):
 def asciiGridExists(fileName):
   return os.path.isfile(fileName)
 
+#-------------------------------------------------------------------------------
+# Returns the sum of the values of each row of a 2d array (nrBlocks,nrValues).
+# Float values are summed in the same order as np.sum does for a 1d array,
+# i.e. with pairwise summation in chunks of the numpy buffersize. So the
+# result of each row is identical to np.sum(blocks[i]).
+# Integer values are summed using the default numpy accumulator type.
+def calcBlockSum(blocks):
+
+  # Integer type?
+  if not np.issubdtype(blocks.dtype,np.floating):
+    return np.sum(blocks,axis=1)
+
+  # Pairwise summation of the columns, see numpy pairwise_sum.
+  def pairwiseSum(values):
+    nrValues = values.shape[1]
+    if nrValues < 8:
+      result = np.zeros(values.shape[0],dtype=values.dtype)
+      for i in range(nrValues):
+        result += values[:,i]
+      return result
+    elif nrValues <= 128:
+      r = values[:,0:8].copy()
+      i = 8
+      while i < nrValues - (nrValues % 8):
+        r += values[:,i:i+8]
+        i += 8
+      result = ((r[:,0] + r[:,1]) + (r[:,2] + r[:,3])) + \
+               ((r[:,4] + r[:,5]) + (r[:,6] + r[:,7]))
+      while i < nrValues:
+        result += values[:,i]
+        i += 1
+      return result
+    else:
+      n2 = nrValues // 2
+      n2 -= n2 % 8
+      return pairwiseSum(values[:,:n2]) + pairwiseSum(values[:,n2:])
+
+  # Sum the chunks.
+  bufSize = np.getbufsize()
+  result = np.zeros(blocks.shape[0],dtype=blocks.dtype)
+  for i in range(0,blocks.shape[1],bufSize):
+    result += pairwiseSum(blocks[:,i:i+bufSize])
+  return result
+
 #-------------------------------------------------------------------------------
 # Extent is a list of [minx,miny,maxx,maxy].
 def calcCellSizeFromExtentColsRows(extent,nrCols,nrRows):
@@ -345,6 +389,34 @@ def calcColRowFromXY(x,y,extent,cellSize):
     row += 1
   return (col,row)  
 
+#-------------------------------------------------------------------------------
+# Calculates the cols and rows of arrays of x,y coordinates, the same as
+# calcColRowFromXY. Returns -1 for the cols and rows of points outside the
+# extent.
+def calcColRowFromXYArray(x,y,extent,cellSize):
+  delta = 0.000000000001
+  x = np.asarray(x,np.float64)
+  y = np.asarray(y,np.float64)
+  # Trunc the same as UT.trunc.
+  fx = (x - extent[0]) / cellSize
+  fy = (y - extent[1]) / cellSize
+  col = np.trunc(fx)
+  col[fx - col > 0.99999999999900] += 1
+  row = np.trunc(fy)
+  row[fy - row > 0.99999999999900] += 1
+  col = col.astype(np.int64)
+  row = UT.trunc((extent[3] - extent[1]) / cellSize) - 1 - row.astype(np.int64)
+  # x is upper bound?
+  col[np.abs(extent[2] - x) < delta] -= 1
+  # y is upper bound?
+  row[(extent[3] - y) < delta] += 1
+  # Check if xy not in extent.
+  mask = (x >= extent[0] - delta) & (x <= extent[2] + delta) & \
+         (y >= extent[1] - delta) & (y <= extent[3] + delta)
+  col[~mask] = -1
+  row[~mask] = -1
+  return (col,row)
+
 #-------------------------------------------------------------------------------
 # Calculates the window (col/row offset and size) from an extent within an extent.
 # Returns MinCol, MinRow, NrCols, NrRows.
@@ -798,6 +870,20 @@ def degreeToKM(lon1,lat1,lon2,lat2):
   d = R * c
   return d
 
+#-------------------------------------------------------------------------------
+# Calculates the geodetic distances between arrays of points, the same as
+# degreeToKM.
+def degreeToKMArray(lon1,lat1,lon2,lat2):
+  R = 6371.0 # km
+  dLat = toRad(lat2-lat1)
+  dLon = toRad(lon2-lon1)
+  a1 = np.sin(dLat/2.0) * np.sin(dLat/2.0)
+  a2 = np.cos(toRad(lat1)) * np.cos(toRad(lat2))
+  a3 = np.sin(dLon/2.0) * np.sin(dLon/2.0)
+  a = a1 + a2 * a3
+  c = 2.0 * np.arctan2(np.sqrt(a), np.sqrt(1.0-a))
+  return R * c
+
 #-------------------------------------------------------------------------------
 # Calculates the geodetic distance between 2 point using the geographic library.
 #
@@ -1567,6 +1653,141 @@ def rasterHasExtentCellSize(rasterName,extent,cellSize):
     return False
   return True
 
+#-------------------------------------------------------------------------------
+# Converts lookup keys to the datatype of the array in which they are 
+# searched. Keys which cannot occur in the array (i.e. fractions or values 
+# out of range for integer arrays) are removed.
+# Returns a tuple (keys,mask) with the converted keys and the mask of the
+# used keys.
+def getArrayLookupKeys(keys,dataType):
+  keys = np.asarray(keys)
+  if np.issubdtype(dataType,np.integer):
+    keys = keys.astype(np.float64)
+    info = np.iinfo(dataType)
+    mask = (keys == np.floor(keys)) & (keys >= info.min) & (keys <= info.max)
+  else:
+    mask = np.ones(len(keys),bool)
+  return (keys[mask].astype(dataType),mask)
+
+#-------------------------------------------------------------------------------
+# Returns the number of rows of the blocks in which large arrays are
+# processed, to limit the memory usage.
+def getArrayBlockNrRows(nrCols):
+  return max(1,GLOB.blockMinNrCells // max(1,nrCols))
+
+#-------------------------------------------------------------------------------
+# Reclasses the values of an array using classes with upperbounds, i.e.
+# outArray[(inArray > prevBound) & (inArray <= bound)] = value, where the 
+# first prevBound is the lowerBound. When the bounds are in ascending order
+# the class of all cells is searched at once, so the array is processed in 
+# one pass (in blocks of rows). Cells outside the classes are not changed.
+def reclassArrayClasses(inArray,lowerBound,bounds,values,outArray):
+  if len(bounds) == 0:
+    return
+  values = np.asarray(values).astype(outArray.dtype)
+  # Compare integer arrays with float bounds.
+  if np.issubdtype(inArray.dtype,np.integer):
+    compareType = np.float64
+  else:
+    compareType = inArray.dtype.type
+  bounds = np.asarray(bounds).astype(compareType)
+  lowerBound = compareType(lowerBound)
+  # Bounds not in ascending order? Then reclass class by class.
+  if np.any(np.diff(bounds) < 0):
+    prevBound = lowerBound
+    for bound,value in zip(bounds,values):
+      outArray[(inArray > prevBound) & (inArray <= bound)] = value
+      prevBound = bound
+    return
+  blockNrRows = getArrayBlockNrRows(inArray.shape[1])
+  for row in range(0,inArray.shape[0],blockNrRows):
+    inBlock = inArray[row:row+blockNrRows].astype(compareType,copy=False)
+    outBlock = outArray[row:row+blockNrRows]
+    # Get the class of the cells. Only the first class uses the lowerBound.
+    idx = np.searchsorted(bounds,inBlock,side="left")
+    mask = (idx < len(bounds)) & ((idx > 0) | (inBlock > lowerBound))
+    outBlock[mask] = values[idx[mask]]
+
+#-------------------------------------------------------------------------------
+# Reclasses the values of an array using a lookup, i.e. 
+# outArray[inArray == key] = value for all keys.
+# The keys of all cells are looked up at once, so the array is processed in
+# one pass (in blocks of rows). For integer arrays with a small range of keys
+# a dense lookup table is used, otherwise the keys are searched in the sorted
+# keys. Cells without a key are not changed.
+def reclassArrayUniqueValues(inArray,keys,values,outArray):
+  keys,mask = getArrayLookupKeys(keys,inArray.dtype)
+  values = np.asarray(values)[mask].astype(outArray.dtype)
+  if len(keys) == 0:
+    return
+  # Sort the keys.
+  order = np.argsort(keys,kind="stable")
+  keys = keys[order]
+  values = values[order]
+
+  # Use a dense lookup table?
+  lut = None
+  if np.issubdtype(inArray.dtype,np.integer):
+    minKey = int(keys[0])
+    lutSize = int(keys[-1]) - minKey + 1
+    if lutSize <= 1024 * 1024:
+      lut = np.zeros(lutSize,outArray.dtype)
+      lutValid = np.zeros(lutSize,bool)
+      lut[keys.astype(np.int64) - minKey] = values
+      lutValid[keys.astype(np.int64) - minKey] = True
+
+  blockNrRows = getArrayBlockNrRows(inArray.shape[1])
+  for row in range(0,inArray.shape[0],blockNrRows):
+    inBlock = inArray[row:row+blockNrRows]
+    outBlock = outArray[row:row+blockNrRows]
+    if not lut is None:
+      # Get the lookup table index of the cells.
+      idx = inBlock.astype(np.int64) - minKey
+      mask = (idx >= 0) & (idx < lutSize)
+      idx[~mask] = 0
+      mask &= lutValid[idx]
+      outBlock[mask] = lut[idx[mask]]
+    else:
+      # Search the keys of the cells.
+      idx = np.searchsorted(keys,inBlock)
+      idx[idx == len(keys)] = 0
+      mask = (keys[idx] == inBlock)
+      outBlock[mask] = values[idx[mask]]
+
+#-------------------------------------------------------------------------------
+# Reclasses the values of two arrays using a lookup with combined keys, i.e. 
+# outArray[(inArray1 == key1) & (inArray2 == key2)] = value for all keys.
+# The values are placed in a 2d table with the unique keys of both arrays 
+# as rows and columns. In one pass (in blocks of rows) the row and column
+# of all cells are looked up, after which the values are read from the table.
+# Cells without a key are not changed.
+def reclassArrayTwoKeys(inArray1,inArray2,keys1,keys2,values,outArray):
+  if len(values) == 0:
+    return
+  # Create the table.
+  uniqueKeys1,rows = np.unique(keys1,return_inverse=True)
+  uniqueKeys2,cols = np.unique(keys2,return_inverse=True)
+  table = np.zeros((len(uniqueKeys1),len(uniqueKeys2)),outArray.dtype)
+  tableValid = np.zeros(table.shape,bool)
+  table[rows,cols] = np.asarray(values).astype(outArray.dtype)
+  tableValid[rows,cols] = True
+  rowIds = np.arange(len(uniqueKeys1))
+  colIds = np.arange(len(uniqueKeys2))
+
+  blockNrRows = getArrayBlockNrRows(inArray1.shape[1])
+  for row in range(0,inArray1.shape[0],blockNrRows):
+    outBlock = outArray[row:row+blockNrRows]
+    # Get the table row and column of the cells.
+    idx1 = np.full(outBlock.shape,-1,np.int32)
+    reclassArrayUniqueValues(inArray1[row:row+blockNrRows],
+                             uniqueKeys1,rowIds,idx1)
+    idx2 = np.full(outBlock.shape,-1,np.int32)
+    reclassArrayUniqueValues(inArray2[row:row+blockNrRows],
+                             uniqueKeys2,colIds,idx2)
+    mask = (idx1 >= 0) & (idx2 >= 0)
+    mask[mask] = tableValid[idx1[mask],idx2[mask]]
+    outBlock[mask] = table[idx1[mask],idx2[mask]]
+
 #-------------------------------------------------------------------------------
 # Generate 2d semi-random data with values between 0.0 and 1.0.
 def semiRandomNoiseGet(nrCols: int,nrRows: int):
@@ -16,13 +16,13 @@ import numpy as np
 import scipy.ndimage
 
 # import GlobioModel.Core.Error as Err
-# import GlobioModel.Core.Globals as GLOB
+import GlobioModel.Core.Globals as GLOB
 import GlobioModel.Core.Logger as Log
 
 import GlobioModel.Common.Utils as UT
 
 from GlobioModel.Core.Raster import Raster
-# import GlobioModel.Core.RasterUtils as RU
+import GlobioModel.Core.RasterUtils as RU
 
 #-------------------------------------------------------------------------------
 def calcRegionLanduseAreas(regionRaster: Raster,
@@ -258,6 +258,166 @@ def writeRegionLanduseAreas(regionRaster: Raster,
   UT.fileWrite(outFileName,lines)
 
 
+#-------------------------------------------------------------------------------
+# Groups connected cells with the same value into unique regions, i.e. the
+# same as GRASS r.clump. Cells without data are not clumped.
+# When diagonal is True the diagonal neighbours are connected too
+# (8-connectivity), else only the horizontal and vertical (4-connectivity).
+# Returns a raster with the region numbers 1..n over the whole extent.
+def clumpRaster(inRaster: Raster,diagonal: bool=False,dataType=np.uint32):
+
+  # Set the connectivity.
+  structure = getLabelStructure(diagonal)
+
+  # Create the output raster.
+  outRaster = Raster()
+  outRaster.initRaster(inRaster.extent,inRaster.cellSize,dataType,RU.getNoDataValue(dataType))
+
+  # Get the values to clump.
+  dataMask = inRaster.getDataMask()
+  values = np.unique(inRaster.r[dataMask])
+
+  # Only one value? Then the data cells can be labeled at once.
+  if len(values) <= 1:
+    labels,nrOfLabels = scipy.ndimage.label(dataMask,structure)
+    outRaster.r[dataMask] = labels[dataMask]
+    return outRaster
+
+  # Label the cells of each value and number the regions after the regions
+  # of the previous values.
+  offset = 0
+  for value in values:
+    valueMask = (inRaster.r == value)
+    labels,nrOfLabels = scipy.ndimage.label(valueMask,structure)
+    outRaster.r[valueMask] = labels[valueMask] + offset
+    offset += nrOfLabels
+  return outRaster
+
+#-------------------------------------------------------------------------------
+# Returns the structure for labeling with or without diagonal connections.
+def getLabelStructure(diagonal: bool):
+  if diagonal:
+    return np.ones((3,3),np.uint8)
+  else:
+    return None
+
+#-------------------------------------------------------------------------------
+# Returns the region numbers of the cells of a tile, i.e. a band of rows,
+# created with labelRegionsTiled.
+def getTileRegions(ras: np.ndarray,tile: tuple,labelToRegion: np.ndarray,
+                   diagonal: bool=True):
+  minRow,maxRow,labelOffset,nrLabels = tile
+  # Label the tile again, this gives the same labels as before.
+  labels,_ = scipy.ndimage.label(ras[minRow:maxRow],getLabelStructure(diagonal))
+  # Create a lookup table from the tile labels to the region numbers.
+  tileLUT = np.zeros(nrLabels+1,labelToRegion.dtype)
+  tileLUT[1:] = labelToRegion[labelOffset+1:labelOffset+nrLabels+1]
+  return tileLUT[labels]
+
+#-------------------------------------------------------------------------------
+# Finds the connected regions of the non-zero cells in ras tile by tile, so
+# no label array of the whole raster is needed.
+# Every tile (a band of rows) is labeled separately. The labels which are
+# connected over the seam of two tiles are merged with union-find. The
+# regions are numbered 1..n in the same order as scipy.ndimage.label.
+# When weights is specified (an array with the same number of rows, e.g. a
+# column with cell areas) the weights are summed per region.
+# Returns a tuple (tiles,labelToRegion,nrRegions,regionSums) in which tiles
+# and labelToRegion are used by getTileRegions to get the region numbers of
+# a tile and regionSums[region] is the sum of the weights of a region (index
+# 0 is not used).
+def labelRegionsTiled(ras: np.ndarray,diagonal: bool=True,
+                      weights: np.ndarray=None,nrRowsPerTile: int=0):
+
+  nrRows,nrCols = ras.shape
+  if nrRowsPerTile<=0:
+    nrRowsPerTile = max(1,GLOB.blockMinNrCells // max(1,nrCols))
+
+  structure = getLabelStructure(diagonal)
+
+  tiles = []
+  labelSums = [np.zeros(1)]
+  seamLabels1 = []
+  seamLabels2 = []
+  labelOffset = 0
+  prevRow = None
+  for minRow in range(0,nrRows,nrRowsPerTile):
+    maxRow = min(nrRows,minRow+nrRowsPerTile)
+
+    # Label the tile.
+    labels,nrLabels = scipy.ndimage.label(ras[minRow:maxRow],structure)
+    tiles.append((minRow,maxRow,labelOffset,nrLabels))
+
+    # Sum the weights per label.
+    if not weights is None:
+      tileWeights = np.broadcast_to(weights[minRow:maxRow],labels.shape)
+      labelSums.append(np.bincount(labels.ravel(),tileWeights.ravel(),nrLabels+1)[1:])
+
+    # Get the global labels of the first and last row.
+    firstRow = labels[0].astype(np.int64)
+    firstRow[firstRow>0] += labelOffset
+    lastRow = labels[-1].astype(np.int64)
+    lastRow[lastRow>0] += labelOffset
+    labels = None
+
+    # Get the connected labels over the seam with the previous tile.
+    if not prevRow is None:
+      neighbours = [(slice(None),slice(None))]
+      if diagonal:
+        neighbours += [(slice(1,None),slice(0,-1)),(slice(0,-1),slice(1,None))]
+      for prev,curr in neighbours:
+        mask = (prevRow[prev] > 0) & (firstRow[curr] > 0)
+        seamLabels1.append(prevRow[prev][mask])
+        seamLabels2.append(firstRow[curr][mask])
+    prevRow = lastRow
+    labelOffset += nrLabels
+
+  # Merge the connected labels.
+  parent = np.arange(labelOffset+1,dtype=np.int64)
+  if len(seamLabels1) > 0:
+    labels1 = np.concatenate(seamLabels1)
+    labels2 = np.concatenate(seamLabels2)
+    while True:
+      # Let all labels point to their root.
+      while True:
+        grandParent = parent[parent]
+        if np.array_equal(grandParent,parent):
+          break
+        parent = grandParent
+      # Get the connected labels with a different root.
+      roots1 = parent[labels1]
+      roots2 = parent[labels2]
+      mask = (roots1 != roots2)
+      if not mask.any():
+        break
+      labels1 = labels1[mask]
+      labels2 = labels2[mask]
+      # Join the roots, the largest root points to the smallest.
+      np.minimum.at(parent,np.maximum(roots1[mask],roots2[mask]),
+                    np.minimum(roots1[mask],roots2[mask]))
+  seamLabels1 = None
+  seamLabels2 = None
+
+  # Number the roots, i.e. the regions.
+  isRoot = (parent == np.arange(labelOffset+1))
+  isRoot[0] = False
+  nrRegions = int(isRoot.sum())
+  if nrRegions < np.iinfo(np.uint32).max:
+    dataType = np.uint32
+  else:
+    dataType = np.int64
+  labelToRegion = np.cumsum(isRoot,dtype=dataType)[parent]
+  isRoot = None
+  parent = None
+
+  # Sum the weights per region.
+  if not weights is None:
+    regionSums = np.bincount(labelToRegion,np.concatenate(labelSums),nrRegions+1)
+  else:
+    regionSums = None
+
+  return (tiles,labelToRegion,nrRegions,regionSums)
+
 #-----------------------------------------------------------------------------
 # Creates a list of region codes from the region raster.
 def createRegionListFromRegionRaster(regionRaster: Raster,
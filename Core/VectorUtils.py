@@ -35,12 +35,20 @@
 
 import os
 import math
+import hashlib
+import json
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.spatial
 
 from shapely.geometry import Point,LineString,MultiLineString,Polygon
 from shapely.ops import split,nearest_points
+from shapely.wkb import loads
 
 import GlobioModel.Core.Error as Err
 import GlobioModel.Core.Globals as GLOB
+import GlobioModel.Core.Logger as Log
 
 if GLOB.gisLib == GLOB.GIS_LIB_GDAL:
   import osgeo.ogr as ogr
@@ -55,6 +63,195 @@ import GlobioModel.Common.Utils as UT
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Core.Vector import Vector
 
+#-------------------------------------------------------------------------------
+# Labels the groups of lines which are connected by their nodes, i.e. the lines
+# are only connected at their begin and end points. 
+# beginNodes,endNodes: arrays with the node ids of the lines (see calcLineNodes).
+# stopNodes: optional boolean array per node. The lines are not connected 
+#            through these nodes (i.e. dams).
+# Returns a tuple (groupIds,nrGroups) with an array of the group id per line.
+# The groups are numbered in order of their first line.
+def calcConnectedLineGroups(beginNodes,endNodes,nrNodes,stopNodes=None):
+  nrLines = len(beginNodes)
+  if nrLines == 0:
+    return (np.zeros(0,np.int64),0)
+  lineIds = np.concatenate([np.arange(nrLines),np.arange(nrLines)])
+  nodes = np.concatenate([beginNodes,endNodes])
+  if not stopNodes is None:
+    mask = ~stopNodes[nodes]
+    lineIds = lineIds[mask]
+    nodes = nodes[mask]
+  # Create a graph of lines and nodes and get the connected components.
+  nrVertices = nrLines + nrNodes
+  graph = scipy.sparse.coo_matrix((np.ones(len(lineIds),np.int8),(lineIds,nrLines + nodes)),
+                                  shape=(nrVertices,nrVertices))
+  _,labels = scipy.sparse.csgraph.connected_components(graph,directed=False)
+  # Renumber the groups in order of their first line.
+  _,firstLines,groupIds = np.unique(labels[:nrLines],return_index=True,return_inverse=True)
+  order = np.argsort(firstLines)
+  rank = np.empty(len(order),np.int64)
+  rank[order] = np.arange(len(order))
+  return (rank[groupIds.ravel()],len(order))
+
+#-------------------------------------------------------------------------------
+# Calculates the geodetic lengths of many lines in one call.
+# coordsList: list of lists or arrays of (lon,lat) tuples, one per line.
+# Returns an array with the length in km per line.
+def calcGeodeticLineLengthsKM(coordsList):
+  nrLines = len(coordsList)
+  if nrLines == 0:
+    return np.zeros(0)
+  coordsList = [np.asarray(coords,np.float64).reshape(-1,2) for coords in coordsList]
+  nrCoords = np.array([len(coords) for coords in coordsList])
+  coords = np.concatenate(coordsList)
+  lineIds = np.repeat(np.arange(nrLines),nrCoords)
+  # Only use segments between coords of the same line.
+  mask = (lineIds[:-1] == lineIds[1:])
+  lengthsKM = RU.degreeToKMArray(coords[:-1,0][mask],coords[:-1,1][mask],
+                                 coords[1:,0][mask],coords[1:,1][mask])
+  return np.bincount(lineIds[:-1][mask],lengthsKM,nrLines)
+
+#-------------------------------------------------------------------------------
+# Calculates the geodetic areas (WGS84) of many polygons in one call.
+# polys: list of polygons, each a list of rings (i.e. lists or arrays of
+#        (lon,lat) tuples) with the exterior first and then the holes, or an
+#        array with shape (nrPolys,nrVertices,2) with polygons without holes.
+# Returns an array with the area in km2 per polygon.
+# Remarks:
+# - The rings are projected to an equal-area cylindrical projection of the
+#   ellipsoid (using the authalic latitude), so the areas of cells and cell
+#   parts bounded by meridians and parallels are exact. Other edges are
+#   straight lines in this projection instead of geodesics, so for large
+#   polygons degreeToKM2 is more accurate.
+# - The rings do not need to be closed.
+def calcGeodeticPolygonAreasKM2(polys):
+  if isinstance(polys,np.ndarray):
+    nrPolys = polys.shape[0]
+    rings = list(polys)
+    polyIds = np.arange(nrPolys)
+    signs = np.ones(nrPolys)
+  else:
+    nrPolys = len(polys)
+    rings = []
+    polyIdList = []
+    signList = []
+    for polyId,poly in enumerate(polys):
+      for ringIdx,ring in enumerate(poly):
+        rings.append(ring)
+        polyIdList.append(polyId)
+        signList.append(1.0 if ringIdx == 0 else -1.0)
+    polyIds = np.array(polyIdList,np.int64)
+    signs = np.array(signList)
+  if len(rings) == 0:
+    return np.zeros(nrPolys)
+
+  rings = [np.asarray(ring,np.float64).reshape(-1,2) for ring in rings]
+  nrCoords = np.array([len(ring) for ring in rings])
+  coords = np.concatenate(rings)
+  ringIds = np.repeat(np.arange(len(rings)),nrCoords)
+  starts = np.cumsum(nrCoords) - nrCoords
+
+  # Project to the equal-area projection (x in radians, y in km2/radian).
+  a = 6378.137
+  f = 1.0 / 298.257223563
+  e2 = f * (2.0 - f)
+  e = math.sqrt(e2)
+  sinLat = np.sin(np.radians(coords[:,1]))
+  q = (1.0 - e2) * (sinLat / (1.0 - e2 * sinLat * sinLat) -
+                    np.log((1.0 - e * sinLat) / (1.0 + e * sinLat)) / (2.0 * e))
+  x = np.radians(coords[:,0])
+  y = q * a * a / 2.0
+
+  # Use coords relative to the first coord of the rings for precision.
+  x = x - x[starts][ringIds]
+  y = y - y[starts][ringIds]
+
+  # Get the next coord in the ring, the last one is connected to the first.
+  nextIdx = np.arange(len(coords)) + 1
+  nextIdx[starts + nrCoords - 1] = starts
+
+  # Calculate the ring areas and subtract the holes.
+  ringAreasKM2 = np.abs(np.bincount(ringIds,x * y[nextIdx] - x[nextIdx] * y,len(rings))) / 2.0
+  return np.bincount(polyIds,signs * ringAreasKM2,nrPolys)
+
+#-------------------------------------------------------------------------------
+# Creates the nodes of a network of SHAPELY lines. The begin and end points of
+# the lines within the tolerance distance get the same node id. 
+# Returns a tuple (beginNodes,endNodes,nrNodes) with arrays of the node ids
+# of the begin and end points of the lines.
+def calcLineNodes(lines,tolerance):
+  nrLines = len(lines)
+  if nrLines == 0:
+    return (np.zeros(0,np.int64),np.zeros(0,np.int64),0)
+  # Get the begin and end points.
+  pnts = np.array([line.coords[0][:2] for line in lines] +
+                  [line.coords[-1][:2] for line in lines],np.float64)
+  # Get the pairs of points within the tolerance distance.
+  pairs = scipy.spatial.cKDTree(pnts).query_pairs(tolerance,output_type="ndarray")
+  # Merge the pairs to nodes.
+  graph = scipy.sparse.coo_matrix((np.ones(len(pairs),np.int8),(pairs[:,0],pairs[:,1])),
+                                  shape=(len(pnts),len(pnts)))
+  nrNodes,nodes = scipy.sparse.csgraph.connected_components(graph,directed=False)
+  return (nodes[:nrLines],nodes[nrLines:],nrNodes)
+
+#-------------------------------------------------------------------------------
+# Splits the segments of a line at the cell edges of the raster with the
+# specified extent. The segments are traversed from cell edge to cell edge, so
+# only the crossed cells are visited.
+# coords: list or array of (x,y) tuples.
+# Returns a tuple (cols,rows,u1,v1,u2,v2) with arrays of the cols and rows of
+# the parts and the begin and end of the parts in cell units from the upper
+# left corner of the extent. The cols and rows can be outside the extent.
+def calcLinePartsPerCell(coords,extent,cellSize):
+  coords = np.asarray(coords,np.float64)
+  if len(coords) < 2:
+    return tuple([np.zeros(0,np.int64)] * 2 + [np.zeros(0)] * 4)
+
+  # Get the segments in cell units (cols,rows) from the upper left corner.
+  u0 = (coords[:-1,0] - extent[0]) / cellSize
+  v0 = (extent[3] - coords[:-1,1]) / cellSize
+  du = (coords[1:,0] - extent[0]) / cellSize - u0
+  dv = (extent[3] - coords[1:,1]) / cellSize - v0
+  nrSegs = len(u0)
+  segIds = np.arange(nrSegs)
+
+  # Collect the begin, end and cell edge crossings of the segments as
+  # fractions (t) of the segments.
+  segList = [segIds,segIds]
+  tList = [np.zeros(nrSegs),np.ones(nrSegs)]
+  for a0,da in ((u0,du),(v0,dv)):
+    # Get the first edge and the number of crossed edges.
+    edge1 = np.floor(np.minimum(a0,a0+da)) + 1
+    nrEdges = (np.floor(np.maximum(a0,a0+da)) - edge1 + 1).astype(np.int64)
+    nrEdges[nrEdges < 0] = 0
+    edgeSegs = np.repeat(segIds,nrEdges)
+    edgeOffsets = np.arange(len(edgeSegs)) - np.repeat(np.cumsum(nrEdges) - nrEdges,nrEdges)
+    edges = edge1[edgeSegs] + edgeOffsets
+    segList.append(edgeSegs)
+    tList.append((edges - a0[edgeSegs]) / da[edgeSegs])
+  segs = np.concatenate(segList)
+  ts = np.concatenate(tList)
+
+  # Sort by segment and t. The parts between 2 crossings are in one cell.
+  order = np.lexsort((ts,segs))
+  segs = segs[order]
+  ts = ts[order]
+  mask = (segs[:-1] == segs[1:]) & (ts[:-1] < ts[1:])
+  partSegs = segs[:-1][mask]
+  t1 = ts[:-1][mask]
+  t2 = ts[1:][mask]
+
+  # Get the begin and end of the parts.
+  u1 = u0[partSegs] + t1 * du[partSegs]
+  v1 = v0[partSegs] + t1 * dv[partSegs]
+  u2 = u0[partSegs] + t2 * du[partSegs]
+  v2 = v0[partSegs] + t2 * dv[partSegs]
+
+  # Get the cells of the parts by the part centers.
+  cols = np.floor((u1 + u2) / 2.0).astype(np.int64)
+  rows = np.floor((v1 + v2) / 2.0).astype(np.int64)
+  return (cols,rows,u1,v1,u2,v2)
+
 #-------------------------------------------------------------------------------
 # Creates a regular grid (fishnet) of polygons.
 # Params:
@@ -194,6 +391,36 @@ def getFgdbName(vectorName):
     c = "/"
   return UT.strBeforeLast(vectorName,c)
 
+#-------------------------------------------------------------------------------
+# Returns the name of the cache file of a vector and the stamp (names, 
+# modification times and sizes of the vector files) to check if the cache
+# is still valid.
+def getVectorCacheNameAndStamp(vectorName,fieldNames=None,attrFilter=None):
+  # Get the vector files.
+  if isShapeFileName(vectorName):
+    baseName = os.path.splitext(vectorName)[0]
+    fileNames = [baseName + ext for ext in [".shp",".shx",".dbf",".prj"]]
+  else:
+    fgdbName = getFgdbName(vectorName)
+    fileNames = [fgdbName] + [os.path.join(fgdbName,fileName) 
+                              for fileName in sorted(os.listdir(fgdbName))]
+  stamp = []
+  for fileName in fileNames:
+    if os.path.exists(fileName):
+      stat = os.stat(fileName)
+      stamp.append([os.path.abspath(fileName),stat.st_mtime_ns,stat.st_size])
+  # Create the cache file name. Reads with other fields or filter are
+  # cached separately.
+  key = repr((os.path.abspath(vectorName),fieldNames,attrFilter))
+  cacheName = "%s.%s.npz" % (os.path.basename(vectorName),
+                             hashlib.md5(key.encode("utf-8")).hexdigest()[:8])
+  if GLOB.vectorCacheDir:
+    cacheDir = GLOB.vectorCacheDir
+  else:
+    cacheDir = os.path.join(GLOB.userTempDir,"globio_vector_cache")
+  cacheName = os.path.join(cacheDir,cacheName)
+  return cacheName,json.dumps(stamp)
+
 #-------------------------------------------------------------------------------
 def isShapeFileName(datasourceName):
   return UT.sameText(UT.getFileNameExtension(datasourceName),".shp")
@@ -340,20 +567,48 @@ def shapeFileWriteFeatures(shpFileName,features,fieldNames=None,fieldTypes=None)
 def shpCalcGeodeticLineLengthKM(line):
   # Split multilines.
   lines = shpMultiLineToLines(line)
-  # Loop intersect lines.
-  lengthKM = 0.0
+  # Calculate the lengths of all lines at once.
+  return float(np.sum(calcGeodeticLineLengthsKM([line.coords for line in lines])))
+
+#-------------------------------------------------------------------------------
+# Calculates the geodetic length of a SHAPELY line, multiline or geomcollection
+# per raster cell. The cells are found by traversing the segments of the line
+# from cell edge to cell edge, so only the crossed cells are visited.
+# Returns a tuple (cols,rows,lengthsKM) with arrays of the cols and rows (in
+# the raster with the specified extent) of the crossed cells and the length
+# in km in these cells. The cols and rows can be outside the extent.
+def shpCalcGeodeticLineLengthPerCellKM(line,extent,cellSize):
+  allCols = []
+  allRows = []
+  allLengths = []
+  # Split multilines.
+  lines = shpMultiLineToLines(line)
   for line in lines:
-    for i in range(0,len(line.coords)-1):
-      c1 = line.coords[i]
-      c2 = line.coords[i+1]
-      lengthKM += RU.degreeToKM(c1[0],c1[1],c2[0],c2[1])
-  return lengthKM
+    # Get the parts of the line per cell.
+    cols,rows,u1,v1,u2,v2 = calcLinePartsPerCell(line.coords,extent,cellSize)
+    allCols.append(cols)
+    allRows.append(rows)
+    # Calculate the geodetic lengths of the parts.
+    allLengths.append(RU.degreeToKMArray(extent[0] + u1 * cellSize,
+                                         extent[3] - v1 * cellSize,
+                                         extent[0] + u2 * cellSize,
+                                         extent[3] - v2 * cellSize))
+
+  if len(allLengths) == 0:
+    return (np.zeros(0,np.int64),np.zeros(0,np.int64),np.zeros(0))
+
+  # Sum the lengths per cell.
+  cells,idx = np.unique(np.stack([np.concatenate(allCols),np.concatenate(allRows)],axis=1),
+                        axis=0,return_inverse=True)
+  lengthsKM = np.bincount(idx.ravel(),np.concatenate(allLengths),len(cells))
+  return (cells[:,0],cells[:,1],lengthsKM)
 
 #-------------------------------------------------------------------------------
 # Calculates the geodetic area of a SHAPELY polygon or multipolygon.
 # The area of inner holes is subtracted.
 # Returns the area in km2.
-# CAUTION: This method uses degreeToKM2 which is relative slow.
+# CAUTION: This method uses degreeToKM2 which is relative slow. For many
+#          cells or cell parts use calcGeodeticPolygonAreasKM2.
 def shpCalcGeodeticPolygonAreaKM2(poly):
   # Split multipolygons.
   polys = shpMultiPolygonToPolygons(poly)    
@@ -367,6 +622,98 @@ def shpCalcGeodeticPolygonAreaKM2(poly):
       areaKM2 -= RU.degreeToKM2(interior.coords)
   return areaKM2
 
+#-------------------------------------------------------------------------------
+# Calculates the geodetic area of a SHAPELY polygon or multipolygon per raster
+# cell. The exact covered part of the cells is calculated by scanning the rows.
+# The parts of the rings per cell add the area between the part and the right
+# side of the cell and add the full part height to the cells to the right,
+# which are summed per row. Holes are subtracted. The covered parts are
+# converted to km2 with the geodetic cell area of the row.
+# Returns a tuple (cols,rows,areasKM2) with arrays of the cols and rows (in
+# the raster with the specified extent) of the covered cells and the area in
+# km2 in these cells. Only cells inside the extent are returned.
+def shpCalcGeodeticPolygonAreaPerCellKM2(poly,extent,cellSize):
+  nrCols,nrRows = RU.calcNrColsRowsFromExtent(extent,cellSize)
+  allCols = []
+  allRows = []
+  allHeights = []
+  allXs = []
+  # Split multipolygons.
+  polys = shpMultiPolygonToPolygons(poly)
+  for poly in polys:
+    for ringIdx,ring in enumerate([poly.exterior] + list(poly.interiors)):
+      coords = np.asarray(ring.coords,np.float64)
+      if len(coords) < 3:
+        continue
+      # Make the exterior counterclockwise and the holes clockwise.
+      signedArea = np.sum(coords[:-1,0] * coords[1:,1] - coords[1:,0] * coords[:-1,1])
+      if (signedArea < 0.0) == (ringIdx == 0):
+        coords = coords[::-1]
+      # Get the parts of the ring per cell.
+      cols,rows,u1,v1,u2,v2 = calcLinePartsPerCell(coords,extent,cellSize)
+      allCols.append(cols)
+      allRows.append(rows)
+      allHeights.append(v2 - v1)
+      allXs.append((u1 + u2) / 2.0 - cols)
+
+  if len(allCols) == 0:
+    return (np.zeros(0,np.int64),np.zeros(0,np.int64),np.zeros(0))
+
+  cols = np.concatenate(allCols)
+  rows = np.concatenate(allRows)
+  heights = np.concatenate(allHeights)
+  xs = np.concatenate(allXs)
+
+  # Only use parts in the rows of the extent.
+  mask = (rows >= 0) & (rows < nrRows) & (heights != 0.0)
+  if not mask.any():
+    return (np.zeros(0,np.int64),np.zeros(0,np.int64),np.zeros(0))
+  # The boundingbox can continue right of the last part in the extent.
+  maxCol = min(cols[mask].max(),nrCols-1)
+  # Only use parts left of the right side of the extent.
+  mask &= (cols < nrCols)
+  if (maxCol < 0) or (not mask.any()):
+    return (np.zeros(0,np.int64),np.zeros(0,np.int64),np.zeros(0))
+  cols = cols[mask]
+  rows = rows[mask]
+  heights = heights[mask]
+  xs = xs[mask]
+
+  # Parts left of the extent add the full part height to the first col.
+  leftMask = (cols < 0)
+  cols[leftMask] = 0
+  xs[leftMask] = 0.0
+
+  # Get the cells of the boundingbox within the extent.
+  minCol = cols.min()
+  minRow = rows.min()
+  maxRow = rows.max()
+  cols -= minCol
+  rows -= minRow
+  bbNrCols = maxCol - minCol + 1
+  bbNrRows = maxRow - minRow + 1
+
+  # Add the area right of the parts and the height for the cells to the right.
+  cover = np.zeros((bbNrRows,bbNrCols+1),np.float64)
+  np.add.at(cover,(rows,cols),heights * (1.0 - xs))
+  np.add.at(cover,(rows,cols+1),heights * xs)
+  cover = np.cumsum(cover[:,:-1],axis=1)
+
+  # Get the covered cells.
+  rows,cols = np.nonzero(np.abs(cover) > 1e-12)
+  fractions = np.abs(cover[rows,cols])
+
+  # Calculate the geodetic cell areas of the rows.
+  x1 = np.full(bbNrRows,extent[0])
+  x2 = x1 + cellSize
+  y2 = extent[3] - (minRow + np.arange(bbNrRows)) * cellSize
+  y1 = y2 - cellSize
+  cellCoords = np.stack([np.stack([x1,y1],axis=1),np.stack([x1,y2],axis=1),
+                         np.stack([x2,y2],axis=1),np.stack([x2,y1],axis=1)],axis=1)
+  rowAreasKM2 = calcGeodeticPolygonAreasKM2(cellCoords)
+
+  return (cols + minCol,rows + minRow,fractions * rowAreasKM2[rows])
+
 #-------------------------------------------------------------------------------
 # Extends the line between two SHAPELY points.
 # The new line is extended by factor * original distance between the points.
@@ -822,6 +1169,74 @@ def vectorIntersectByExtent(inVectorName,extent,outVectorName):
   outVector.close()
   outVector = None
 
+#-------------------------------------------------------------------------------
+# Reads the features of a vector as SHAPELY geometries.
+# fieldNames: optional list of fields of which the values are read.
+# attrFilter: optional attribute filter, i.e. "SUB_REGION = 'Pacific'".
+# Returns a tuple (geoms,values) with the list of geometries and a list of 
+# values per feature (one value per field, empty when no fieldNames).
+# Remarks:
+# - When GLOB.useVectorCache is set, the geometries (as WKB) and values are 
+#   cached on disk (see getVectorCacheNameAndStamp). The cache is used when
+#   the vector files are not modified, so repeated runs do not have to read
+#   all features with OGR again. The cache is a numpy .npz file, which is
+#   read without pickle.
+def vectorReadFeatures(vectorName,fieldNames=None,attrFilter=None):
+
+  # Cache valid?
+  if GLOB.useVectorCache:
+    cacheName,stamp = getVectorCacheNameAndStamp(vectorName,fieldNames,attrFilter)
+    if os.path.isfile(cacheName):
+      try:
+        with np.load(cacheName,allow_pickle=False) as cache:
+          if str(cache["stamp"]) == stamp:
+            Log.dbg("Using vector cache: %s" % cacheName)
+            wkbData = cache["wkbData"].tobytes()
+            wkbOffsets = cache["wkbOffsets"]
+            geoms = [loads(wkbData[wkbOffsets[i]:wkbOffsets[i+1]])
+                     for i in range(len(wkbOffsets)-1)]
+            return geoms,json.loads(str(cache["values"]))
+      except Exception:
+        # Invalid cache, read the vector.
+        pass
+
+  # Read the vector.
+  vector = Vector(vectorName)
+  vector.read()
+  if not attrFilter is None:
+    vector.setAttributeFilter(attrFilter)
+  wkbs = []
+  values = []
+  for feat in vector.layer:
+    wkbs.append(bytes(feat.GetGeometryRef().ExportToWkb()))
+    if not fieldNames is None:
+      values.append([feat.GetField(fieldName) for fieldName in fieldNames])
+  vector.close()
+  vector = None
+
+  # Write the cache. Use a temporary file, because other processes can read
+  # the same cache.
+  if GLOB.useVectorCache:
+    tmpCacheName = "%s.%s.tmp" % (cacheName,os.getpid())
+    try:
+      os.makedirs(os.path.dirname(cacheName),exist_ok=True)
+      wkbOffsets = np.zeros(len(wkbs)+1,np.int64)
+      wkbOffsets[1:] = np.cumsum([len(wkb) for wkb in wkbs])
+      with open(tmpCacheName,"wb") as f:
+        np.savez(f,stamp=np.array(stamp),
+                 wkbData=np.frombuffer(b"".join(wkbs),np.uint8),
+                 wkbOffsets=wkbOffsets,
+                 values=np.array(json.dumps(values)))
+      os.replace(tmpCacheName,cacheName)
+    except (OSError,TypeError,ValueError):
+      # No cache, i.e. no write access or values which cannot be stored.
+      Log.dbg("Unable to write vector cache: %s" % cacheName)
+      if os.path.isfile(tmpCacheName):
+        os.remove(tmpCacheName)
+
+  geoms = [loads(wkb) for wkb in wkbs]
+  return geoms,values
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
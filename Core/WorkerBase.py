@@ -27,6 +27,7 @@ import sys
 
 import logging
 import multiprocessing as mp
+from multiprocessing import shared_memory
 import numpy as np
 
 from shapely.geometry import box
@@ -65,6 +66,76 @@ class RasterSH:
   def r(self):
     return self.raster
 
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+# A lightweight raster class (like RasterSH) with the raster data in a
+# multiprocessing shared memory block, to share rasters between pool/worker
+# subprocesses without copying the raster data to every subprocess.
+# When pickled (i.e. passed with initargs) only the name of the shared memory
+# block is pickled. The subprocesses attach to the same shared memory block.
+# The process which creates the SharedRaster should call release() when the
+# raster is no longer used.
+class SharedRaster:
+  raster = None
+  extent = None
+  cellSize = None
+  nrCols = None
+  nrRows = None
+  dataType = None
+  noDataValue = 0
+  shmName = None
+  shm = None
+  isOwner = False
+  #-----------------------------------------------------------------------------
+  def __init__(self,raster):
+    self.extent = raster.extent
+    self.cellSize = raster.cellSize
+    self.nrCols = raster.nrCols
+    self.nrRows = raster.nrRows
+    self.dataType = raster.dataType
+    self.noDataValue = raster.noDataValue
+    # Create shared memory block.
+    self.shm = shared_memory.SharedMemory(create=True,size=max(1,raster.r.nbytes))
+    self.shmName = self.shm.name
+    self.isOwner = True
+    # Copy raster data to shared memory.
+    self.raster = np.ndarray(raster.r.shape,dtype=raster.r.dtype,buffer=self.shm.buf)
+    self.raster[:] = raster.r[:]
+  #-------------------------------------------------------------------------------
+  # Only pickle the raster info and the name of the shared memory block.
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state["raster"] = None
+    state["shm"] = None
+    state["isOwner"] = False
+    state["shape"] = (self.nrRows,self.nrCols)
+    state["dtype"] = self.raster.dtype
+    return state
+  #-------------------------------------------------------------------------------
+  # Attach to the shared memory block.
+  def __setstate__(self,state):
+    shape = state.pop("shape")
+    dtype = state.pop("dtype")
+    self.__dict__.update(state)
+    self.shm = shared_memory.SharedMemory(name=self.shmName)
+    self.raster = np.ndarray(shape,dtype=dtype,buffer=self.shm.buf)
+  #-------------------------------------------------------------------------------
+  # Shortcut to self.raster.
+  @property
+  def r(self):
+    return self.raster
+  #-------------------------------------------------------------------------------
+  # Closes the shared memory block. When this is the creating process the
+  # shared memory block is also released.
+  def release(self):
+    if self.shm is None:
+      return
+    self.raster = None
+    self.shm.close()
+    if self.isOwner:
+      self.shm.unlink()
+    self.shm = None
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 # A class to share global data between pool/worker subprocesses.
@@ -79,61 +150,23 @@ class RasterSH:
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 class SharedData:
-  zoneRaster: RasterSH = None
-  valueRaster: RasterSH = None
-  areaRaster: RasterSH = None
-  labelRaster: RasterSH = None
-  catchRaster: RasterSH = None
+  zoneRaster: SharedRaster = None
+  valueRaster: SharedRaster = None
+  areaRaster: SharedRaster = None
+  labelRaster: SharedRaster = None
+  catchRaster: SharedRaster = None
+  sourceRaster: SharedRaster = None
+  flowRaster: SharedRaster = None
+  flagRaster: SharedRaster = None
   catchRCIDict: dict = None
   damTree = None
   riverTree = None
-
-# #-------------------------------------------------------------------------------
-# #-------------------------------------------------------------------------------
-# # A wrapper for Raster objects for creating multiprocessing shared arrays
-# # which can be accessed by multiple processes.
-# class SharedRaster:
-#   extent = None
-#   cellSize = None
-#   nrCols = None
-#   nrRows = None
-#   noDataValue = 0
-#   raster = None
-#   shArray = None
-#   npArray = None
-#   #-----------------------------------------------------------------------------
-#   def __init__(self,raster=None):
-#     # Check raster.
-#     if raster is None:
-#       return
-#     # Set extent.
-#     self.extent = raster.extent
-#     # Set cellSize.
-#     self.cellSize = raster.cellSize
-#     # Set nrCols.
-#     self.nrCols = raster.nrCols
-#     # Set nrRows.
-#     self.nrRows = raster.nrRows
-#     # Set nodata value.
-#     self.noDataValue = raster.noDataValue
-#     # Set raster.
-#     self.raster = raster
-#     # Get ctype.
-#     cType = RU.dataTypeNumpyToC(raster.dataType)
-#     # Create shared array space.
-#     self.shArray = mp.Array(cType,raster.r.size)
-#     # Convert to numpy array space.
-#     self.npArray = np.frombuffer(self.shArray.get_obj(),raster.dataType)
-#     # Copy raster data to shared space.
-#     self.npArray[:] = raster.r.flatten()
-#
-#   #-------------------------------------------------------------------------------
-#   @property
-#   def r(self):
-#     if not self.npArray is None:
-#       return self.npArray.reshape(self.raster.nrRows,self.raster.nrCols)
-#     else:
-#       return None
+  #-------------------------------------------------------------------------------
+  # Releases the shared memory of the shared rasters.
+  def release(self):
+    for value in self.__dict__.values():
+      if isinstance(value,SharedRaster):
+        value.release()
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
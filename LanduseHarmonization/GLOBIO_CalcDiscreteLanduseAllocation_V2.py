@@ -522,7 +522,7 @@ class GLOBIO_CalcDiscreteLanduseAllocation_V2(CalculationBase):
       # Check allocatable mask.
       if np.sum(allocatableMask) == 0:
         Log.info("%s  No allocatable areas found." % self.indent)
-        exit(0)
+        return
 
       ########### FOR TESTING.
       if GLOB.saveTmpData:
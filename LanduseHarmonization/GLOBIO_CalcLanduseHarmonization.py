@@ -10,10 +10,12 @@
 #-------------------------------------------------------------------------------
 
 import os
+import multiprocessing as mp
 import numpy as np
 import scipy.ndimage
 
 import GlobioModel.Core.Error as Err
+import GlobioModel.Core.Globals as GLOB
 import GlobioModel.Core.Logger as Log
 import GlobioModel.Core.Monitor as MON
 
@@ -23,6 +25,7 @@ from GlobioModel.Core.CSVFile import CSVFile
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 import GlobioModel.Core.RegionUtils as RGU
+from GlobioModel.Core.WorkerBase import WorkerBase
 
 import GlobioModel.Common.Utils as UT
 
@@ -30,6 +33,40 @@ from GlobioModel.LanduseAllocation.LanduseTypes import LanduseTypes
 
 from GlobioModel.LanduseHarmonization.GLOBIO_CalcDiscreteLanduseAllocation_V2 import GLOBIO_CalcDiscreteLanduseAllocation_V2
 
+# The global settings used by the landuse allocation module and the logger.
+# These are passed to the subprocesses, because the globals are not inherited
+# when the subprocesses are spawned (i.e. on Windows).
+allocSettingNames = ["SHOW_TRACEBACK_ERRORS","testing","debug","saveTmpData",
+                     "monitorEnabled","numberOfCores","blockMinNrCells",
+                     "useVectorCache","vectorCacheDir",
+                     "logging","logToFile","logfileBaseName","logfileName",
+                     "gisLib"]
+
+#-------------------------------------------------------------------------------
+# Helper function.
+# Returns a tuple (settings,logIndent) with the global settings used by the
+# landuse allocation module and the current log indent.
+def getLanduseAllocationSettings():
+  settings = {}
+  for name in allocSettingNames:
+    settings[name] = getattr(GLOB,name)
+  return (settings,Log.logger.indent)
+
+#-------------------------------------------------------------------------------
+# Helper function.
+# Runs the landuse allocation module for one year and region.
+# The args are a tuple (allocSettings,allocArgs), see
+# getLanduseAllocationSettings.
+def runLanduseAllocation(args):
+  (settings,logIndent),allocArgs = args
+  # Set the global settings.
+  for name,value in settings.items():
+    setattr(GLOB,name,value)
+  Log.logger.indent = logIndent
+  # Run the landuse allocation.
+  pAlloc = GLOBIO_CalcDiscreteLanduseAllocation_V2()
+  pAlloc.run_v25(*allocArgs)
+
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
 class GLOBIO_CalcLanduseHarmonization(CalculationBase):
@@ -283,6 +320,17 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
     fileName = os.path.join(self.outDir,fileName)
     return fileName
 
+  #-------------------------------------------------------------------------------
+  # Returns the number of cores to use for the given number of tasks.
+  # Uses GLOB.numberOfCores (see WorkerBase).
+  # When saving tmp data 1 core is used, because the tmp rasters of the
+  # allocation module have the same names.
+  def getNumberOfCores(self,nrOfTasks):
+    if GLOB.saveTmpData:
+      return 1
+    nrOfCores = WorkerBase(GLOB.numberOfCores).nrOfCores
+    return max(min(nrOfCores,nrOfTasks),1)
+
   #-------------------------------------------------------------------------------
   def getRegionAreasFileName(self):
     fileName = "regions_areas.csv"
@@ -343,6 +391,36 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
     # Fill areas outside regions with the undefined code.
     outRaster.r[~regionMask] = landuseUndefinedCode
 
+  #-------------------------------------------------------------------------------
+  # Runs the landuse allocation module for each item in allocArgs.
+  # When more than 1 core is used the allocations run in a pool of
+  # subprocesses. Each subprocess runs one allocation, so the memory is
+  # released after each allocation.
+  def runLanduseAllocations(self,allocArgs: list,nrOfCores: int):
+    # Add the global settings.
+    allocSettings = getLanduseAllocationSettings()
+    allocArgs = [(allocSettings,args) for args in allocArgs]
+
+    # Only 1 core?
+    if nrOfCores <= 1:
+      for args in allocArgs:
+        runLanduseAllocation(args)
+      return
+
+    pool = None
+    try:
+      # Create the pool.
+      pool = mp.Pool(processes=nrOfCores,maxtasksperchild=1)
+      pool.map(runLanduseAllocation,allocArgs,chunksize=1)
+      pool.close()
+      pool.join()
+    except KeyboardInterrupt:
+      if not pool is None:
+        print("^C received, shutting down the workers.")
+        pool.close()
+        pool.terminate()
+      raise
+
   #-------------------------------------------------------------------------------
   # Calculates and writes region allocated landuse areas for a year.
   def writeRegionAllocLanduseAreas(self,regionRaster: Raster,
@@ -712,6 +790,9 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
     allocYears = years[1:]
     del years
 
+    # Create a list with the allocation module arguments per year and region.
+    allocArgs = []
+
     # Loop years.
     for i,year in enumerate(allocYears):
 
@@ -746,10 +827,6 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
       # Loop regions.
       for region in regions:
 
-        #Log.info("- Allocating landuse for region %s..." % region)
-        Log.info("")
-        Log.info("    Allocating landuse for region %s..." % region)
-
         # Set region info.
         allocRegionExtent = regionExtents[region]
         allocRegionFilterStr = str(region)
@@ -758,32 +835,45 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
         # Get allocated landuse raster name.
         allocYearRegionRasterName = self.getAllocatedLanduseRegionRasterName(year,region)
 
-        # Run landuse allocation module.
-        pAlloc = GLOBIO_CalcDiscreteLanduseAllocation_V2()
-        pAlloc.run_v25(allocRegionExtent,cellSize,
-                       globioLanduseCodesStr,globioLanduseNamesStr,
-                       globioLandusePriorityCodesStr,
-                       landcoverRasterName,
-                       regionRasterName,
-                       allocRegionFilterStr,
-                       allocRegionExcludeFilterStr,
-                       landuseRasterName,
-                       globioLanduseReplaceCodesStr,
-                       globioLanduseReplaceWithCodeStr,
-                       globioLanduseUndefinedCodeStr,
-                       notAllocatableAreasRasterName,
-                       paReduceFactorRasterName,
-                       suitRasterCodesStr,suitRasterNamesStr,
-                       harmonizedClaimsFileName,
-                       self.claimLanduseFieldName,
-                       self.claimRegionFieldName,
-                       self.claimAreaFieldName,
-                       self.claimLookupFileName,
-                       self.claimAreaMultiplierLanduseCodesStr,
-                       self.claimAreaMultipliersStr,
-                       cellAreaKM2RasterName,
-                       semiRandomNoiseRasterName,
-                       allocYearRegionRasterName)
+        # Add landuse allocation module arguments.
+        allocArgs.append((allocRegionExtent,cellSize,
+                          globioLanduseCodesStr,globioLanduseNamesStr,
+                          globioLandusePriorityCodesStr,
+                          landcoverRasterName,
+                          regionRasterName,
+                          allocRegionFilterStr,
+                          allocRegionExcludeFilterStr,
+                          landuseRasterName,
+                          globioLanduseReplaceCodesStr,
+                          globioLanduseReplaceWithCodeStr,
+                          globioLanduseUndefinedCodeStr,
+                          notAllocatableAreasRasterName,
+                          paReduceFactorRasterName,
+                          suitRasterCodesStr,suitRasterNamesStr,
+                          harmonizedClaimsFileName,
+                          self.claimLanduseFieldName,
+                          self.claimRegionFieldName,
+                          self.claimAreaFieldName,
+                          self.claimLookupFileName,
+                          self.claimAreaMultiplierLanduseCodesStr,
+                          self.claimAreaMultipliersStr,
+                          cellAreaKM2RasterName,
+                          semiRandomNoiseRasterName,
+                          allocYearRegionRasterName))
+
+    #-----------------------------------------------------------------------------
+    # Allocate landuse per year and region.
+    # The allocations are independent, so they can run in parallel.
+    #-----------------------------------------------------------------------------
+
+    # Get number of cores.
+    nrOfCores = self.getNumberOfCores(len(allocArgs))
+
+    Log.info("- Allocating landuse for %s years/regions using %s cores..." % \
+             (len(allocArgs),nrOfCores))
+
+    # Run allocations.
+    self.runLanduseAllocations(allocArgs,nrOfCores)
 
     #-----------------------------------------------------------------------------
     # Merge allocated landuse per year.
@@ -815,6 +905,11 @@ class GLOBIO_CalcLanduseHarmonization(CalculationBase):
         allocLanduseRegionRasterName = self.getAllocatedLanduseRegionRasterName(year,
                                                                                 region)
 
+        # No allocated landuse region raster, i.e. no allocatable areas?
+        if not RU.rasterExists(allocLanduseRegionRasterName):
+          Log.info("    No allocated landuse found for region %s." % region)
+          continue
+
         # Read allocated landuse region raster.
         allocLanduseRegionRaster = Raster(allocLanduseRegionRasterName)
         allocLanduseRegionRaster.read()
@@ -23,9 +23,6 @@
 
 import os
 
-from shapely.wkb import loads
-
-# Import after shapely.
 import osgeo.ogr as ogr
 
 import GlobioModel.Core.Error as Err
@@ -38,7 +35,6 @@ import GlobioModel.Common.Utils as UT
 from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticConnectedRivers import AquaticConnectedRivers
-from GlobioModel.Core.Vector import Vector
 import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
@@ -95,8 +91,7 @@ class GLOBIO_AquaticConnectedRivers(CalculationBase):
     Log.info("Reading river shapefile...")
 
     # Read shapefile.
-    inVector = Vector(inShapeFileName)
-    inVector.read()
+    geoms,values = VU.vectorReadFeatures(inShapeFileName,["Connected"])
 
     # 20201209
     # # Get lines.
@@ -110,19 +105,17 @@ class GLOBIO_AquaticConnectedRivers(CalculationBase):
     # 20201209
     # Get lines.
     lines = []
-    for feat in inVector.layer:
-      line = loads(feat.GetGeometryRef().ExportToWkb())
+    for line,(connected,) in zip(geoms,values):
       tmpLines = VU.shpMultiLineToLines(line)
       for tmpLine in tmpLines:
-        tmpLine.Connected = feat.Connected
+        tmpLine.Connected = connected
         lines.append(tmpLine)
 
     Log.info("Total number of rivers found: %s" % len(lines))    
 
     # Clean up.
-    inVector.close()
-    #inVector = None
-    del inVector
+    geoms = None
+    values = None
 
     #-----------------------------------------------------------------------------
     # Calculate connected rivers.
@@ -20,8 +20,6 @@
 import os
 import numpy as np
 
-from shapely.wkb import loads
-
 # NA shapely.
 #import osgeo.ogr as ogr
 
@@ -37,7 +35,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.RasterFunc import RasterFunc
-from GlobioModel.Core.Vector import Vector
+import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -95,19 +93,11 @@ class GLOBIO_AquaticFragmentationDamDensity(CalculationBase):
 
     Log.info("Reading dams...")
 
-    # Read shapefile.
-    inVector = Vector(damShapeFileName)
-    inVector.read()
-
-    # Get points.
-    points = [loads(feat.GetGeometryRef().ExportToWkb()) for feat in inVector.layer]
+    # Read shapefile and get points.
+    points,_ = VU.vectorReadFeatures(damShapeFileName)
     
     Log.info("Total number of features found: %s" % len(points))    
 
-    # Clean up.
-    inVector.close()
-    inVector = None
-
     #-----------------------------------------------------------------------------
     # Create dam raster.
     #-----------------------------------------------------------------------------
@@ -124,17 +114,16 @@ class GLOBIO_AquaticFragmentationDamDensity(CalculationBase):
 
     Log.info("Rasterizing dams...")
 
+    # Get col/row of raster of all points.
+    cols,rows = RU.calcColRowFromXYArray([point.x for point in points],
+                                         [point.y for point in points],
+                                         extent,cellSize)
+    # Inside the working extent?
+    mask = (cols>=0) & (rows>=0) & (cols<nrCols) & (rows<nrRows)
+
     # Rasterize points with number of dams per cell.
-    for point in points:
-      # Get col/row of raster.
-      col,row = RU.calcColRowFromXY(point.x,point.y,extent,cellSize)
-      # Inside the working extent?
-      if (col>=0) and (row>=0) and (col<nrCols) and (row<nrRows):
-        # Set raster cell value.
-        if damRaster.r[row,col] == damRaster.noDataValue:
-          damRaster.r[row,col] = 1
-        else:
-          damRaster.r[row,col] += 1
+    cells,counts = np.unique(rows[mask] * nrCols + cols[mask],return_counts=True)
+    np.put(damRaster.r,cells,counts.astype(dataType))
 
     mask = damRaster.getDataMask()
     self.dbgPrint("damRaster sum mask %s" % np.sum(damRaster.r[mask]))
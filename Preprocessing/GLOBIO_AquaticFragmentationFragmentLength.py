@@ -13,8 +13,6 @@
 
 import os
 
-from shapely.wkb import loads
-
 # Import after shapely.
 #import osgeo.ogr as ogr
 
@@ -27,7 +25,7 @@ import GlobioModel.Core.Monitor as MON
 from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticFragmentationFragmentLength import AquaticFragmentationFragmentLength
-from GlobioModel.Core.Vector import Vector
+import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -84,23 +82,21 @@ class GLOBIO_AquaticFragmentationFragmentLength(CalculationBase):
     Log.info("Reading river fragments...")
 
     # Read shapefile.
-    inVector = Vector(inRivShapeFileName)
-    inVector.read()
+    geoms,values = VU.vectorReadFeatures(inRivShapeFileName,["RivId","FragId","LengthKM"])
 
     # Get connected lines with RivId.
     multiLines = []
-    for feat in inVector.layer:
-      mline = loads(feat.GetGeometryRef().ExportToWkb())
-      mline.rivId = feat.RivId
-      mline.fragId = feat.FragId
-      mline.lengthKM = feat.LengthKM
+    for mline,(rivId,fragId,lengthKM) in zip(geoms,values):
+      mline.rivId = rivId
+      mline.fragId = fragId
+      mline.lengthKM = lengthKM
       multiLines.append(mline)      
 
     Log.info("Total number of river fragments found: %s" % len(multiLines))    
 
     # Clean up.
-    inVector.close()
-    inVector = None
+    geoms = None
+    values = None
 
     #-----------------------------------------------------------------------------
     # Calculate the fragment length raster.
@@ -15,8 +15,6 @@
 
 import os
 
-from shapely.wkb import loads
-
 # Import after shapely.
 #import osgeo.ogr as ogr
 
@@ -30,7 +28,7 @@ import GlobioModel.Common.Utils as UT
 from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticFragmentationRCI import AquaticFragmentationRCI
-from GlobioModel.Core.Vector import Vector
+import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -97,22 +95,20 @@ class GLOBIO_AquaticFragmentationRCI(CalculationBase):
     Log.info("Reading river fragments...")
 
     # Read shapefile.
-    inVector = Vector(inRivShapeFileName)
-    inVector.read()
+    geoms,values = VU.vectorReadFeatures(inRivShapeFileName,["FragId","LengthKM"])
 
     # Get connected lines.
     multiLines = []
-    for feat in inVector.layer:
-      mline = loads(feat.GetGeometryRef().ExportToWkb())
-      mline.fragId = feat.FragId
-      mline.lengthKM = feat.LengthKM
+    for mline,(fragId,lengthKM) in zip(geoms,values):
+      mline.fragId = fragId
+      mline.lengthKM = lengthKM
       multiLines.append(mline)      
 
     Log.info("Total number of river fragments found: %s" % len(multiLines))    
 
     # Clean up.
-    inVector.close()
-    inVector = None
+    geoms = None
+    values = None
 
     #-------------------------------------------------------------------------------
     # Read raster.
@@ -15,8 +15,6 @@
 import os
 import numpy as np
 
-from shapely.wkb import loads
-
 import GlobioModel.Core.Error as Err
 import GlobioModel.Core.Globals as GLOB
 import GlobioModel.Core.Logger as Log
@@ -29,7 +27,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticLakeReservoirFractions import AquaticLakeReservoirFractions
-from GlobioModel.Core.Vector import Vector
+import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -159,19 +157,10 @@ class GLOBIO_AquaticLakeReservoirFractions(CalculationBase):
         attrFilter = "(%s) and (%s <=  %s)" % (attrFilter,depthFieldName,depthThresholdM)
       self.dbgPrint("  Using filter: %s" % attrFilter)    
         
-      # Read the shapefile.
-      inVector = Vector(inShapeFileName)
-      inVector.read()
-      inVector.setAttributeFilter(attrFilter)
-  
-      # Get the lake and reservoir polygons.
-      polys = [loads(feat.GetGeometryRef().ExportToWkb()) for feat in inVector.layer]
+      # Read the shapefile and get the lake and reservoir polygons.
+      polys,_ = VU.vectorReadFeatures(inShapeFileName,attrFilter=attrFilter)
 
       Log.info("Total number of features found: %s" % len(polys))    
-
-      # Clean up.
-      inVector.close()
-      inVector = None
       
       #-----------------------------------------------------------------------------
       # Calculate the watertype area raster.
@@ -12,8 +12,6 @@
 import os
 import numpy as np
 
-from shapely.wkb import loads
-
 import GlobioModel.Core.Error as Err
 import GlobioModel.Core.Globals as GLOB
 import GlobioModel.Core.Logger as Log
@@ -26,7 +24,7 @@ from GlobioModel.Core.CalculationBase import CalculationBase
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticRiverFractions import AquaticRiverFractions
-from GlobioModel.Core.Vector import Vector
+import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
 #-------------------------------------------------------------------------------
@@ -81,19 +79,11 @@ class GLOBIO_AquaticRiverFractions(CalculationBase):
 
     Log.info("Reading shapefile...")
 
-    # Read shapefile.
-    inVector = Vector(rivShapeFileName)
-    inVector.read()
-
-    # Get lines.
-    lines = [loads(feat.GetGeometryRef().ExportToWkb()) for feat in inVector.layer]
+    # Read shapefile and get lines.
+    lines,_ = VU.vectorReadFeatures(rivShapeFileName)
 
     Log.info("Total number of features found: %s" % len(lines))    
 
-    # Clean up.
-    inVector.close()
-    inVector = None
-
     #-----------------------------------------------------------------------------
     # Calculate the watertype length raster.
     #-----------------------------------------------------------------------------
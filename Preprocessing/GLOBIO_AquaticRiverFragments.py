@@ -16,9 +16,6 @@
 
 import os
 
-from shapely.wkb import loads
-
-# Import after shapely.
 import osgeo.ogr as ogr
 
 import GlobioModel.Core.Error as Err
@@ -31,7 +28,6 @@ import GlobioModel.Common.Utils as UT
 from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Workers.AquaticRiverFragments import AquaticRiverFragments
-from GlobioModel.Core.Vector import Vector
 import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
@@ -91,23 +87,21 @@ class GLOBIO_AquaticRiverFragments(CalculationBase):
     Log.info("Reading dams...")
 
     # Read shapefile.
-    inVector = Vector(inDamShapeFileName)
-    inVector.read()
+    geoms,values = VU.vectorReadFeatures(inDamShapeFileName,["Connected"])
 
     # Get points.
     points = []
-    for feat in inVector.layer:
-      point = loads(feat.GetGeometryRef().ExportToWkb())
+    for point,(connected,) in zip(geoms,values):
       # Connected to a river?
-      if feat.Connected == 1:
+      if connected == 1:
         # Add to list.
         points.append(point)      
 
     Log.info("Total number of dams connected to rivers found: %s" % len(points))    
 
     # Clean up.
-    inVector.close()
-    inVector = None
+    geoms = None
+    values = None
 
     #---------------------------------------------------------------------------
     # Read features. 
@@ -116,21 +110,19 @@ class GLOBIO_AquaticRiverFragments(CalculationBase):
     Log.info("Reading rivers...")
 
     # Read shapefile.
-    inVector = Vector(inRivShapeFileName)
-    inVector.read()
+    geoms,values = VU.vectorReadFeatures(inRivShapeFileName,["RivId"])
 
     # Get connected lines with RivId.
     multiLines = []
-    for feat in inVector.layer:
-      mline = loads(feat.GetGeometryRef().ExportToWkb())
-      mline.rivId = feat.RivId
+    for mline,(rivId,) in zip(geoms,values):
+      mline.rivId = rivId
       multiLines.append(mline)      
 
     Log.info("Total number of connected rivers found: %s" % len(multiLines))    
 
     # Clean up.
-    inVector.close()
-    inVector = None
+    geoms = None
+    values = None
 
     #-----------------------------------------------------------------------------
     # Calculate the river fragments.
@@ -28,7 +28,6 @@
 import os
 
 from shapely.strtree import STRtree
-from shapely.wkb import loads
 
 # Import after shapely.
 import osgeo.ogr as ogr
@@ -42,7 +41,6 @@ import GlobioModel.Common.Utils as UT
 
 from GlobioModel.Core.CalculationBase import CalculationBase
 import GlobioModel.Core.RasterUtils as RU
-from GlobioModel.Core.Vector import Vector
 import GlobioModel.Core.VectorUtils as VU
 
 #-------------------------------------------------------------------------------
@@ -209,25 +207,17 @@ class GLOBIO_AquaticSplitRivers(CalculationBase):
     Log.info("Reading river shapefile...")
 
     # Read shapefile.
-    inVector = Vector(inRivShapeFileName)
-    inVector.read()
+    lines,_ = VU.vectorReadFeatures(inRivShapeFileName)
 
-    # Get lines, initialize Connected property.
-    lines = []
+    # Initialize Connected property.
     FID = 0
-    for feat in inVector.layer:
-      line = loads(feat.GetGeometryRef().ExportToWkb())
+    for line in lines:
       line.Connected = 0
       line.FID = FID
-      lines.append(line)      
       FID += 1
 
     Log.info("Total number of rivers found: %s" % len(lines))    
 
-    # Clean up.
-    inVector.close()
-    inVector = None
-
     #---------------------------------------------------------------------------
     # Read features. 
     #---------------------------------------------------------------------------
@@ -235,25 +225,17 @@ class GLOBIO_AquaticSplitRivers(CalculationBase):
     Log.info("Reading dam shapefile...")
 
     # Read shapefile.
-    inVector = Vector(inDamShapeFileName)
-    inVector.read()
+    points,_ = VU.vectorReadFeatures(inDamShapeFileName)
 
-    # Get points, initialize FID.
-    points = []
+    # Initialize FID.
     FID = 0
-    for feat in inVector.layer:
-      point = loads(feat.GetGeometryRef().ExportToWkb())
+    for point in points:
       point.Connected = 0
       point.FID = FID
-      points.append(point)      
       FID += 1
       
     Log.info("Total number of dams found: %s" % len(points))    
 
-    # Clean up.
-    inVector.close()
-    inVector = None
-
     #-----------------------------------------------------------------------------
     # Calculate connected rivers.
     #-----------------------------------------------------------------------------
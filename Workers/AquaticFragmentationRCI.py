@@ -37,8 +37,6 @@ import multiprocessing as mp
 import numpy as np
 
 from shapely import speedups
-from shapely.geometry import Polygon
-from shapely.prepared import prep
 from shapely.strtree import STRtree
 
 import GlobioModel.Core.Logger as Log
@@ -47,7 +45,7 @@ from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 import GlobioModel.Core.VectorUtils as VU
 #from GlobioModel.Core.WorkerBase import SharedRaster
-from GlobioModel.Core.WorkerBase import RasterSH
+from GlobioModel.Core.WorkerBase import SharedRaster
 from GlobioModel.Core.WorkerBase import SharedData
 from GlobioModel.Core.WorkerBase import WorkerBase
 from GlobioModel.Core.WorkerBase import WorkerProgress
@@ -116,7 +114,6 @@ class AquaticFragmentationRCI(WorkerBase):
     # Get arguments.
     lock = args[0]
     coreId = args[1]
-    cellSize = args[2]
     fragmentObjects = args[3]
 
     #self.dbgPrint("  %s - calculate_rci" % (coreId))
@@ -148,9 +145,6 @@ class AquaticFragmentationRCI(WorkerBase):
     catchLengthDict = dict()
     fragCatchLengthDict = dict()
 
-    # Create a small offset for the cell origin.
-    d = cellSize / 10.0
-
     #self.dbgPrint("  Calculating lengths...")
 
     # Init progress.
@@ -170,85 +164,36 @@ class AquaticFragmentationRCI(WorkerBase):
       
       #self.dbgPrint("  %s - Processing fragId: %s %s" % (coreId,fragId))
       
-      # Get prepared fragment line.
-      prepFragmentLine = prep(fragmentLine)
-      
-      # Calculate coordinates of origin and the number of cols and rows of 
-      # the fragment line boundingbox.
-      minx,miny,cols,rows = VU.shpLineCalcOriginNrColsRows(fragmentLine,cellSize)
-      
-      # Create a grid fishnet over the fragments and calculate length per cell.
-      y1 = miny
-      y2 = y1 + cellSize
-      # Loop rows.
-      for _ in range(rows):
-        x1 = minx
-        x2 = x1 + cellSize
-        # Loop cols.
-        for _ in range(cols):
-
-          # Create the cell polygon.
-          cell = Polygon([(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)])
-
-          # Does fragment line intersects cell?
-          if prepFragmentLine.intersects(cell):
-          
-            # Get col/row of the catchment cell.
-            # 20201208
-            # catchCol,catchRow = RU.calcColRowFromXY(x1+d,y1+d,
-            #                                         catchRasterSH.extent,
-            #                                         catchRasterSH.cellSize)
-            catchCol,catchRow = RU.calcColRowFromXY(x1+d,y1+d,
-                                                    catchRaster.extent,
-                                                    catchRaster.cellSize)
-
-            # Inside the catchment extent?
-            if (catchCol>=0) and (catchRow>=0) and \
-               (catchCol<nrCols) and (catchRow<nrRows):
-
-              # 20201208
-              # Get catchment id from catchment raster.
-              # catchId = catchRasterSH.r[catchRow,catchCol]
-              catchId = catchRaster.r[catchRow,catchCol]
-
-              # No nodata?
-              # 20201118
-              #if catchId <> catchRasterSH.noDataValue:
-              # 20201208
-              # if catchId != catchRasterSH.noDataValue:
-              if catchId != catchRaster.noDataValue:
-
-                # Get fragment intersections with the cell.
-                intersections = fragmentLine.intersection(cell)
-                if intersections.is_empty:
-                  # Set length.
-                  lengthKM = 0.0
-                else:
-                  # Calculate geodetic length.
-                  lengthKM = 0.0
-                  intersections = VU.shpMultiLineToLines(intersections)
-                  for intersection in intersections:
-                    lengthKM += VU.shpCalcGeodeticLineLengthKM(intersection)
-                  
-                # Add length to catch dict.
-                try:
-                  catchLengthDict[catchId]+=lengthKM
-                except KeyError:
-                  catchLengthDict[catchId]=lengthKM
-
-                # Add length to frag/catch dict.
-                try:
-                  fragCatchLengthDict[(fragId,catchId)]+=lengthKM
-                except KeyError:
-                  fragCatchLengthDict[(fragId,catchId)]=lengthKM                  
-
-          # Set next column.
-          x1 += cellSize
-          x2 += cellSize
-          
-        # Set next row.
-        y1 += cellSize
-        y2 += cellSize
+      # Calculate the geodetic length per crossed catchment cell.
+      catchCols,catchRows,lengthsKM = VU.shpCalcGeodeticLineLengthPerCellKM(fragmentLine,
+                                                                           catchRaster.extent,
+                                                                           catchRaster.cellSize)
+
+      # Inside the catchment extent?
+      mask = (catchCols>=0) & (catchRows>=0) & \
+             (catchCols<nrCols) & (catchRows<nrRows)
+      catchIds = catchRaster.r[catchRows[mask],catchCols[mask]]
+      lengthsKM = lengthsKM[mask]
+
+      # No nodata?
+      mask = (catchIds != catchRaster.noDataValue)
+      catchIds = catchIds[mask]
+      lengthsKM = lengthsKM[mask]
+
+      # Loop catchment cells.
+      for catchId,lengthKM in zip(catchIds.tolist(),lengthsKM.tolist()):
+
+        # Add length to catch dict.
+        try:
+          catchLengthDict[catchId]+=lengthKM
+        except KeyError:
+          catchLengthDict[catchId]=lengthKM
+
+        # Add length to frag/catch dict.
+        try:
+          fragCatchLengthDict[(fragId,catchId)]+=lengthKM
+        except KeyError:
+          fragCatchLengthDict[(fragId,catchId)]=lengthKM                  
    
     return (catchLengthDict,fragCatchLengthDict)
 
@@ -273,9 +218,6 @@ class AquaticFragmentationRCI(WorkerBase):
     # Get nrCols and nrRows.    
     nrCols,nrRows = RU.calcNrColsRowsFromExtent(extent,cellSize)
 
-    # Create a small offset for the cell origin.
-    d = cellSize / 10.0
-
     # Create an array for the output RCI.
     ras = np.zeros((nrRows,nrCols),np.float32)
 
@@ -293,64 +235,27 @@ class AquaticFragmentationRCI(WorkerBase):
       # Get fragment properties.
       fragmentLine = fragmentObject.line
       
-      # Get prepared fragment line.
-      prepFragmentLine = prep(fragmentLine)
-      
-      # Calculate coordinates of origin and the number of cols and rows of 
-      # the fragment line boundingbox.
-      minx,miny,cols,rows = VU.shpLineCalcOriginNrColsRows(fragmentLine,cellSize)
-      
-      # Create a grid fishnet over the fragments and calculate length per cell.
-      y1 = miny
-      y2 = y1 + cellSize
-      # Loop rows.
-      for _ in range(rows):
-        x1 = minx
-        x2 = x1 + cellSize
-        # Loop cols.
-        for _ in range(cols):
-          
-          # Get col/row of the cell in work raster.
-          col,row = RU.calcColRowFromXY(x1+d,y1+d,extent,cellSize)
-          
-          # Inside the working extent?
-          if (col>=0) and (row>=0) and (col<nrCols) and (row<nrRows):
-            
-            # Create the cell polygon.
-            cell = Polygon([(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)])
-            
-            # Does fragment line intersects cell?
-            if prepFragmentLine.intersects(cell):
-            
-              # Get catchment id from shared raster.
-              # 20201208
-              # catchCol,catchRow = RU.calcColRowFromXY(x1+d,y1+d,
-              #                                         catchRasterSH.extent,
-              #                                         catchRasterSH.cellSize)
-              catchCol,catchRow = RU.calcColRowFromXY(x1+d,y1+d,
-                                                      catchRaster.extent,
-                                                      catchRaster.cellSize)
-              # 20201208
-              #catchId = catchRasterSH.r[catchRow,catchCol]
-              catchId = catchRaster.r[catchRow,catchCol]
-
-              # No nodata?
-              # 20201118
-              #if catchId <> catchRasterSH.noDataValue:
-              # 20201208
-              # if catchId != catchRasterSH.noDataValue:
-              if catchId != catchRaster.noDataValue:
-                # Set raster rci value.
-                # 20201208
-                #ras[row,col] = catchRCIDictSH[(catchId)]
-                ras[row,col] = catchRCIDict[(catchId)]
-
-          # Set next column.
-          x1 += cellSize
-          x2 += cellSize
-        # Set next row.
-        y1 += cellSize
-        y2 += cellSize
+      # Get the cells in the work raster crossed by the fragment.
+      cols,rows,_ = VU.shpCalcGeodeticLineLengthPerCellKM(fragmentLine,extent,cellSize)
+
+      # Inside the working extent?
+      mask = (cols>=0) & (rows>=0) & (cols<nrCols) & (rows<nrRows)
+      cols = cols[mask]
+      rows = rows[mask]
+
+      # Get catchment ids from shared raster using the cell centers.
+      x = extent[0] + (cols + 0.5) * cellSize
+      y = extent[3] - (rows + 0.5) * cellSize
+      catchCols = np.floor((x - catchRaster.extent[0]) / catchRaster.cellSize).astype(np.int64)
+      catchRows = np.floor((catchRaster.extent[3] - y) / catchRaster.cellSize).astype(np.int64)
+      catchIds = catchRaster.r[catchRows,catchCols]
+
+      # Loop cells.
+      for row,col,catchId in zip(rows.tolist(),cols.tolist(),catchIds.tolist()):
+        # No nodata?
+        if catchId != catchRaster.noDataValue:
+          # Set raster rci value.
+          ras[row,col] = catchRCIDict[(catchId)]
 
     return (ras,)
 
@@ -368,6 +273,7 @@ class AquaticFragmentationRCI(WorkerBase):
     #global catchRasterSH,catchRCIDictSH
     global sharedDataSH
     pool = None
+    sharedData = None
     try:
     
       # Check nrOfChunks.
@@ -384,7 +290,7 @@ class AquaticFragmentationRCI(WorkerBase):
       # 20201208
       #catchRasterSH = SharedRaster(catchRaster)
       sharedData = SharedData()
-      sharedData.catchRaster = RasterSH(catchRaster)
+      sharedData.catchRaster = SharedRaster(catchRaster)
 
       # Create tree and get fragment lines within extent.
       fragmentLinesTree = STRtree(fragmentLines)
@@ -484,9 +390,7 @@ class AquaticFragmentationRCI(WorkerBase):
       #catchRCIDictSH = {key: length * 100 for key,length in catchSumDict.iteritems()}
       # 20201208
       #catchRCIDictSH = {key: length * 100 for key,length in catchSumDict.items()}
-      # TODO: Is dit nodig? Is al een keer gemaakt. DENK HET WEL!
-      sharedData = SharedData()
-      sharedData.catchRaster = RasterSH(catchRaster)
+      # The shared catchment raster is reused, only the rci dict is added.
       sharedData.catchRCIDict = {key: length * 100 for key,length in catchSumDict.items()}
 
       #-------------------------------------------------------------------------
@@ -566,3 +470,7 @@ class AquaticFragmentationRCI(WorkerBase):
         #pool = None
         del pool
       return None
+    finally:
+      # Release the shared raster.
+      if not sharedData is None:
+        sharedData.release()
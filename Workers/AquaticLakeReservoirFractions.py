@@ -18,8 +18,7 @@
 import multiprocessing as mp
 import numpy as np
 
-from shapely.geometry import Polygon,box
-from shapely.prepared import prep
+from shapely.geometry import box
 from shapely.strtree import STRtree
 
 import GlobioModel.Core.Logger as Log
@@ -62,61 +61,16 @@ class AquaticLakeReservoirFractions(WorkerBase):
     # Create an raster for the area.
     ras = np.zeros((nrRows,nrCols),np.float16)
 
-    # Create a small offset for the cell origin.
-    d = cellSize / 10.0
-    
     # Loop polygons.
     for poly in polys:
-      # Create prepared polygon for later use.
-      prepPoly = prep(poly)
-      # Calculate origin coords and number of cols and rows of the polygon boundingbox.
-      minx,miny,cols,rows = VU.shpLineCalcOriginNrColsRows(poly,cellSize)
-      # Create a grid fishnet over the polygon and calculate area per cell.
-      y1 = miny
-      y2 = y1 + cellSize
-      # Loop rows.
-      for _ in range(rows):
-        x1 = minx
-        x2 = x1 + cellSize
-        # Reset rowCellAreaKM2 (does not vary in one row, i.e. lattitude).
-        rowCellAreaKM2 = None
-        # Loop cols.
-        for _ in range(cols):
-          # Get col/row of raster.
-          col,row = RU.calcColRowFromXY(x1+d,y1+d,extent,cellSize)
-          # Inside the working extent?
-          if (col>=0) and (row>=0) and (col<nrCols) and (row<nrRows):
-            # Create the cell polygon.
-            cell = Polygon([(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)])
-            # Does the polygon fully contains the cell?
-            areaKM2 = None
-            if prepPoly.contains(cell):
-              # rowCellAreaKM2 not yet calculated?
-              if rowCellAreaKM2 is None:
-                rowCellAreaKM2 = VU.shpCalcGeodeticPolygonAreaKM2(cell)
-              # Set full area of cell.
-              areaKM2 = rowCellAreaKM2
-            else:
-              # 20201209
-              # Check the polygon geometry for self-intersections.
-              if not poly.is_valid:
-                poly = poly.buffer(0)
-              # Get intersection with the cell.
-              intersections = poly.intersection(cell)
-              # Not empty?
-              if not intersections.is_empty:
-                # Calculate intersection polygon area.
-                areaKM2 = VU.shpCalcGeodeticPolygonAreaKM2(intersections)
-            # Valid area?
-            if not areaKM2 is None:
-              # Update area of raster cell.
-              ras[row,col] += areaKM2
-          # Set next column.
-          x1 += cellSize
-          x2 += cellSize
-        # Set next row.
-        y1 += cellSize
-        y2 += cellSize
+      # 20201209
+      # Check the polygon geometry for self-intersections.
+      if not poly.is_valid:
+        poly = poly.buffer(0)
+      # Calculate the area per covered cell.
+      cols,rows,areasKM2 = VU.shpCalcGeodeticPolygonAreaPerCellKM2(poly,extent,cellSize)
+      # Update area of raster cells.
+      np.add.at(ras,(rows,cols),areasKM2)
           
     return (ras,)
 
@@ -15,7 +15,7 @@
 import multiprocessing as mp
 import numpy as np
 
-from shapely.geometry import Polygon,box
+from shapely.geometry import box
 from shapely.strtree import STRtree
 
 import GlobioModel.Core.Logger as Log
@@ -57,50 +57,17 @@ class AquaticRiverFractions(WorkerBase):
     # Create an array for the length.
     ras = np.zeros((nrRows,nrCols),np.float16)
 
-    # Create a small offset for the cell origin.
-    d = cellSize / 10.0
-
     # Loop lines.
     for line in lines:
       
       #self.dbgPrint(line.wkt)
       
-      # Calculate origin coords and number of cols and rows of the line boundingbox.
-      minx,miny,cols,rows = VU.shpLineCalcOriginNrColsRows(line,cellSize)
-      # Create a grid fishnet over the line and calculate length per cell.
-      y1 = miny
-      y2 = y1 + cellSize
-      # Loop rows.
-      for _ in range(rows):
-        x1 = minx
-        x2 = x1 + cellSize
-        # Loop cols.
-        for _ in range(cols):
-          # Get col/row of raster.
-          col,row = RU.calcColRowFromXY(x1+d,y1+d,extent,cellSize)
-          # Inside the working extent?
-          if (col>=0) and (row>=0) and (col<nrCols) and (row<nrRows):
-            # Create the cell polygon.
-            cell = Polygon([(x1,y1),(x1,y2),(x2,y2),(x2,y1),(x1,y1)])
-            # Get line intersection with the cell.
-            intersections = line.intersection(cell)
-            # Not empty?
-            if not intersections.is_empty:
-              # Calculate intersection polygon area.
-              lengthKM = VU.shpCalcGeodeticLineLengthKM(intersections)
-              
-              #self.dbgPrint("row,col,lengthKM: %s %s %s" % (row,col,lengthKM))
-
-              # Update length of raster cell.
-              ras[row,col] += lengthKM
-              
-          # Set next column.
-          x1 += cellSize
-          x2 += cellSize
-          
-        # Set next row.
-        y1 += cellSize
-        y2 += cellSize
+      # Calculate the length per crossed cell.
+      cols,rows,lengthsKM = VU.shpCalcGeodeticLineLengthPerCellKM(line,extent,cellSize)
+      # Inside the working extent?
+      mask = (cols>=0) & (rows>=0) & (cols<nrCols) & (rows<nrRows)
+      # Update length of raster cells.
+      np.add.at(ras,(rows[mask],cols[mask]),lengthsKM[mask])
    
     return (ras,)
 
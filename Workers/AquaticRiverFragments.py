@@ -21,12 +21,13 @@
 #-------------------------------------------------------------------------------
 
 import multiprocessing as mp
+import numpy as np
+import scipy.spatial
 
 from shapely.geometry import MultiLineString
 from shapely.strtree import STRtree
 
 import GlobioModel.Core.Logger as Log
-import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Core.WorkerBase import WorkerBase
 from GlobioModel.Core.WorkerBase import SharedData
 import GlobioModel.Core.VectorUtils as VU
@@ -86,60 +87,25 @@ class AquaticRiverFragments(WorkerBase):
     super(AquaticRiverFragments,self).__init__(nrOfCores)
 
   #-------------------------------------------------------------------------------
-  # Get connected segments to start point. Stops at endpoints or at dam.
-  def getConnectedLines(self,startPnt,segmentTree,damTree,
-                        searchDist,processedProp="processed"):
-  
-    # Create segments.
-    connectedSegments = []
-
-    # Init list with startPnt.
-    processPnts = [startPnt]
-        
-    # Loop while there are points to process.
-    while len(processPnts)>0:
-  
-      # Get last point and remove.    
-      processPnt = processPnts.pop()
-
-      # Check if point is dam.
-      queryDams = damTree.query(processPnt.buffer(searchDist,1))
-      damFound = False
-      #  print "  queryDams %s" % len(queryDams)
-      for queryDam in queryDams:
-        # Check found dam. Get distance to processPnt.
-        dist = queryDam.distance(processPnt)
-        # Distance less than search distance?
-        if dist < searchDist:
-          damFound = True
-          break
-
-      # Dam found?
-      if damFound:
-        # Continue with next point.
-        continue
-      
-      # Get segments connected to the processPnt.
-      querySegments = segmentTree.query(processPnt)
-      for querySegment in querySegments:
-        # Already processed?
-        if hasattr(querySegment,processedProp):
-          continue
-        # Double check connected segments. Get minimum distance to found segment.
-        dist = processPnt.distance(querySegment)
-        # Distance greater than search distance?
-        if dist > searchDist:
-          # Ignore segment (so not connected).
-          continue
-        # Set processed property.
-        setattr(querySegment,processedProp,1)
-        # Append to foundlines.
-        connectedSegments.append(querySegment)
-        # Append begin- and endpoint of segement to be processed.
-        processPnts.append(VU.shpLineGetBeginPoint(querySegment))
-        processPnts.append(VU.shpLineGetEndPoint(querySegment))
-  
-    return connectedSegments
+  # Returns a tuple (groupIds,nrGroups) with for all segments the group id of
+  # the connected segments. Segments are connected when their begin or end
+  # points are within the search distance and are not stopped by a dam. 
+  # The network graph of the segments is created once and is traversed for 
+  # all segments at once.
+  def getConnectedLineGroups(self,segments,dams,searchDist):
+    # Create the network nodes.
+    beginNodes,endNodes,nrNodes = VU.calcLineNodes(segments,searchDist)
+    # Check which nodes are dams, i.e. a dam within the search distance.
+    stopNodes = np.zeros(nrNodes,bool)
+    if len(dams) > 0:
+      damTree = scipy.spatial.cKDTree(np.array([dam.coords[0][:2] for dam in dams]))
+      pnts = np.array([segment.coords[0][:2] for segment in segments] +
+                      [segment.coords[-1][:2] for segment in segments],np.float64)
+      dists,_ = damTree.query(pnts,distance_upper_bound=searchDist)
+      nodes = np.concatenate([beginNodes,endNodes])
+      stopNodes[nodes[dists < searchDist]] = True
+    # Get the connected segments. Stop at end or at dam.
+    return VU.calcConnectedLineGroups(beginNodes,endNodes,nrNodes,stopNodes)
 
   #-------------------------------------------------------------------------------
   # Returns a list of Fragment objects.
@@ -187,48 +153,29 @@ class AquaticRiverFragments(WorkerBase):
       #self.dbgPrint("  Found riverDams: %s" % (len(riverDams)))
 
       # Get river multiline segments.
-      riverSegments = river.geoms
+      riverSegments = list(river.geoms)
 
       #self.dbgPrint("  Found riverSegments: %s" % (len(riverSegments)))
 
-      # Create tree.
-      riverDamTree = STRtree(riverDams)
-      segmentTree = STRtree(riverSegments)
+      # Get the connected segments.
+      groupIds,nrGroups = self.getConnectedLineGroups(riverSegments,riverDams,searchDist)
 
-      # Loop river segments. 
-      for segment in riverSegments:
-        
-        # Already processed?
-        if hasattr(segment,"processed"):
-          continue
-        
-        # Set processed.
-        setattr(segment,"processed",1)
-        
-        # Get begin and endpoint of line.
-        beginPnt = VU.shpLineGetBeginPoint(segment)
-        endPnt = VU.shpLineGetEndPoint(segment)
+      # Get the segments per group.
+      nrGroupSegments = np.bincount(groupIds,minlength=nrGroups)
+      order = np.argsort(groupIds,kind="stable")
+      groupSegmentIds = np.split(order,np.cumsum(nrGroupSegments)[:-1])
 
-        # Get connected to begin point. Stop at end or at dam.
-        conLines = self.getConnectedLines(beginPnt,segmentTree,riverDamTree,searchDist)
+      # Loop groups of connected segments.
+      for segmentIds in groupSegmentIds:
 
-        # Get connected to end point. Stop at end or at dam.
-        conLines2 = self.getConnectedLines(endPnt,segmentTree,riverDamTree,searchDist)
-        
-        # Merge the two lists.
-        conLines.extend(conLines2)
         # Connected lines found?
-        if len(conLines)>0:
-          # Include current segment.
-          conLines.append(segment)
+        if len(segmentIds)>1:
+
+          # Get the connected segments.
+          conLines = [riverSegments[i] for i in segmentIds]
           
           # Calculate length.
-          lengthKM = 0.0
-          for conLine in conLines:
-            for i in range(0,len(conLine.coords)-1):
-              c1 = conLine.coords[i]
-              c2 = conLine.coords[i+1]
-              lengthKM += RU.degreeToKM(c1[0],c1[1],c2[0],c2[1])
+          lengthKM = float(VU.calcGeodeticLineLengthsKM([conLine.coords for conLine in conLines]).sum())
               
           # Create multiline fragment.
           fragmentLine = MultiLineString(conLines)
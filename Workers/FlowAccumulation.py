@@ -0,0 +1,346 @@
+# ******************************************************************************
+## GLOBIO - https://www.globio.info
+## PBL Netherlands Environmental Assessment Agency - https://www.pbl.nl.
+## Reuse permitted under European Union Public License, EUPL v1.2
+# ******************************************************************************
+#-------------------------------------------------------------------------------
+# Calculates the D8 contributing area (number of upstream cells) and the
+# weighted contributing area of a flow direction raster, i.e. the same as
+# TauDEM AreaD8 (aread8).
+#
+# The flow directions are the TauDEM D8 flow directions:
+#   1=E, 2=NE, 3=N, 4=NW, 5=W, 6=SW, 7=S, 8=SE.
+#
+# The cells are divided in groups of basins (i.e. all cells draining to the
+# same outlet), which are calculated in parallel. Within a group the cells
+# are accumulated in topological order, i.e. a cell is added to its
+# downstream cell when all its upstream cells are added. The total and
+# weighted areas are accumulated in the same pass.
+#
+# Like TauDEM the edge contamination is checked, i.e. cells with upstream
+# cells next to the edge or next to nodata cells are set to nodata.
+#
+# Flow directions with cycles (i.e. flat or flawed flow directions) are cut
+# by using the cells of the cycle as outlets. These cells are set to nodata.
+#-------------------------------------------------------------------------------
+
+import math
+import multiprocessing as mp
+import numpy as np
+import scipy.ndimage
+
+import GlobioModel.Core.Globals as GLOB
+import GlobioModel.Core.Logger as Log
+
+from GlobioModel.Core.Raster import Raster
+import GlobioModel.Core.RasterUtils as RU
+from GlobioModel.Core.WorkerBase import WorkerBase
+from GlobioModel.Core.WorkerBase import SharedRaster
+from GlobioModel.Core.WorkerBase import SharedData
+
+# Shared data for multiprocessing.
+sharedDataSH: SharedData
+
+#-------------------------------------------------------------------------------
+# Helper function.
+# Creates a global variable to share data between pool subprocesses.
+def initPool(sharedData):
+  global sharedDataSH
+  sharedDataSH = sharedData
+
+#-------------------------------------------------------------------------------
+# Helper function.
+def calculate_Accumulation(arg,**kwarg):
+  return FlowAccumulation.calculate_Accumulation(*arg,**kwarg)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+class FlowAccumulation(WorkerBase):
+  """
+  Multiprocessing D8 flow accumulation.
+  """
+
+  # Row and column offsets of the TauDEM D8 flow directions 1..8.
+  d8RowOffsets = np.array([0,0,-1,-1,-1,0,1,1,1],np.int64)
+  d8ColOffsets = np.array([0,1,1,0,-1,-1,-1,0,1],np.int64)
+
+  # Flags for cells with an invalid accumulation.
+  flagEdgeContamination = 1
+  flagNoDataWeight = 2
+  flagCycle = 4
+
+  #-------------------------------------------------------------------------------
+  # nrOfCores: The number of cores to be used.
+  #  >=1 = This number of cores will be used.
+  #  0   = All number of available cores will be used.
+  #  <0  = All number of available cores will be used minus the specified number.
+  def __init__(self,nrOfCores):
+    super(FlowAccumulation,self).__init__(nrOfCores)
+
+  #-------------------------------------------------------------------------------
+  # Returns an array with the (flat) index of the downstream cell of every
+  # cell, -1 when the cell has no downstream cell (i.e. an outlet or a cell
+  # without data).
+  def calcDownstreamCells(self,flowDirRaster,validMask,indexType):
+    nrRows,nrCols = validMask.shape
+    down = np.full(nrRows*nrCols,-1,indexType)
+    nrRowsPerBand = max(1,GLOB.blockMinNrCells // nrCols)
+    for minRow in range(0,nrRows,nrRowsPerBand):
+      maxRow = min(nrRows,minRow+nrRowsPerBand)
+      # Get the cells with a flow direction.
+      dirs = flowDirRaster.r[minRow:maxRow]
+      rows,cols = np.nonzero(validMask[minRow:maxRow] & (dirs >= 1) & (dirs <= 8))
+      dirs = dirs[rows,cols].astype(np.int64)
+      rows = rows + minRow
+      # Get the downstream cells.
+      toRows = rows + self.d8RowOffsets[dirs]
+      toCols = cols + self.d8ColOffsets[dirs]
+      dirs = None
+      # Skip cells flowing out of the raster.
+      mask = (toRows >= 0) & (toRows < nrRows) & (toCols >= 0) & (toCols < nrCols)
+      rows = rows[mask]
+      cols = cols[mask]
+      toRows = toRows[mask]
+      toCols = toCols[mask]
+      # Skip cells flowing to cells without data.
+      mask = validMask[toRows,toCols]
+      down[rows[mask] * nrCols + cols[mask]] = toRows[mask] * nrCols + toCols[mask]
+    return down
+
+  #-------------------------------------------------------------------------------
+  # Returns an array with the group of every cell, -1 for cells without data.
+  # All cells of a basin (i.e. draining to the same outlet) are in the same
+  # group. The groups have about the same number of cells.
+  # Cycles in the downstream cells are cut, i.e. the downstream cells of the
+  # cells in the cycle are set to -1 (the down array is modified).
+  # Returns a tuple (groups,cycleCells) with the groups and the (flat) indices
+  # of the cells where the cycles are cut.
+  def calcBasinGroups(self,down,validFlat,nrOfGroups):
+    # Find the outlet of every cell.
+    outlets = self.calcOutlets(down)
+
+    # Cells in or draining to a cycle do not reach an outlet, but a cell of
+    # the cycle. All cells of the cycle are reached, use these as outlets.
+    cycleCells = np.unique(outlets[validFlat & (down[outlets] >= 0)])
+    if len(cycleCells) > 0:
+      down[cycleCells] = -1
+      outlets = self.calcOutlets(down)
+
+    # Get the basin of every cell.
+    outletIds = np.flatnonzero(validFlat & (down < 0))
+    basins = np.searchsorted(outletIds,outlets[validFlat])
+    outlets = None
+
+    # Divide the basins over the groups by the cumulative number of cells.
+    basinSizes = np.bincount(basins,minlength=len(outletIds))
+    basinStarts = np.cumsum(basinSizes) - basinSizes
+    basinGroups = (basinStarts * nrOfGroups // max(1,len(basins))).astype(np.int32)
+
+    groups = np.full(len(down),-1,np.int32)
+    groups[validFlat] = basinGroups[basins]
+    return (groups,cycleCells)
+
+  #-------------------------------------------------------------------------------
+  # Returns an array with the outlet of every cell by pointer jumping.
+  # The number of jumps is limited, so cells in or draining to a cycle do not
+  # reach an outlet but a cell of the cycle.
+  def calcOutlets(self,down):
+    outlets = np.arange(len(down),dtype=down.dtype)
+    mask = (down >= 0)
+    outlets[mask] = down[mask]
+    mask = None
+    maxNrJumps = int(math.ceil(math.log2(max(2,len(down))))) + 1
+    for _ in range(maxNrJumps):
+      nextOutlets = outlets[outlets]
+      if np.array_equal(nextOutlets,outlets):
+        break
+      outlets = nextOutlets
+    return outlets
+
+  #-------------------------------------------------------------------------------
+  # Accumulates the cells of a group of basins.
+  # Returns a tuple (cells,totalAcc,weightedAcc,flags) with the (flat) cell
+  # indices, the number of upstream cells, the sum of the upstream weights
+  # (None when there are no weights) and the invalid accumulation flags.
+  def calculate_Accumulation(self,args):
+    global sharedDataSH
+
+    # Get arguments.
+    groupId = args[0]
+
+    # Get the cells of the group.
+    cells = np.flatnonzero(sharedDataSH.zoneRaster.r.ravel() == groupId)
+    nrCells = len(cells)
+
+    # Get the local index of the downstream cells.
+    down = sharedDataSH.flowRaster.r.ravel()[cells]
+    hasDown = (down >= 0)
+    localDown = np.full(nrCells,-1,np.int64)
+    localDown[hasDown] = np.searchsorted(cells,down[hasDown])
+    down = None
+
+    # Initialize the accumulations with the cell itself.
+    flags = sharedDataSH.flagRaster.r.ravel()[cells]
+    totalAcc = np.ones(nrCells,np.float64)
+    if sharedDataSH.valueRaster is None:
+      weightedAcc = None
+    else:
+      weightedAcc = sharedDataSH.valueRaster.r.ravel()[cells].astype(np.float64)
+      weightedAcc[(flags & self.flagNoDataWeight) > 0] = 0.0
+
+    # Count the upstream cells of every cell and start with the cells
+    # without upstream cells.
+    nrUpstream = np.bincount(localDown[hasDown],minlength=nrCells)
+    hasDown = None
+    currCells = np.flatnonzero(nrUpstream == 0)
+
+    # Add the cells to their downstream cells in topological order.
+    while len(currCells) > 0:
+      toCells = localDown[currCells]
+      mask = (toCells >= 0)
+      currCells = currCells[mask]
+      toCells = toCells[mask]
+      np.add.at(totalAcc,toCells,totalAcc[currCells])
+      if not weightedAcc is None:
+        np.add.at(weightedAcc,toCells,weightedAcc[currCells])
+      np.bitwise_or.at(flags,toCells,flags[currCells])
+      # Continue with the downstream cells of which all upstream cells are added.
+      np.subtract.at(nrUpstream,toCells,1)
+      currCells = np.unique(toCells[nrUpstream[toCells] == 0])
+
+    if not weightedAcc is None:
+      weightedAcc = weightedAcc.astype(np.float32)
+    return (cells,totalAcc.astype(np.float32),weightedAcc,flags)
+
+  #-------------------------------------------------------------------------------
+  # Calculates the D8 contributing area of the flow directions (TauDEM D8
+  # codes), i.e. the number of upstream cells including the cell itself.
+  # When a weight raster is specified also the weighted contributing area
+  # is calculated, i.e. the sum of the weights of the upstream cells.
+  # When edgeContamination is True cells which possibly have upstream cells
+  # outside the raster or in nodata cells are set to nodata (like TauDEM
+  # without -nc).
+  # Returns a tuple (totalRaster,weightedRaster). The weightedRaster is None
+  # when no weight raster is specified.
+  #
+  # Usage:
+  #     pFlow = FlowAccumulation(GLOB.numberOfCores)
+  #     totalRaster,weightedRaster = pFlow.areaD8(flowDirRaster,weightRaster)
+  #     pFlow = None
+  def areaD8(self,flowDirRaster,weightRaster=None,edgeContamination=True,nrOfChunks=0):
+    pool = None
+    sharedData = None
+    try:
+      extent = flowDirRaster.extent
+      cellSize = flowDirRaster.cellSize
+      nrRows,nrCols = flowDirRaster.r.shape
+      nrCells = nrRows * nrCols
+
+      # Check nrOfChunks. Use more groups than cores to balance the load.
+      if nrOfChunks==0:
+        if self.nrOfCores > 1:
+          nrOfChunks = self.nrOfCores * 4
+        else:
+          nrOfChunks = 1
+
+      # Select the cell index type.
+      if nrCells < np.iinfo(np.int32).max:
+        indexType = np.int32
+      else:
+        indexType = np.int64
+
+      # Get the cells with a flow direction.
+      validMask = flowDirRaster.getDataMask()
+
+      # Create the shared rasters.
+      sharedData = SharedData()
+
+      Log.dbg("  Calculating downstream cells...")
+      downRaster = Raster()
+      downRaster.initRasterEmpty(extent,cellSize,indexType,-1)
+      downRaster.r = self.calcDownstreamCells(flowDirRaster,validMask,indexType).reshape(nrRows,nrCols)
+
+      Log.dbg("  Calculating basins...")
+      groupRaster = Raster()
+      groupRaster.initRasterEmpty(extent,cellSize,np.int32,-1)
+      groups,cycleCells = self.calcBasinGroups(downRaster.r.reshape(-1),
+                                               validMask.ravel(),nrOfChunks)
+      groupRaster.r = groups.reshape(nrRows,nrCols)
+      groups = None
+      if len(cycleCells) > 0:
+        Log.info("  Warning: %s cells with cyclic flow directions found." % len(cycleCells))
+
+      sharedData.flowRaster = SharedRaster(downRaster)
+      downRaster.close()
+      downRaster = None
+      sharedData.zoneRaster = SharedRaster(groupRaster)
+      groupRaster.close()
+      groupRaster = None
+
+      # Set the invalid accumulation flags.
+      flagRaster = Raster()
+      flagRaster.initRaster(extent,cellSize,np.uint8,0)
+      flagRaster.r.flat[cycleCells] |= self.flagCycle
+      cycleCells = None
+      if edgeContamination:
+        # Cells next to the edge or next to nodata cells.
+        edgeMask = scipy.ndimage.binary_dilation(~validMask,np.ones((3,3),bool),
+                                                 border_value=1)
+        flagRaster.r[edgeMask & validMask] |= self.flagEdgeContamination
+        edgeMask = None
+      if not weightRaster is None:
+        flagRaster.r[~weightRaster.getDataMask()] |= self.flagNoDataWeight
+        sharedData.valueRaster = SharedRaster(weightRaster)
+      sharedData.flagRaster = SharedRaster(flagRaster)
+      flagRaster.close()
+      flagRaster = None
+
+      # Create the input list with tuples of (groupId,).
+      args = [[i] for i in range(nrOfChunks)]
+
+      # Calculate the groups. With 1 core the groups are calculated in
+      # this process.
+      Log.dbg("  Accumulating...")
+      if self.nrOfCores > 1:
+        pool = mp.Pool(processes=self.nrOfCores,
+                       initializer=initPool, initargs=(sharedData,))
+        results = pool.imap_unordered(calculate_Accumulation,zip([self]*len(args),args))
+      else:
+        initPool(sharedData)
+        results = map(calculate_Accumulation,zip([self]*len(args),args))
+
+      # Create the output rasters.
+      noDataValue = RU.getNoDataValue(np.float32)
+      totalRaster = Raster()
+      totalRaster.initRaster(extent,cellSize,np.float32,noDataValue)
+      if weightRaster is None:
+        weightedRaster = None
+      else:
+        weightedRaster = Raster()
+        weightedRaster.initRaster(extent,cellSize,np.float32,noDataValue)
+
+      # Set the accumulations.
+      for cells,totalAcc,weightedAcc,flags in results:
+        mask = ((flags & (self.flagEdgeContamination | self.flagCycle)) == 0)
+        totalRaster.r.flat[cells[mask]] = totalAcc[mask]
+        if not weightedRaster is None:
+          mask = (flags == 0)
+          weightedRaster.r.flat[cells[mask]] = weightedAcc[mask]
+
+      return (totalRaster,weightedRaster)
+
+    except KeyboardInterrupt:
+      if not pool is None:
+        print("^C received, shutting down the workers.")
+        pool.close()
+        pool.terminate()
+        # noinspection PyUnusedLocal
+        pool = None
+      return (None,None)
+    finally:
+      # Close the pool and release the shared rasters.
+      if not pool is None:
+        pool.close()
+        pool.join()
+      if not sharedData is None:
+        sharedData.release()
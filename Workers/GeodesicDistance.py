@@ -0,0 +1,458 @@
+# ******************************************************************************
+## GLOBIO - https://www.globio.info
+## PBL Netherlands Environmental Assessment Agency - https://www.pbl.nl.
+## Reuse permitted under European Union Public License, EUPL v1.2
+# ******************************************************************************
+#-------------------------------------------------------------------------------
+# Calculates the geodesic distance (in meters) to the nearest source cell.
+#
+# The nearest sources are found by propagating the source cells row by row
+# and column by column in 4 sweeps (down, up, right, left). This is an
+# approximation, a source can be missed when it is not propagated through
+# the neighbour cells. The distances are calculated with the haversine
+# formula on a sphere.
+#
+# The raster is processed in bands of rows. Every band is calculated with
+# a halo of extra rows above and below. A distance is valid when it is less
+# than the distance to the edge of the halo, otherwise the band is calculated
+# again with a doubled halo. The halo is limited to maxHaloFactor times the
+# band size. The distances of the cells which are still not valid (i.e. cells
+# far from any source) are calculated with a kd-tree of the border source
+# cells, in blocks of rows. So the memory used depends on the band size and
+# the number of border source cells.
+#
+# The buffer (i.e. the same as GRASS r.buffer) is calculated from these
+# distances, with a halo limited to the buffer distance.
+#-------------------------------------------------------------------------------
+
+import math
+import multiprocessing as mp
+import numpy as np
+
+from scipy.spatial import cKDTree
+
+import GlobioModel.Core.Globals as GLOB
+import GlobioModel.Core.Logger as Log
+
+from GlobioModel.Core.Raster import Raster
+import GlobioModel.Core.RasterUtils as RU
+from GlobioModel.Core.WorkerBase import WorkerBase
+from GlobioModel.Core.WorkerBase import SharedRaster
+from GlobioModel.Core.WorkerBase import SharedData
+
+# Shared data for multiprocessing.
+sharedDataSH: SharedData
+
+#-------------------------------------------------------------------------------
+# Helper function.
+# Creates a global variable to share data between pool subprocesses.
+def initPool(sharedData):
+  global sharedDataSH
+  sharedDataSH = sharedData
+
+#-------------------------------------------------------------------------------
+# Helper function.
+def calculate_Distance(arg,**kwarg):
+  return GeodesicDistance.calculate_Distance(*arg,**kwarg)
+
+#-------------------------------------------------------------------------------
+#-------------------------------------------------------------------------------
+class GeodesicDistance(WorkerBase):
+  """
+  Multiprocessing geodesic distance and buffer to the nearest source cell.
+  """
+
+  # Earth radius in meters (see RU.degreeToKM).
+  earthRadius = 6371000.0
+
+  # The maximum halo in number of band sizes.
+  maxHaloFactor = 4
+
+  #-------------------------------------------------------------------------------
+  # nrOfCores: The number of cores to be used.
+  #  >=1 = This number of cores will be used.
+  #  0   = All number of available cores will be used.
+  #  <0  = All number of available cores will be used minus the specified number.
+  def __init__(self,nrOfCores):
+    super(GeodesicDistance,self).__init__(nrOfCores)
+
+  #-------------------------------------------------------------------------------
+  # Returns the haversine value (i.e. sin(d/2R)^2) of the distances between
+  # the cells (rows,cols) and the sources (srcRows,srcCols).
+  # sinHalf2 is a table with sin(n*cellSize/2)^2 for n cells.
+  # cosLat is a table with cos(lat) per row.
+  def calcHaversine(self,rows,cols,srcRows,srcCols,sinHalf2,cosLat):
+    return sinHalf2[np.abs(rows - srcRows)] + \
+           cosLat[rows] * cosLat[srcRows] * sinHalf2[np.abs(cols - srcCols)]
+
+  #-------------------------------------------------------------------------------
+  # Calculates the haversine values of the distances to the nearest sources
+  # in the sourceMask. The top of the sourceMask is at latitude maxLat.
+  # Returns an array with the haversine values, np.inf when no source is found.
+  def calcNearestSources(self,sourceMask,maxLat,cellSize):
+    nrRows,nrCols = sourceMask.shape
+
+    # Create the tables. The sinHalf2 table has 1 extra item, because
+    # cells without a source (i.e. -1) are also looked up.
+    cellSizeRad = math.radians(cellSize)
+    sinHalf2 = np.sin(np.arange(max(nrRows,nrCols)+1) * cellSizeRad / 2.0) ** 2
+    lats = maxLat - (np.arange(nrRows) + 0.5) * cellSize
+    cosLat = np.cos(np.radians(lats))
+
+    # Initialize the nearest sources.
+    srcRows = np.full((nrRows,nrCols),-1,np.int32)
+    srcCols = np.full((nrRows,nrCols),-1,np.int32)
+    hav = np.full((nrRows,nrCols),np.inf,np.float64)
+    rows,cols = np.nonzero(sourceMask)
+    srcRows[rows,cols] = rows
+    srcCols[rows,cols] = cols
+    hav[rows,cols] = 0.0
+    rows = None
+    cols = None
+
+    # Sweep down and up.
+    self.sweep(srcRows,srcCols,hav,sinHalf2,cosLat,False,False)
+    self.sweep(srcRows,srcCols,hav,sinHalf2,cosLat,False,True)
+
+    # Sweep right and left. Use transposed copies, so a column is contiguous.
+    srcRows = np.ascontiguousarray(srcRows.T)
+    srcCols = np.ascontiguousarray(srcCols.T)
+    hav = np.ascontiguousarray(hav.T)
+    self.sweep(srcRows,srcCols,hav,sinHalf2,cosLat,True,False)
+    self.sweep(srcRows,srcCols,hav,sinHalf2,cosLat,True,True)
+
+    return np.ascontiguousarray(hav.T)
+
+  #-------------------------------------------------------------------------------
+  # Calculates the distances of the cells of a band of rows.
+  # Returns a tuple (distRas,) with the distances of the band rows in meters,
+  # np.inf when no source is found.
+  def calculate_Distance(self,args):
+    global sharedDataSH
+
+    # Get arguments.
+    #coreId = args[0]
+    bandMinRow = args[1]
+    bandMaxRow = args[2]
+    tileMinRow = args[3]
+    tileMaxRow = args[4]
+
+    # Get shared raster.
+    sourceRaster = sharedDataSH.sourceRaster
+
+    # Get the latitude of the top of the tile.
+    cellSize = sourceRaster.cellSize
+    maxLat = sourceRaster.extent[3] - tileMinRow * cellSize
+
+    # Calculate the nearest sources of the tile.
+    hav = self.calcNearestSources(sourceRaster.r[tileMinRow:tileMaxRow],
+                                  maxLat,cellSize)
+
+    # Get the band rows.
+    hav = hav[bandMinRow-tileMinRow:bandMaxRow-tileMinRow]
+
+    # Convert to meters.
+    distRas = np.full(hav.shape,np.inf,np.float64)
+    mask = np.isfinite(hav)
+    distRas[mask] = 2.0 * self.earthRadius * np.arcsin(np.sqrt(np.minimum(hav[mask],1.0)))
+
+    return (distRas,)
+
+  #-------------------------------------------------------------------------------
+  # Calculates the distances in meters of the cells in the todoMask to the
+  # nearest source cells in the sourceMask. A kd-tree is used of the border
+  # source cells (i.e. the source cells with a neighbour which is not a
+  # source), on the unit sphere. The chord length on the unit sphere gives
+  # the same distance as the haversine formula.
+  # The cells are processed in blocks of rows.
+  # Returns a tuple (rows,cols,distances) per block.
+  def calcRemainingDistances(self,extent,cellSize,sourceMask,todoMask):
+    nrRows,nrCols = sourceMask.shape
+    blockNrRows = RU.getArrayBlockNrRows(nrCols)
+
+    # Returns the unit vectors of the cells.
+    def toUnitVectors(rows,cols):
+      lats = np.radians(extent[3] - (rows + 0.5) * cellSize)
+      lons = np.radians(extent[0] + (cols + 0.5) * cellSize)
+      cosLats = np.cos(lats)
+      return np.column_stack((cosLats * np.cos(lons),
+                              cosLats * np.sin(lons),
+                              np.sin(lats)))
+
+    # Get the border source cells, only these can be the nearest sources.
+    xyzList = []
+    for minRow in range(0,nrRows,blockNrRows):
+      maxRow = min(nrRows,minRow + blockNrRows)
+      tileMinRow = max(0,minRow - 1)
+      tileMaxRow = min(nrRows,maxRow + 1)
+      tile = np.pad(sourceMask[tileMinRow:tileMaxRow],1)
+      center = tile[1:-1,1:-1]
+      interior = center & tile[:-2,1:-1] & tile[2:,1:-1] & tile[1:-1,:-2] & tile[1:-1,2:]
+      border = (center & ~interior)[minRow-tileMinRow:maxRow-tileMinRow]
+      rows,cols = np.nonzero(border)
+      xyzList.append(toUnitVectors(rows + minRow,cols))
+    tree = cKDTree(np.concatenate(xyzList))
+    xyzList = None
+
+    # Calculate the distances.
+    for minRow in range(0,nrRows,blockNrRows):
+      maxRow = min(nrRows,minRow + blockNrRows)
+      rows,cols = np.nonzero(todoMask[minRow:maxRow])
+      if len(rows) == 0:
+        continue
+      rows += minRow
+      chords,_ = tree.query(toUnitVectors(rows,cols),workers=self.nrOfCores)
+      dists = 2.0 * self.earthRadius * np.arcsin(np.minimum(chords / 2.0,1.0))
+      yield rows,cols,dists
+
+  #-------------------------------------------------------------------------------
+  # Propagates the nearest sources from the previous row to the next row
+  # (i.e. from the 3 neighbour cells). When transposed is True the arrays are
+  # transposed and the propagation is from the previous to the next column.
+  def sweep(self,srcRows,srcCols,hav,sinHalf2,cosLat,transposed,reverse):
+    nrSteps,nrCells = srcRows.shape
+    if nrSteps < 2:
+      return
+    cells = np.arange(nrCells)
+    if reverse:
+      steps = range(nrSteps-2,-1,-1)
+      prevOffset = 1
+    else:
+      steps = range(1,nrSteps)
+      prevOffset = -1
+
+    # The cells (dst) and the neighbour cells in the previous step (src).
+    neighbours = [(slice(1,None),slice(0,-1)),
+                  (slice(None),slice(None)),
+                  (slice(0,-1),slice(1,None))]
+
+    for i in steps:
+      prev = i + prevOffset
+      for dst,src in neighbours:
+        # Get the sources of the neighbours.
+        nbRows = srcRows[prev,src]
+        nbCols = srcCols[prev,src]
+        valid = (nbRows >= 0)
+        if not valid.any():
+          continue
+        # Calculate the haversine values.
+        if transposed:
+          nbHav = self.calcHaversine(cells[dst],i,nbRows,nbCols,sinHalf2,cosLat)
+        else:
+          nbHav = self.calcHaversine(i,cells[dst],nbRows,nbCols,sinHalf2,cosLat)
+        # Get the cells with a nearer source.
+        currHav = hav[i,dst]
+        mask = valid & (nbHav < currHav)
+        # Update.
+        currHav[mask] = nbHav[mask]
+        srcRows[i,dst][mask] = nbRows[mask]
+        srcCols[i,dst][mask] = nbCols[mask]
+
+  #-------------------------------------------------------------------------------
+  # Calculates the geodesic distance in meters to the nearest source cell,
+  # i.e. the cells with data in the source raster.
+  # When a mask raster is specified only the source cells with data in the
+  # mask raster are used and the cells without data in the mask raster are
+  # set to nodata.
+  # When a maxDistance (meters) is specified larger distances are set to
+  # maxDistance.
+  # Returns a raster with the distances. When no source cells are found
+  # all cells are nodata.
+  def distance(self,extent,cellSize,sourceRaster,maskRaster=None,
+               maxDistance=None,dataType=np.float32,nrOfChunks=0):
+    pool = None
+    sharedData = None
+    try:
+      # Check nrOfChunks. Use bands of at least blockMinNrCells.
+      nrCols,nrRows = RU.calcNrColsRowsFromExtent(extent,cellSize)
+      if nrOfChunks==0:
+        nrOfChunks = max(self.nrOfCores,
+                         int(math.ceil(nrRows * nrCols / float(GLOB.blockMinNrCells))))
+      nrOfChunks = min(nrOfChunks,nrRows)
+
+      # Create the source mask.
+      sourceMaskRaster = Raster()
+      sourceMaskRaster.initRasterEmpty(extent,cellSize,np.uint8,0)
+      sourceMask = sourceRaster.getDataMask()
+      if not maskRaster is None:
+        sourceMask &= maskRaster.getDataMask()
+      sourceMaskRaster.r = sourceMask.astype(np.uint8)
+      hasSources = sourceMask.any()
+      sourceMask = None
+
+      # Create the output raster.
+      noDataValue = RU.getNoDataValue(dataType)
+      outRaster = Raster()
+      outRaster.initRaster(extent,cellSize,dataType,noDataValue)
+
+      # No sources?
+      if not hasSources:
+        Log.info("  No source cells found.")
+        return outRaster
+
+      # Split the data in bands to be handled by the cores.
+      offsets,sizes = self.getOffsetsAndSizes(nrRows,nrOfChunks)
+
+      # Set the initial and maximum halo. When the halo covers the maximum
+      # distance the remaining cells are beyond the maximum distance.
+      cellSizeM = math.radians(cellSize) * self.earthRadius
+      maxHalo = max(sizes) * self.maxHaloFactor
+      if maxDistance is None:
+        halo = max(sizes)
+        maxDistanceHalo = None
+      else:
+        maxDistanceHalo = int(math.ceil(maxDistance / cellSizeM)) + 1
+        halo = min(maxDistanceHalo,maxHalo)
+
+      # Set shared raster.
+      sharedData = SharedData()
+      sharedData.sourceRaster = SharedRaster(sourceMaskRaster)
+      sourceMaskRaster.close()
+      sourceMaskRaster = None
+
+      # Create the pool. With 1 core the bands are calculated in this process,
+      # which saves the startup of a subprocess for small rasters.
+      if self.nrOfCores > 1:
+        pool = mp.Pool(processes=self.nrOfCores,
+                       initializer=initPool, initargs=(sharedData,))
+      else:
+        initPool(sharedData)
+
+      # Create a mask for the cells which are not calculated yet.
+      if maskRaster is None:
+        todoMask = np.ones((nrRows,nrCols),bool)
+      else:
+        todoMask = maskRaster.getDataMask()
+
+      bands = list(range(len(offsets)))
+      while len(bands) > 0:
+        # Create the input list with tuples of (coreId,bandMinRow,bandMaxRow,
+        # tileMinRow,tileMaxRow).
+        args = []
+        for i in bands:
+          bandMinRow = offsets[i]
+          bandMaxRow = offsets[i] + sizes[i]
+          args.append([i,bandMinRow,bandMaxRow,
+                       max(0,bandMinRow-halo),min(nrRows,bandMaxRow+halo)])
+
+        if pool is None:
+          results = list(map(calculate_Distance,zip([self]*len(args),args)))
+        else:
+          results = pool.map(calculate_Distance,zip([self]*len(args),args))
+
+        # Check the distances of the bands.
+        nextBands = []
+        for arg,result in zip(args,results):
+          i,bandMinRow,bandMaxRow,tileMinRow,tileMaxRow = arg
+          bandDist = result[0]
+          # Get the distance to the edges of the halo. Sources outside the
+          # tile are at least this distance away.
+          haloDist = np.inf
+          if tileMinRow > 0:
+            haloDist = min(haloDist,(bandMinRow - tileMinRow) * cellSizeM)
+          if tileMaxRow < nrRows:
+            haloDist = min(haloDist,(tileMaxRow - bandMaxRow) * cellSizeM)
+          # Get the valid distances.
+          bandTodoMask = todoMask[bandMinRow:bandMaxRow]
+          validMask = bandTodoMask & (bandDist <= haloDist)
+          bandDist = bandDist[validMask]
+          # Limit to maximum distance.
+          if not maxDistance is None:
+            bandDist = np.minimum(bandDist,maxDistance)
+          # Set output distances.
+          if np.issubdtype(np.dtype(dataType),np.integer):
+            bandDist = np.rint(bandDist)
+          outRaster.r[bandMinRow:bandMaxRow][validMask] = bandDist
+          bandTodoMask[validMask] = False
+          # All distances valid or beyond the maximum distance?
+          if (not bandTodoMask.any()) or (halo == maxDistanceHalo):
+            continue
+          nextBands.append(i)
+
+        # Halo covers the maximum distance? Set the remaining cells to the
+        # maximum distance. These cells are further away than the halo, so
+        # further away than the maximum distance.
+        if halo == maxDistanceHalo:
+          outRaster.r[todoMask] = maxDistance
+          break
+
+        # Calculate the remaining bands with a doubled halo.
+        bands = nextBands
+        halo *= 2
+        if not maxDistanceHalo is None:
+          halo = min(halo,maxDistanceHalo)
+        if len(bands) == 0:
+          break
+        if halo > maxHalo:
+          # Calculate the remaining cells without bands.
+          Log.dbg("  Calculating the remaining cells of %s bands." % len(bands))
+          for rows,cols,dists in self.calcRemainingDistances(extent,cellSize,
+                                                             sharedData.sourceRaster.r.view(bool),
+                                                             todoMask):
+            # Limit to maximum distance.
+            if not maxDistance is None:
+              dists = np.minimum(dists,maxDistance)
+            if np.issubdtype(np.dtype(dataType),np.integer):
+              dists = np.rint(dists)
+            outRaster.r[rows,cols] = dists
+          break
+        Log.dbg("  Recalculating %s bands with halo of %s rows." % (len(bands),halo))
+      todoMask = None
+
+      # Set nodata outside the mask.
+      if not maskRaster is None:
+        outRaster.r[~maskRaster.getDataMask()] = noDataValue
+
+      return outRaster
+
+    except KeyboardInterrupt:
+      if not pool is None:
+        print("^C received, shutting down the workers.")
+        pool.close()
+        pool.terminate()
+        # noinspection PyUnusedLocal
+        pool = None
+      return None
+    finally:
+      # Close the pool and release the shared raster.
+      if not pool is None:
+        pool.close()
+        pool.join()
+      if not sharedData is None:
+        sharedData.release()
+
+  #-------------------------------------------------------------------------------
+  # Creates a buffer of the given distance (meters) around the source cells,
+  # i.e. the cells with data in the source raster.
+  # Returns a raster with the value 1 for the source cells, 2 for the cells
+  # within the buffer distance and nodata for the other cells (like GRASS
+  # r.buffer).
+  #
+  # Usage:
+  #     pDist = GeodesicDistance(GLOB.numberOfCores)
+  #     bufRaster = pDist.buffer(extent,cellSize,inRaster,bufferKM*1000.0)
+  #     pDist = None
+  def buffer(self,extent,cellSize,sourceRaster,distance,dataType=np.uint8,nrOfChunks=0):
+
+    # Calculate the distances. Use a maximum distance of 1 cell more than
+    # the buffer distance, so cells beyond the buffer distance get a larger
+    # distance. 
+    cellSizeM = math.radians(cellSize) * self.earthRadius
+    distRaster = self.distance(extent,cellSize,sourceRaster,
+                               maxDistance=distance+cellSizeM,
+                               dataType=np.float32,nrOfChunks=nrOfChunks)
+    if distRaster is None:
+      return None
+
+    # Create the buffer raster.
+    noDataValue = RU.getNoDataValue(dataType)
+    outRaster = Raster()
+    outRaster.initRaster(extent,cellSize,dataType,noDataValue)
+    outRaster.r[distRaster.getDataMask() & (distRaster.r <= distance)] = 2
+    distRaster.close()
+    distRaster = None
+
+    # Set the source cells.
+    outRaster.r[sourceRaster.getDataMask()] = 1
+
+    return outRaster
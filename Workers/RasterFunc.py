@@ -23,7 +23,7 @@ import multiprocessing as mp
 from GlobioModel.Core.Raster import Raster
 import GlobioModel.Core.RasterUtils as RU
 from GlobioModel.Core.WorkerBase import WorkerBase
-from GlobioModel.Core.WorkerBase import RasterSH
+from GlobioModel.Core.WorkerBase import SharedRaster
 from GlobioModel.Core.WorkerBase import SharedData
 
 # Shared data for multiprocessing.
@@ -97,16 +97,28 @@ class RasterFunc(WorkerBase):
 
     # Create a chunk raster for the label values.
     outRas = np.full((size,nrCols),noDataValue,dataType)
-    
-    # Loop rows and cols.
-    for r in range(size):
-      for c in range(nrCols):
-        # Get label id in the full extent label raster.
-        lid = labelRas[offset+r,c]
-        # Found?
-        if lid in labelDict:
-          # Set label value in the chunk raster.
-          outRas[r,c] = labelDict[lid]
+
+    # No labels?
+    if len(labelDict) == 0:
+      return (outRas,)
+
+    # Get label ids of the chunk.
+    lidRas = labelRas[offset:offset+size]
+
+    # Create sorted lookup arrays of the label ids and values.
+    lids = np.array(list(labelDict.keys()))
+    labels = np.array(list(labelDict.values()))
+    sortIdx = np.argsort(lids,kind="stable")
+    lids = lids[sortIdx]
+    labels = labels[sortIdx]
+
+    # Lookup the label ids.
+    idx = np.searchsorted(lids,lidRas)
+    idx[idx >= len(lids)] = 0
+    mask = (lids[idx] == lidRas)
+
+    # Set label values in the chunk raster.
+    outRas[mask] = labels[idx[mask]]
 
     return (outRas,)
 
@@ -122,7 +134,6 @@ class RasterFunc(WorkerBase):
     #coreId = args[0]
     offset = args[1]
     size = args[2]
-    nrCols = args[3]
 
     # 20201207
     # Get shared rasters.
@@ -135,43 +146,47 @@ class RasterFunc(WorkerBase):
     zoneNoDataValue = sharedDataSH.zoneRaster.noDataValue
     valueNoDataValue = sharedDataSH.valueRaster.noDataValue
 
-    # Initialize dicts.
-    sumDict = dict()
-    sumAreaDict = dict()
-    
-    # Loop rows and cols in chunks of the full extent rasters.
-    for i in range(size):
-      # Set chunck row.
-      r = offset+i
-      for c in range(nrCols):
-
-        # Get zone id.
-        zid = zoneRas[r,c]
-        # Zone id is nodata?
-        if zid == zoneNoDataValue:
-          # Skip.
-          continue
-
-        # Get area.
-        area = areaRas[r,c]
-        # Get value.
-        v = valueRas[r,c]
-                
-        # Set sum and area.
-        if not zid in sumDict:
-          # Value is not nodata?
-          # 20201118
-          #if v <> valueNoDataValue:
-          if v != valueNoDataValue:
-            sumDict[zid] = v
-          sumAreaDict[zid] = area
-        else:
-          # Value is not nodata?
-          # 20201118
-          #if v <> valueNoDataValue:
-          if v != valueNoDataValue:
-            sumDict[zid] += v
-          sumAreaDict[zid] += area
+    # Get the chunks of the full extent rasters.
+    zoneRas = zoneRas[offset:offset+size]
+    valueRas = valueRas[offset:offset+size]
+    areaRas = areaRas[offset:offset+size]
+
+    # Skip nodata zones.
+    mask = (zoneRas != zoneNoDataValue)
+    zoneIds = zoneRas[mask]
+    values = valueRas[mask]
+    areas = areaRas[mask]
+
+    # Get the zones and the zone index of each cell.
+    zones,zoneIdx = np.unique(zoneIds,return_inverse=True)
+
+    # Sum the values per zone. Nodata values are skipped.
+    valueMask = (values != valueNoDataValue)
+    valueZoneIdx = zoneIdx[valueMask]
+    sums = np.zeros(len(zones),valueRas.dtype)
+    np.add.at(sums,valueZoneIdx,values[valueMask])
+    counts = np.bincount(valueZoneIdx,minlength=len(zones))
+
+    # Get the first cell with a value per zone.
+    cellIdx = np.arange(len(zoneIds))
+    firstIdx = np.full(len(zones),len(zoneIds))
+    np.minimum.at(firstIdx,valueZoneIdx,cellIdx[valueMask])
+
+    # Sum the areas per zone from the first cell with a value on. Uses
+    # np.add.at to sum in cell order, like summing cell by cell.
+    areaMask = (cellIdx >= firstIdx[zoneIdx])
+    sumAreas = np.zeros(len(zones),areaRas.dtype)
+    np.add.at(sumAreas,zoneIdx[areaMask],areas[areaMask])
+
+    # Zones without values get the area of their last cell.
+    lastIdx = np.zeros(len(zones),cellIdx.dtype)
+    np.maximum.at(lastIdx,zoneIdx,cellIdx)
+    noValueZones = (counts == 0)
+    sumAreas[noValueZones] = areas[lastIdx[noValueZones]]
+
+    # Create dicts. Only zones with values are added to the sum dict.
+    sumDict = {zones[i]: sums[i] for i in np.flatnonzero(counts)}
+    sumAreaDict = {zones[i]: sumAreas[i] for i in range(len(zones))}
 
     return (sumDict,sumAreaDict)
 
@@ -187,7 +202,6 @@ class RasterFunc(WorkerBase):
     #coreId = args[0]
     offset = args[1]
     size = args[2]
-    nrCols = args[3]
 
     # 20201207
     # Get shared rasters.
@@ -199,34 +213,27 @@ class RasterFunc(WorkerBase):
     zoneNoDataValue = sharedDataSH.zoneRaster.noDataValue
     valueNoDataValue = sharedDataSH.valueRaster.noDataValue
 
-    # Initialize dicts.
-    countDict = dict()
-    sumDict = dict()
-    
-    # Loop rows and cols in chunks of the full extent rasters.
-    for i in range(size):
-      # Set chunck row.
-      r = offset+i
-      for c in range(nrCols):
-        # Get value.
-        v = valueRas[r,c]
-        # Value is nodata?
-        if (v == valueNoDataValue):
-          # Skip.
-          continue
-        # Get zone id.
-        zid = zoneRas[r,c]
-        # Zone id is nodata?
-        if (zid == zoneNoDataValue):
-          # Skip.
-          continue
-        # Set count and area.
-        if not zid in countDict:
-          countDict[zid] = 1
-          sumDict[zid] = v
-        else:
-          countDict[zid] += 1
-          sumDict[zid] += v
+    # Get the chunks of the full extent rasters.
+    zoneRas = zoneRas[offset:offset+size]
+    valueRas = valueRas[offset:offset+size]
+
+    # Skip nodata values and nodata zones.
+    mask = (valueRas != valueNoDataValue) & (zoneRas != zoneNoDataValue)
+    zoneIds = zoneRas[mask]
+    values = valueRas[mask]
+
+    # Get the zones and the zone index of each cell.
+    zones,zoneIdx = np.unique(zoneIds,return_inverse=True)
+
+    # Count and sum the values per zone. Uses np.add.at to sum in cell
+    # order, like summing cell by cell.
+    counts = np.bincount(zoneIdx,minlength=len(zones))
+    sums = np.zeros(len(zones),valueRas.dtype)
+    np.add.at(sums,zoneIdx,values)
+
+    # Create dicts.
+    countDict = {zones[i]: int(counts[i]) for i in range(len(zones))}
+    sumDict = {zones[i]: sums[i] for i in range(len(zones))}
 
     return (countDict,sumDict)
 
@@ -237,6 +244,7 @@ class RasterFunc(WorkerBase):
   def label(self,extent,cellSize,inRaster,labelDict,
             dataType,noDataValue=None,nrOfChunks=0):
     pool = None
+    sharedData = None
     try:
       # Check nrOfChunks.
       if nrOfChunks==0:
@@ -266,7 +274,7 @@ class RasterFunc(WorkerBase):
       # 20201207
       # Set shared raster.
       sharedData = SharedData()
-      sharedData.labelRaster = RasterSH(inRaster)
+      sharedData.labelRaster = SharedRaster(inRaster)
 
       # 20201207
       # Create the pool.
@@ -294,6 +302,10 @@ class RasterFunc(WorkerBase):
         # noinspection PyUnusedLocal
         pool = None
       return None
+    finally:
+      # Release the shared rasters.
+      if not sharedData is None:
+        sharedData.release()
 
   #-----------------------------------------------------------------------------
   # Returns a tupe of dicts (densDict,countDict,areaDict) with the density
@@ -304,6 +316,7 @@ class RasterFunc(WorkerBase):
                         zoneRaster,valueRaster,areaRaster,
                         nrOfChunks=0):
     pool = None
+    sharedData = None
     try:
       # Check nrOfChunks.
       if nrOfChunks==0:
@@ -326,9 +339,9 @@ class RasterFunc(WorkerBase):
       # 20201207
       # Set shared rasters.
       sharedData = SharedData()
-      sharedData.zoneRaster = RasterSH(zoneRaster)
-      sharedData.valueRaster = RasterSH(valueRaster)
-      sharedData.areaRaster = RasterSH(areaRaster)
+      sharedData.zoneRaster = SharedRaster(zoneRaster)
+      sharedData.valueRaster = SharedRaster(valueRaster)
+      sharedData.areaRaster = SharedRaster(areaRaster)
 
       # 20201207
       # Create the pool.
@@ -364,6 +377,10 @@ class RasterFunc(WorkerBase):
         pool.close()
         pool.terminate()
       return (None,None,None)
+    finally:
+      # Release the shared rasters.
+      if not sharedData is None:
+        sharedData.release()
 
   #-----------------------------------------------------------------------------
   # Returns a tupe of dicts (meanDict,countDict,sumDict) with the mean of 
@@ -373,6 +390,7 @@ class RasterFunc(WorkerBase):
                 zoneRaster,valueRaster,
                 nrOfChunks=0):
     pool = None
+    sharedData = None
     try:
       # Check nrOfChunks.
       if nrOfChunks==0:
@@ -395,8 +413,8 @@ class RasterFunc(WorkerBase):
       # 20201207
       # Set shared rasters.
       sharedData = SharedData()
-      sharedData.zoneRaster = RasterSH(zoneRaster)
-      sharedData.valueRaster = RasterSH(valueRaster)
+      sharedData.zoneRaster = SharedRaster(zoneRaster)
+      sharedData.valueRaster = SharedRaster(valueRaster)
 
       # 20201207
       # Create the pool.
@@ -431,4 +449,8 @@ class RasterFunc(WorkerBase):
         pool.close()
         pool.terminate()
       return (None,None,None)
+    finally:
+      # Release the shared rasters.
+      if not sharedData is None:
+        sharedData.release()
 